@@ -0,0 +1,371 @@
+import asyncio
+import json
+import math
+import os
+import random
+import time
+import urllib.parse
+from datetime import datetime, timezone
+from znn_eth_uniswap_pool import ZnnEthUniswapPool
+from nom_data import NomData
+
+
+class FakeService(object):
+    # Minimal HTTP/1.1 server that stands in for an upstream API. Every
+    # request is answered by the handler after the configured latency. A
+    # share of the requests fails with an HTTP 503 or a dropped connection.
+
+    def __init__(self, name, handler, latency=0, jitter=0, error_rate=0, drop_rate=0):
+        self.name = name
+        self.handler = handler
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.drop_rate = drop_rate
+        self.server = None
+        self.port = None
+
+        self.requests = 0
+        self.errors = 0
+        self.drops = 0
+
+    async def start(self, host='127.0.0.1'):
+        self.server = await asyncio.start_server(self.__handle, host, 0)
+        self.port = self.server.sockets[0].getsockname()[1]
+        return f'http://{host}:{self.port}'
+
+    def close(self):
+        if self.server is not None:
+            self.server.close()
+
+    def get_stats(self):
+        return {'requests': self.requests, 'errors': self.errors, 'drops': self.drops}
+
+    async def __handle(self, reader, writer):
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b'\r\n', b'\n', b''):
+                        break
+                    name, _, value = line.decode('latin-1').partition(':')
+                    headers[name.strip().lower()] = value.strip()
+                content_length = int(headers.get('content-length', 0))
+                body = await reader.readexactly(content_length) if content_length > 0 else b''
+                method, target, _ = request_line.decode('latin-1').split()
+
+                self.requests = self.requests + 1
+                await asyncio.sleep(self.latency + random.uniform(0, self.jitter))
+
+                failure = random.random()
+                if failure < self.drop_rate:
+                    self.drops = self.drops + 1
+                    break
+                if failure < self.drop_rate + self.error_rate:
+                    self.errors = self.errors + 1
+                    status, data = 503, {}
+                else:
+                    status, data = self.handler(method, target, body)
+
+                response = json.dumps(data, separators=(',', ':')).encode()
+                writer.write((f'HTTP/1.1 {status} {"OK" if status == 200 else "Error"}\r\n'
+                              f'Content-Type: application/json\r\n'
+                              f'Content-Length: {len(response)}\r\n\r\n').encode('latin-1') + response)
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+
+class Recordings(object):
+    # Recorded responses that replace the synthetic ones. The directory holds
+    # one JSON file per response, named by service and call:
+    # node.<method>.json holds the JSON-RPC result of the method, paged lists
+    # are sliced by the requested page. etherscan.tokenbalance.json,
+    # etherscan.tokensupply.json, bitquery.dexTrades.json, coingecko.coins.json
+    # and coingecko.market_chart.json hold the full response bodies.
+
+    def __init__(self, directory=None):
+        self.responses = {}
+        if directory is None:
+            return
+        for file_name in os.listdir(directory):
+            if file_name.endswith('.json'):
+                with open(os.path.join(directory, file_name)) as f:
+                    self.responses[file_name[:-len('.json')]] = json.load(f)
+
+    def get(self, name):
+        return self.responses.get(name)
+
+
+class FakeNode(object):
+    # Answers the JSON-RPC calls of the refiner with synthetic data for the
+    # configured number of Pillars and Sentinels. The frontier advances by
+    # one momentum per height request and the producing Pillar's stats change
+    # with it, like on a live node within an epoch. With stakers every
+    # momentum also adds a stake entry, which adds a block to the staking
+    # contract's account chain.
+
+    PILLAR_COUNT_TOP_30 = 30
+
+    def __init__(self, pillar_count, sentinel_count, recordings, seed=0, staker_count=0):
+        self.pillar_count = pillar_count
+        self.sentinel_count = sentinel_count
+        self.recordings = recordings
+        self.height = 5000000
+
+        rnd = random.Random(seed)
+        self.rnd = rnd
+        self.pillars = []
+        for i in range(pillar_count):
+            # Delegated weight falls off with the rank like on mainnet
+            weight = int((15000 + 2000000 / (1 + i) ** 0.8 * rnd.uniform(0.8, 1.2)) * NomData.DECIMALS)
+            expected_momentums = 0 if i >= 1000 else rnd.randint(10, 40)
+            self.pillars.append({
+                'name': f'Pillar{i}',
+                'rank': i,
+                'type': 1,
+                'ownerAddress': f'z1qpillarowner{i:026d}',
+                'producerAddress': f'z1qpillarproducer{i:023d}',
+                'withdrawAddress': f'z1qpillarwithdraw{i:023d}',
+                'isRevocable': False,
+                'revokeCooldown': 0,
+                'revokeTimestamp': 0,
+                'giveMomentumRewardPercentage': rnd.choice((0, 10, 25, 50, 75, 100)),
+                'giveDelegateRewardPercentage': rnd.choice((0, 50, 75, 90, 100)),
+                'currentStats': {'producedMomentums': rnd.randint(0, expected_momentums),
+                                 'expectedMomentums': expected_momentums},
+                'weight': str(weight)
+            })
+        self.pillars.sort(key=lambda p: -int(p['weight']))
+        for rank, pillar in enumerate(self.pillars):
+            pillar['rank'] = rank
+
+        # Stake entries by address and the staking contract's account blocks
+        self.stakers = [f'z1qstaker{i:031d}' for i in range(staker_count)]
+        self.stake_entries = {}
+        self.stake_blocks = []
+        for address in self.stakers:
+            for _ in range(rnd.randint(1, 3)):
+                self.add_stake_entry(address)
+
+        self.methods = {
+            'ledger.getFrontierMomentum': self.get_frontier_momentum,
+            'stats.processInfo': lambda params: {'version': 'v0.0.7', 'commit': 'benchmark'},
+            'embedded.token.getByZts': self.get_token,
+            'ledger.getAccountInfoByAddress': self.get_account_info,
+            'ledger.getAccountBlocksByHeight': self.get_account_blocks,
+            'embedded.stake.getFrontierRewardByPage': lambda params: self.get_page(
+                [{'epoch': 1, 'znnAmount': '0', 'qsrAmount': str(12 * NomData.DECIMALS)}], params),
+            'embedded.stake.getEntriesByAddress': self.get_stake_entries,
+            'embedded.liquidity.getFrontierRewardByPage': lambda params: self.get_page(
+                [{'epoch': 1, 'znnAmount': str(3 * NomData.DECIMALS), 'qsrAmount': str(10 * NomData.DECIMALS)}], params),
+            'embedded.liquidity.getLiquidityStakeEntriesByAddress': lambda params: {
+                **self.get_page([{'amount': str(10 ** 18), 'weightedAmount': str(2 * 10 ** 18)}], params),
+                'totalAmount': str(10 ** 18), 'totalWeightedAmount': str(2 * 10 ** 18)},
+            'embedded.liquidity.getLiquidityInfo': lambda params: {
+                'administrator': 'z1qbenchmark', 'isHalted': False,
+                'znnReward': str(1000 * NomData.DECIMALS), 'qsrReward': str(5000 * NomData.DECIMALS)},
+            'embedded.sentinel.getAllActive': self.get_sentinels,
+            'embedded.pillar.getAll': lambda params: self.get_page(self.pillars, params)
+        }
+
+    def handle(self, method, target, body):
+        request = json.loads(body)
+        if isinstance(request, list):
+            return 200, [self.call(r) for r in request]
+        return 200, self.call(request)
+
+    def call(self, request):
+        method = request.get('method')
+        params = request.get('params', [])
+        recording = self.recordings.get(f'node.{method}')
+        if recording is not None:
+            result = self.get_page(recording['list'], params, recording.get(
+                'count')) if 'list' in recording and len(params) >= 2 else recording
+        elif method in self.methods:
+            result = self.methods[method](params)
+        else:
+            return {'jsonrpc': '2.0', 'id': request.get('id'),
+                    'error': {'code': -32601, 'message': f'the method {method} does not exist/is not available'}}
+        return {'jsonrpc': '2.0', 'id': request.get('id'), 'result': result}
+
+    def get_page(self, items, params, count=None):
+        # The page index and size are the last two parameters
+        page_index, page_size = params[-2], params[-1]
+        return {'count': len(items) if count is None else count,
+                'list': items[page_index * page_size:(page_index + 1) * page_size]}
+
+    def get_frontier_momentum(self, params):
+        self.height = self.height + 1
+        if len(self.pillars) > 0:
+            stats = self.pillars[self.height % min(len(self.pillars), self.PILLAR_COUNT_TOP_30)]['currentStats']
+            stats['producedMomentums'] = min(stats['producedMomentums'] + 1, stats['expectedMomentums'])
+        if len(self.stakers) > 0:
+            self.add_stake_entry(self.rnd.choice(self.stakers))
+        return {'height': self.height, 'timestamp': int(time.time()), 'hash': f'{self.height:064x}'}
+
+    def add_stake_entry(self, address):
+        months = self.rnd.randint(1, 12)
+        amount = self.rnd.randint(1, 10000) * NomData.DECIMALS
+        start = int(time.time())
+        self.stake_entries.setdefault(address, []).append({
+            'id': f'{len(self.stake_blocks):064x}',
+            'address': address,
+            'amount': str(amount),
+            'weightedAmount': str(amount * (9 + months) // 10),
+            'startTimestamp': start,
+            'expirationTimestamp': start + months * 30 * 24 * 60 * 60})
+        self.stake_blocks.append({'toAddress': NomData.STAKING_CONTRACT_ADDRESS,
+                                  'pairedAccountBlock': {'address': address}})
+
+    def get_token(self, params):
+        supply = 9800000 if params[0] == NomData.ZNN_ZTS_ID else 180000000
+        return {'tokenStandard': params[0], 'totalSupply': str(supply * NomData.DECIMALS), 'decimals': 8}
+
+    def get_account_info(self, params):
+        height = len(self.stake_blocks) if params[0] == NomData.STAKING_CONTRACT_ADDRESS else 0
+        staked_amount = sum(int(entry['amount']) for entries in self.stake_entries.values() for entry in entries)
+        return {'address': params[0], 'accountHeight': max(height, 1), 'balanceInfoMap': {
+            NomData.ZNN_ZTS_ID: {'balance': str(staked_amount if height > 0 else 4000000 * NomData.DECIMALS)},
+            NomData.ZNN_ETH_LP_ZTS_ID: {'balance': str(150 * 10 ** 18)}}}
+
+    def get_account_blocks(self, params):
+        # The parameters are the address, the start height and the number of blocks
+        address, height, count = params
+        blocks = self.stake_blocks if address == NomData.STAKING_CONTRACT_ADDRESS else []
+        return {'count': len(blocks), 'list': blocks[height - 1:height - 1 + count]}
+
+    def get_stake_entries(self, params):
+        entries = self.stake_entries.get(params[0])
+        if entries is None:
+            # The reference staking address
+            entries = [{'amount': str(1000 * NomData.DECIMALS),
+                        'weightedAmount': str(2000 * NomData.DECIMALS)}]
+        return {**self.get_page(entries, params),
+                'totalAmount': str(sum(int(entry['amount']) for entry in entries)),
+                'totalWeightedAmount': str(sum(int(entry['weightedAmount']) for entry in entries))}
+
+    def get_sentinels(self, params):
+        sentinels = [{'owner': f'z1qsentinelowner{i:025d}', 'active': True}
+                     for i in range(min(params[-1], self.sentinel_count))]
+        return {'count': self.sentinel_count, 'list': sentinels}
+
+
+class FakeEtherscan(object):
+
+    def __init__(self, recordings):
+        self.recordings = recordings
+
+    def handle(self, method, target, body):
+        query = urllib.parse.parse_qs(urllib.parse.urlsplit(target).query)
+        action = query.get('action', [''])[0]
+        recording = self.recordings.get(f'etherscan.{action}')
+        if recording is not None:
+            return 200, recording
+        if action == 'tokenbalance':
+            contract_address = query['contractaddress'][0].lower()
+            balance = 950 * 10 ** 18 if contract_address == ZnnEthUniswapPool.WETH_ADDRESS else 1500000 * 10 ** 8
+            return 200, {'status': '1', 'message': 'OK', 'result': str(balance)}
+        if action == 'tokensupply':
+            return 200, {'status': '1', 'message': 'OK', 'result': str(37000 * 10 ** 18)}
+        return 200, {'status': '0', 'message': 'NOTOK', 'result': 'Error! Invalid action'}
+
+
+class FakeBitquery(object):
+
+    def __init__(self, recordings):
+        self.recordings = recordings
+
+    def handle(self, method, target, body):
+        recording = self.recordings.get('bitquery.dexTrades')
+        if recording is not None:
+            return 200, recording
+
+        today = datetime.now(timezone.utc).toordinal()
+        trades = [{'date': {'date': datetime.fromordinal(today - i).strftime('%y-%m-%d')},
+                   'tradeAmount': 25000 + 1000 * i} for i in range(7)]
+        return 200, {'data': {'ethereum': {
+            'dexTrades': trades,
+            'address': [{'balances': [{'currency': {'symbol': 'wZNN'}, 'value': 1500000},
+                                      {'currency': {'symbol': 'WETH'}, 'value': 950}]}],
+            'startReserves': [{'arguments': [{'value': str(1450000 * 10 ** 8), 'argument': 'reserve0'},
+                                             {'value': str(980 * 10 ** 18), 'argument': 'reserve1'}],
+                               'block': {'height': 17000000}}],
+            'endReserves': [{'arguments': [{'value': str(1500000 * 10 ** 8), 'argument': 'reserve0'},
+                                           {'value': str(950 * 10 ** 18), 'argument': 'reserve1'}],
+                             'block': {'height': 17050000}}]}}}
+
+
+class FakeCoinGecko(object):
+
+    # Days of price history returned for days=max
+    MAX_HISTORY_DAYS = 1500
+
+    PRICES_USD = {'zenon-2': 1.75, 'ethereum': 1800}
+
+    def __init__(self, recordings):
+        self.recordings = recordings
+
+    def handle(self, method, target, body):
+        parts = urllib.parse.urlsplit(target)
+        query = urllib.parse.parse_qs(parts.query)
+        path = parts.path.rstrip('/').split('/')
+        if path[-1] == 'market_chart':
+            recording = self.recordings.get('coingecko.market_chart')
+            if recording is not None:
+                return 200, recording
+            days = query.get('days', ['max'])[0]
+            days = self.MAX_HISTORY_DAYS if days == 'max' else min(int(days), self.MAX_HISTORY_DAYS)
+            now = math.trunc(time.time()) * 1000
+            return 200, {'prices': [[now - i * 86400000, 1.75 + math.sin(i / 30)] for i in range(days, -1, -1)]}
+
+        recording = self.recordings.get('coingecko.coins')
+        if recording is not None:
+            return 200, recording
+        coin = path[-1]
+        if coin not in self.PRICES_USD:
+            return 404, {'error': 'coin not found'}
+        return 200, {'id': coin, 'market_data': {'current_price': {'usd': self.PRICES_USD[coin]}}}
+
+
+async def serve(options, connection):
+    recordings = Recordings(options.get('recordings'))
+    node = FakeNode(options['pillar_count'], options['sentinel_count'], recordings,
+                    staker_count=options.get('staker_count', 0))
+    handlers = [('node', node.handle) for _ in range(options.get('node_count', 1))] + [
+        ('etherscan', FakeEtherscan(recordings).handle),
+        ('bitquery', FakeBitquery(recordings).handle),
+        ('coingecko', FakeCoinGecko(recordings).handle)]
+
+    services = []
+    urls = {}
+    for name, handler in handlers:
+        latency = options.get(f'{name}_latency', options.get('latency', 0))
+        service = FakeService(name, handler, latency, options.get('jitter', 0),
+                              options.get('error_rate', 0), options.get('drop_rate', 0))
+        urls.setdefault(name, []).append(await service.start())
+        services.append(service)
+    connection.send(urls)
+
+    # Serve until the harness asks for the stats
+    await asyncio.get_running_loop().run_in_executor(None, connection.recv)
+    stats = {}
+    for service in services:
+        service.close()
+        service_stats = stats.setdefault(service.name, {'requests': 0, 'errors': 0, 'drops': 0})
+        for key, value in service.get_stats().items():
+            service_stats[key] = service_stats[key] + value
+    connection.send(stats)
+
+
+def run_fake_services(options, connection):
+    # Entry point of the fake services process. Sends the URLs of the services
+    # once they are listening, then serves until stats are requested.
+    asyncio.run(serve(options, connection))
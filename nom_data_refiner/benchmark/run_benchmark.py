@@ -0,0 +1,291 @@
+import argparse
+import asyncio
+import contextlib
+import json
+import multiprocessing
+import os
+import resource
+import sys
+import tempfile
+import time
+import tracemalloc
+from benchmark.fake_services import run_fake_services
+from utils.http_wrapper import HttpWrapper
+from main import Refiner, configure_http
+
+# Offline benchmark of the refresh path. The node, Etherscan, Bitquery and
+# CoinGecko are replaced by local fake services in a separate process, so
+# their work doesn't count towards the measured timings.
+#
+# Run from the nom_data_refiner directory:
+#   python -m benchmark.run_benchmark --pillars 10000 --latency 20 --cycles 20
+
+
+class Benchmark(object):
+    # Runs refresh cycles against the fake services and records the duration
+    # of each stage. The stages run one after the other so each can be timed
+    # on its own, the refiner itself runs the fetches concurrently.
+
+    STAGES = ('market_prices', 'market_history', 'pool_data',
+              'node_data', 'derived_data', 'outputs')
+
+    # Seconds after which a stage counts as failed
+    STAGE_TIMEOUT = 60
+
+    def __init__(self, refiner, warm_cache=False):
+        self.refiner = refiner
+        self.network = refiner.networks[0]
+        self.warm_cache = warm_cache
+        self.timings = {stage: [] for stage in self.STAGES + ('cycle',)}
+        self.errors = {stage: 0 for stage in self.STAGES}
+
+    async def run_cycle(self):
+        # Without a warm cache every cycle fetches the pool data again
+        if not self.warm_cache:
+            self.refiner.cache.entries = {}
+
+        start = time.perf_counter()
+        await self.__run_stage('market_prices', self.refiner.update_market_prices)
+        await self.__run_stage('market_history', self.refiner.update_market_history)
+        await self.__run_stage('pool_data', self.refiner.update_pool_data)
+        await self.__run_stage('node_data', self.network.update_node_data)
+        snapshot = await self.__run_stage('derived_data', self.network.update_derived_data)
+        if snapshot is not None:
+            await self.__run_stage('outputs', self.network.write_outputs, snapshot)
+        self.timings['cycle'].append(time.perf_counter() - start)
+
+    def reset(self):
+        for timings in self.timings.values():
+            timings.clear()
+        for stage in self.errors:
+            self.errors[stage] = 0
+
+    def get_report(self):
+        report = {}
+        for stage, timings in self.timings.items():
+            report[stage] = {
+                'p50': get_percentile(timings, 0.5),
+                'p90': get_percentile(timings, 0.9),
+                'p99': get_percentile(timings, 0.99),
+                'max': max(timings, default=0),
+                'errors': self.errors.get(stage, sum(self.errors.values()))
+            }
+        return report
+
+    async def __run_stage(self, stage, fn, *args):
+        start = time.perf_counter()
+        try:
+            r = fn(*args)
+            if asyncio.iscoroutine(r):
+                r = await asyncio.wait_for(r, self.STAGE_TIMEOUT)
+        except Exception as e:
+            print(f'Error: {stage}: {type(e).__name__}: {str(e)}', file=sys.stderr)
+            self.errors[stage] = self.errors[stage] + 1
+            r = None
+        self.timings[stage].append(time.perf_counter() - start)
+        return r
+
+
+def get_percentile(values, percentile):
+    if len(values) == 0:
+        return 0
+    values = sorted(values)
+    return values[min(int(len(values) * percentile), len(values) - 1)]
+
+
+def get_config(args, urls):
+    cfg = {}
+    if args.config is not None:
+        with open(args.config) as f:
+            cfg = json.load(f)
+    cfg.pop('networks', None)
+    cfg.update({
+        'node_urls_http': urls['node'],
+        'reference_staking_address': 'z1qbenchmarkstaker00000000000000000000000',
+        'reference_lp_address': 'z1qbenchmarkliquiditystaker00000000000000',
+        'bitquery_api_key': '',
+        'ether_scan_api_key': '',
+        'api_server_enabled': False,
+        'history_enabled': args.history,
+        'stake_index_enabled': args.stakers > 0
+    })
+    if args.incremental is not None:
+        cfg['incremental_refresh'] = args.incremental
+    return cfg
+
+
+def print_report(args, report, memory, service_stats):
+    print(f'Pillars: {args.pillars}, Sentinels: {args.sentinels}, nodes: {args.nodes}, '
+          f'cycles: {args.cycles}, latency: {args.latency}+{args.jitter}ms, '
+          f'error rate: {args.error_rate}, drop rate: {args.drop_rate}')
+    print(f'{"stage":<16}{"p50 ms":>10}{"p90 ms":>10}{"p99 ms":>10}{"max ms":>10}{"errors":>8}')
+    for stage, timings in report.items():
+        print(f'{stage:<16}' + ''.join(f'{timings[key] * 1000:>10.2f}' for key in (
+            'p50', 'p90', 'p99', 'max')) + f'{timings["errors"]:>8}')
+
+    traced = f'{memory["traced_peak_mb"]:.1f} MB allocated' if memory['traced_peak_mb'] is not None else 'allocations not traced'
+    print(f'Peak memory: {traced}, {memory["max_rss_mb"]:.1f} MB RSS')
+    for name, stats in service_stats.items():
+        print(f'{name}: {stats["requests"]} requests, {stats["errors"]} errors, {stats["drops"]} drops injected')
+
+
+def get_regressions(result, baseline, max_regression):
+    # Stages whose p50 or p90 is slower than the baseline by more than the allowed share
+    regressions = []
+    for stage, timings in result['stages'].items():
+        baseline_timings = baseline['stages'].get(stage)
+        if baseline_timings is None:
+            continue
+        for key in ('p50', 'p90'):
+            if timings[key] > baseline_timings[key] * (1 + max_regression):
+                regressions.append(
+                    f'{stage} {key}: {timings[key] * 1000:.2f} ms, baseline {baseline_timings[key] * 1000:.2f} ms')
+
+    traced_peak_mb = result['memory']['traced_peak_mb']
+    baseline_traced_peak_mb = baseline['memory'].get('traced_peak_mb')
+    if traced_peak_mb is not None and baseline_traced_peak_mb is not None and traced_peak_mb > baseline_traced_peak_mb * (1 + max_regression):
+        regressions.append(
+            f'peak memory: {traced_peak_mb:.1f} MB, baseline {baseline_traced_peak_mb:.1f} MB')
+    return regressions
+
+
+async def run(args, urls, data_store_dir):
+    cfg = get_config(args, urls)
+    configure_http(cfg)
+
+    # The traced peak covers the refiner's data from its creation on
+    if args.trace_memory:
+        tracemalloc.start()
+    refiner = Refiner(cfg, data_store_dir)
+
+    # Point the market and pool data at the fake services
+    refiner.market.BASE_URL = f'{urls["coingecko"][0]}/api/v3'
+    refiner.znn_eth_uniswap_pool.ETHER_SCAN_API_URL = f'{urls["etherscan"][0]}/api'
+    refiner.znn_eth_uniswap_pool.BITQUERY_API_URL = urls['bitquery'][0]
+    if args.engine != 'auto':
+        refiner.networks[0].nom_data.use_vectorized_pillar_engine = args.engine == 'vectorized'
+
+    benchmark = Benchmark(refiner, args.warm_cache)
+    output = open(os.devnull, 'w') if not args.verbose else sys.stdout
+    try:
+        with contextlib.redirect_stdout(output):
+            for _ in range(args.warmup):
+                await benchmark.run_cycle()
+
+            # Measure the incremental stake index updates, not the initial scan
+            nom_data = refiner.networks[0].nom_data
+            for stake_index in (nom_data.stake_index, nom_data.znn_eth_lp_stake_index):
+                if stake_index is not None and stake_index.build_task is not None:
+                    await stake_index.build_task
+            benchmark.reset()
+
+            for _ in range(args.cycles):
+                await benchmark.run_cycle()
+            traced_peak = tracemalloc.get_traced_memory()[1] if args.trace_memory else None
+            tracemalloc.stop()
+    finally:
+        HttpWrapper.close()
+        if output is not sys.stdout:
+            output.close()
+
+    # Linux reports the maximum resident set size in kilobytes
+    memory = {'traced_peak_mb': traced_peak / 1024 / 1024 if traced_peak is not None else None,
+              'max_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024}
+    return benchmark.get_report(), memory
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Benchmark the refresh path against local fake services')
+    parser.add_argument('--pillars', type=int, default=100,
+                        help='number of synthetic Pillars (100 to 100000)')
+    parser.add_argument('--sentinels', type=int, default=500,
+                        help='number of synthetic Sentinels')
+    parser.add_argument('--stakers', type=int, default=0,
+                        help='number of synthetic staking addresses, enables the stake index')
+    parser.add_argument('--nodes', type=int, default=1,
+                        help='number of fake node endpoints')
+    parser.add_argument('--cycles', type=int, default=10,
+                        help='number of measured refresh cycles')
+    parser.add_argument('--warmup', type=int, default=1,
+                        help='number of refresh cycles run before measuring')
+    parser.add_argument('--latency', type=float, default=0,
+                        help='latency of the fake services in milliseconds')
+    parser.add_argument('--node-latency', type=float,
+                        help='latency of the fake node in milliseconds, defaults to --latency')
+    parser.add_argument('--jitter', type=float, default=0,
+                        help='random extra latency of up to this many milliseconds')
+    parser.add_argument('--error-rate', type=float, default=0,
+                        help='share of requests answered with HTTP 503')
+    parser.add_argument('--drop-rate', type=float, default=0,
+                        help='share of requests whose connection is dropped')
+    parser.add_argument('--recordings',
+                        help='directory of recorded responses replayed instead of the synthetic ones')
+    parser.add_argument('--config',
+                        help='refiner config to benchmark, the node and API settings are replaced')
+    parser.add_argument('--engine', choices=('auto', 'scalar', 'vectorized'), default='auto',
+                        help='Pillar reward computation to use')
+    parser.add_argument('--incremental', action=argparse.BooleanOptionalAction,
+                        help='override the incremental_refresh setting')
+    parser.add_argument('--history', action=argparse.BooleanOptionalAction, default=False,
+                        help='append to the time series history on each cycle')
+    parser.add_argument('--warm-cache', action='store_true',
+                        help='keep the cached pool data between cycles')
+    parser.add_argument('--trace-memory', action='store_true',
+                        help='trace the peak of the allocated memory, slows down the cycles')
+    parser.add_argument('--json', help='write the results to this file')
+    parser.add_argument('--baseline',
+                        help='results file of an earlier run to compare against')
+    parser.add_argument('--max-regression', type=float, default=0.25,
+                        help='allowed slowdown against the baseline as a share')
+    parser.add_argument('--verbose', action='store_true',
+                        help='show the output of the refiner')
+    args = parser.parse_args()
+
+    options = {
+        'pillar_count': args.pillars,
+        'sentinel_count': args.sentinels,
+        'staker_count': args.stakers,
+        'node_count': args.nodes,
+        'latency': args.latency / 1000,
+        'jitter': args.jitter / 1000,
+        'error_rate': args.error_rate,
+        'drop_rate': args.drop_rate,
+        'recordings': args.recordings
+    }
+    if args.node_latency is not None:
+        options['node_latency'] = args.node_latency / 1000
+
+    connection, child_connection = multiprocessing.Pipe()
+    process = multiprocessing.Process(
+        target=run_fake_services, args=(options, child_connection), daemon=True)
+    process.start()
+    try:
+        urls = connection.recv()
+        with tempfile.TemporaryDirectory() as data_store_dir:
+            report, memory = asyncio.run(run(args, urls, data_store_dir))
+        connection.send('stats')
+        service_stats = connection.recv()
+    finally:
+        process.join(5)
+        if process.is_alive():
+            process.terminate()
+
+    print_report(args, report, memory, service_stats)
+    result = {'options': vars(args), 'stages': report,
+              'memory': memory, 'services': service_stats}
+    if args.json is not None:
+        with open(args.json, 'w') as f:
+            json.dump(result, f, indent=4)
+
+    if args.baseline is not None:
+        with open(args.baseline) as f:
+            regressions = get_regressions(result, json.load(f), args.max_regression)
+        for regression in regressions:
+            print(f'Regression: {regression}')
+        if len(regressions) > 0:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,77 @@
+import datetime
+
+
+class EmissionSchedule(object):
+    # Calculates the epoch, the emission month and the yearly ZNN and QSR
+    # reward emissions. The values for the current epoch are cached until
+    # the next epoch boundary.
+
+    GENESIS = datetime.datetime(
+        year=2021, month=11, day=24, hour=12, tzinfo=datetime.timezone.utc)
+    EPOCH_LENGTH_IN_DAYS = 1
+    DAYS_PER_MONTH = 30
+    MONTHS_PER_YEAR = 12
+
+    # Daily reward emissions
+    DAILY_ZNN_REWARDS_BY_MONTH = [
+        14400, 8640, 7200, 10080, 7200, 5760, 10080, 5760, 4320, 10080, 4320, 4320
+    ]
+    DAILY_QSR_REWARDS_BY_MONTH = [
+        20000, 20000, 20000, 20000, 15000, 15000, 15000, 5000, 5000, 5000, 5000,
+        5000
+    ]
+
+    def __init__(self):
+        self.epoch = 0
+        self.month = 0
+        self.yearly_znn_rewards = 0
+        self.yearly_qsr_rewards = 0
+        self.next_epoch_start = None
+
+    def update(self, now=None):
+        # Only recalculate the values once the next epoch has started
+        now = datetime.datetime.now(datetime.timezone.utc) if now is None else now
+        if self.next_epoch_start is not None and now < self.next_epoch_start and now >= self.get_epoch_start(self.epoch):
+            return
+
+        self.epoch = self.get_epoch(now)
+        self.month = self.get_month(self.epoch)
+        self.yearly_znn_rewards = self.get_yearly_znn_rewards(self.month)
+        self.yearly_qsr_rewards = self.get_yearly_qsr_rewards(self.month)
+        self.next_epoch_start = self.get_epoch_start(self.epoch + 1)
+
+    def get_epoch(self, date):
+        return (date - self.GENESIS).days // self.EPOCH_LENGTH_IN_DAYS
+
+    def get_epoch_start(self, epoch):
+        return self.GENESIS + datetime.timedelta(days=epoch * self.EPOCH_LENGTH_IN_DAYS)
+
+    def get_month(self, epoch):
+        return max(0, epoch * self.EPOCH_LENGTH_IN_DAYS // self.DAYS_PER_MONTH)
+
+    def get_yearly_znn_rewards(self, month):
+        # The emissions stay at the rate of the last month of the schedule
+        month = min(month, len(self.DAILY_ZNN_REWARDS_BY_MONTH) - 1)
+        return self.DAILY_ZNN_REWARDS_BY_MONTH[month] * self.DAYS_PER_MONTH * self.MONTHS_PER_YEAR
+
+    def get_yearly_qsr_rewards(self, month):
+        month = min(month, len(self.DAILY_QSR_REWARDS_BY_MONTH) - 1)
+        return self.DAILY_QSR_REWARDS_BY_MONTH[month] * self.DAYS_PER_MONTH * self.MONTHS_PER_YEAR
+
+    def get_schedule(self, start, end):
+        # Returns the emissions of each epoch that starts within [start, end)
+        schedule = []
+        epoch = max(0, self.get_epoch(start))
+        if self.get_epoch_start(epoch) < start:
+            epoch = epoch + 1
+        while self.get_epoch_start(epoch) < end:
+            month = self.get_month(epoch)
+            schedule.append({
+                'epoch': epoch,
+                'start': self.get_epoch_start(epoch),
+                'month': month,
+                'yearlyZnnRewards': self.get_yearly_znn_rewards(month),
+                'yearlyQsrRewards': self.get_yearly_qsr_rewards(month),
+            })
+            epoch = epoch + 1
+        return schedule
@@ -6,6 +6,16 @@ import math
 import datetime
 from znn_eth_uniswap_pool import ZnnEthUniswapPool
 from utils.market_wrapper import MarketWrapper
+from utils.http_wrapper import HttpWrapper
+from utils.price_history_store import PriceHistoryStore
+from utils.cache import Cache
+from utils.scheduler import Scheduler
+from utils.output_writer import OutputWriter
+from utils.api_server import ApiServer
+from utils.change_feed import ChangeFeed
+from utils.time_series_store import TimeSeriesStore
+from utils.metrics import Metrics
+from utils.momentum_subscription import MomentumSubscription
 from nom_data import NomData
 
 
@@ -21,7 +31,7 @@ def write_to_file_as_json(data, file_name):
         json.dump(data, outfile, indent=4)
 
 
-def write_nom_data_to_file(data, file_name):
+def get_nom_data_json(data):
 
     # Convert NoM data to JSON
     json_data = {
@@ -36,6 +46,7 @@ def write_nom_data_to_file(data, file_name):
         },
         'znnEthLpInfo': {
             'avgStakingLockupTimeInDays': data.avg_znn_eth_lp_lockup_time_in_days,
+            'lockupDistribution': dict(data.znn_eth_lp_lockup_distribution),
             'participationRate':  data.znn_eth_lp_program_participation_rate,
             'totalStaked': {
                 'weightedAmount': data.total_staked_znn_eth_lp['weighted_amount'],
@@ -43,6 +54,7 @@ def write_nom_data_to_file(data, file_name):
             },
         },
         'avgStakingLockupTimeInDays': data.avg_staking_lockup_time_in_days,
+        'stakingLockupDistribution': dict(data.staking_lockup_distribution),
         'totalDelegatedZnn': data.total_delegated_znn,
         'sentinelCount': data.sentinel_count,
         'pillarCount': data.pillar_count,
@@ -65,43 +77,18 @@ def write_nom_data_to_file(data, file_name):
         'orbitalRewardMultiplier': data.orbital_multiplier
     }
 
-    # Dump data to file
-    write_to_file_as_json(json_data, file_name)
+    return json_data
 
 
-def write_pillar_data_to_file(data, file_name):
+def get_pillar_data_json(data):
 
     # Convert Pillar data to JSON
-    json_data = {}
-    for pillar in data.pillars:
-        json_data[pillar.owner_address] = {
-            'name': pillar.name,
-            'rank': pillar.rank,
-            # 'type': pillar.type,
-            # 'ownerAddress': pillar.owner_address,
-            # 'producerAddress': pillar.producer_address,
-            # 'withdrawAddress': pillar.withdraw_address,
-            # 'isRevocable': pillar.is_revocable,
-            # 'revokeCooldown': pillar.revoke_cooldown,
-            # 'revokeTimestamp': pillar.revoke_timestamp,
-            'giveMomentumRewardPercentage': pillar.give_momentum_reward_percentage,
-            'giveDelegateRewardPercentage': pillar.give_delegate_reward_percentage,
-            'producedMomentums': pillar.produced_momentums,
-            'expectedMomentums': pillar.expected_momentums,
-            'weight': pillar.weight,
-            'epochMomentumRewards': pillar.epoch_momentum_rewards,
-            'epochDelegateRewards': pillar.epoch_delegate_rewards,
-            'apr': pillar.apr,
-            'delegateApr': pillar.delegate_apr,
-            # 'timestamp': math.trunc(time.time()),
-            # 'momentumHeight': data.momentum_height
-        }
-
-    # Dump data to file
-    write_to_file_as_json(json_data, file_name)
-
-
-def write_pool_data_to_file(data, file_name):
+    json_data = dict(data.pillars)
+
+    return json_data
+
+
+def get_pool_data_json(data):
 
     # Convert data to JSON
     json_data = {
@@ -114,25 +101,484 @@ def write_pool_data_to_file(data, file_name):
         'lpTokenTotalSupply': data.lp_token_total_supply
     }
 
-    # Dump data to file
-    write_to_file_as_json(json_data, file_name)
-
-
-def history_list_to_map(l):
-    m = {}
-    for e in l:
-        m[e[0]] = e[1]
-    return m
-
+    return json_data
+
+
+def get_history_values(data, pool_data):
+    # Values of the NoM data, the Pillar data and the pool data that are kept in the history
+    values = {
+        'staking_apr': data.staking_apr,
+        'delegate_apr': data.delegate_apr,
+        'lp_apr': data.lp_apr,
+        'sentinel_apr': data.sentinel_apr,
+        'pillar_apr_top_30': data.pillar_apr_top_30,
+        'pillar_apr_not_top_30': data.pillar_apr_not_top_30,
+        'znn_price_usd': data.znn_price_usd,
+        'qsr_price_usd': data.qsr_price_usd,
+        'total_delegated_znn': data.total_delegated_znn,
+        'pool.liquidity_usd': pool_data.liquidity_usd,
+        'pool.impermanent_loss': pool_data.impermanent_loss,
+        'pool.yearly_trading_fees_usd': pool_data.yearly_trading_fees_usd
+    }
+    for owner_address, pillar in data.pillars.items():
+        values[f'pillar.{owner_address}.apr'] = pillar['apr']
+        values[f'pillar.{owner_address}.delegate_apr'] = pillar['delegateApr']
+        values[f'pillar.{owner_address}.produced_momentums'] = pillar['producedMomentums']
+        values[f'pillar.{owner_address}.weight'] = pillar['weight'] / \
+            NomData.DECIMALS
+    return values
+
+
+def get_history_days_to_fetch(price_history_store, coin, currency):
+    # Fetch the whole history if nothing is stored yet, else only the days since the last stored point
+    last_timestamp = price_history_store.get_last_timestamp(coin, currency)
+    if last_timestamp is None:
+        return 'max'
+    return math.ceil((time.time() - last_timestamp / 1000) / 86400) + 1
+
+
+def configure_http(cfg):
+    HttpWrapper.configure(
+        max_concurrency=cfg.get(
+            'http_max_concurrency', HttpWrapper.DEFAULT_MAX_CONCURRENCY),
+        pool_size=cfg.get('http_pool_size', HttpWrapper.DEFAULT_POOL_SIZE),
+        keep_alive_timeout=cfg.get('http_keep_alive_timeout', HttpWrapper.DEFAULT_KEEP_ALIVE_TIMEOUT),
+        connect_timeout=cfg.get('http_connect_timeout', HttpWrapper.DEFAULT_CONNECT_TIMEOUT),
+        read_timeout=cfg.get('http_read_timeout', HttpWrapper.DEFAULT_READ_TIMEOUT),
+        max_retries=cfg.get('http_max_retries', HttpWrapper.DEFAULT_MAX_RETRIES),
+        circuit_failure_threshold=cfg.get(
+            'http_circuit_failure_threshold', HttpWrapper.DEFAULT_CIRCUIT_FAILURE_THRESHOLD),
+        circuit_reset_timeout=cfg.get('http_circuit_reset_timeout', HttpWrapper.DEFAULT_CIRCUIT_RESET_TIMEOUT))
+
+
+def get_network_configs(cfg, data_store_dir):
+    # Without a list of networks the top level node settings are used as a single network
+    if 'networks' not in cfg:
+        return [{
+            'name': 'default',
+            'node_urls_http': cfg.get('node_urls_http', [cfg.get('node_url_http')]),
+            'node_urls_ws': cfg.get('node_urls_ws', [cfg['node_url_ws']] if 'node_url_ws' in cfg else []),
+            'reference_staking_address': cfg['reference_staking_address'],
+            'reference_lp_address': cfg['reference_lp_address'],
+            'output_dir': data_store_dir
+        }]
+
+    networks = []
+    for network in cfg['networks']:
+        networks.append({
+            'name': network['name'],
+            'node_urls_http': network.get('node_urls_http', [network.get('node_url_http')]),
+            'node_urls_ws': network.get('node_urls_ws', [network['node_url_ws']] if 'node_url_ws' in network else []),
+            'reference_staking_address': network.get('reference_staking_address', ''),
+            'reference_lp_address': network.get('reference_lp_address', ''),
+            'output_dir': os.path.join(data_store_dir, network.get('output_dir', network['name']))
+        })
+    return networks
+
+
+class NetworkRefiner(object):
+    # Refreshes the node data of one network and writes the network's
+    # outputs. The market and pool data are shared by all networks.
+
+    # Seconds without a momentum notification after which the node is polled again
+    SUBSCRIPTION_STALE_TIMEOUT = 30
+
+    def __init__(self, refiner, network_cfg, api_prefix=''):
+        self.refiner = refiner
+        self.name = network_cfg['name']
+        self.api_prefix = api_prefix
+        self.node_urls = network_cfg['node_urls_http']
+        self.reference_staking_address = network_cfg['reference_staking_address']
+        self.reference_lp_address = network_cfg['reference_lp_address']
+        self.output_dir = network_cfg['output_dir']
+        os.makedirs(self.output_dir, exist_ok=True)
+
+        self.nom_data = NomData()
+        self.node_data_updated = False
+
+        # Index all stake entries for the exact total weighted stake
+        if refiner.cfg.get('stake_index_enabled', False):
+            self.nom_data.enable_stake_indexes(f'{self.output_dir}/stake_index')
+
+        # Node data updates don't overlap, whether polled or triggered by momentums.
+        # The derived data and the outputs are only updated between node data
+        # updates, so they never see a partly updated node state.
+        self.node_data_lock = asyncio.Lock()
+
+        # With a momentum subscription the node data is updated on new momentums.
+        # The node is only polled while the subscription is down.
+        self.subscription = None
+        self.momentum_received = asyncio.Event()
+        if refiner.cfg.get('node_subscription_enabled', False) and len(network_cfg['node_urls_ws']) > 0:
+            if MomentumSubscription.AVAILABLE:
+                self.subscription = MomentumSubscription(
+                    network_cfg['node_urls_ws'], lambda height: self.momentum_received.set())
+            else:
+                print('websockets is not installed, polling the node instead')
+
+        # Duration of the node data update since the last output update
+        self.node_data_duration = 0
+
+        # Streams the changes of the network's data to API server clients
+        self.change_feed = None
+        if refiner.api_server is not None:
+            self.change_feed = ChangeFeed(refiner.cfg.get(
+                'change_feed_apr_threshold', refiner.DEFAULT_CHANGE_FEED_APR_THRESHOLD))
+            refiner.api_server.set_feed(f'{api_prefix}/events', self.change_feed)
+
+        # Keeps the history of the APRs, the Pillar stats and the pool metrics
+        self.history_store = None
+        if refiner.cfg.get('history_enabled', False):
+            self.history_store = TimeSeriesStore(f'{self.output_dir}/history',
+                                                 refiner.cfg.get('history_raw_retention_days', TimeSeriesStore.DEFAULT_RAW_RETENTION_DAYS))
+            if refiner.api_server is not None:
+                refiner.api_server.set_handler(
+                    f'{api_prefix}/history', self.get_history)
+
+        # Set when an input of the network's derived data has changed
+        self.inputs_changed = asyncio.Event()
+
+    async def update_node_data(self):
+        async with self.node_data_lock:
+            start = time.perf_counter()
+            changed = await self.nom_data.update_node_data(node_url=self.node_urls,
+                                                           reference_staking_address=self.reference_staking_address,
+                                                           reference_lp_address=self.reference_lp_address,
+                                                           incremental=self.refiner.incremental)
+            self.node_data_duration = self.node_data_duration + \
+                time.perf_counter() - start
+            self.node_data_updated = True
+            if changed:
+                self.inputs_changed.set()
+
+    async def poll_node_data(self):
+        # Polling is skipped while momentums arrive through the subscription
+        if self.subscription is not None and self.subscription.is_live(self.SUBSCRIPTION_STALE_TIMEOUT):
+            return
+        await self.update_node_data()
+
+    async def update_node_data_on_momentums(self):
+        # Momentums that arrive within the debounce delay, or during an
+        # update, are coalesced into a single update
+        while True:
+            await self.momentum_received.wait()
+            await asyncio.sleep(self.refiner.node_subscription_debounce)
+            self.momentum_received.clear()
+            try:
+                await self.update_node_data()
+            except Exception as e:
+                print(f'Error: update_node_data_on_momentums: {self.name}: {str(e)}')
+
+    async def update_outputs(self):
+        refiner = self.refiner
+        while True:
+            await self.inputs_changed.wait()
+            self.inputs_changed.clear()
+
+            # Wait until every input has been updated at least once
+            if not refiner.pool_updated or not self.node_data_updated:
+                continue
+
+            async with self.node_data_lock:
+                print(f'{str(datetime.datetime.now())}: Updating {self.name} outputs')
+                start = time.perf_counter()
+                try:
+                    snapshot = self.update_derived_data()
+                    self.write_outputs(snapshot)
+                except Exception as e:
+                    print(f'Error: update_outputs: {self.name}: {str(e)}')
+                    continue
+                self.__record_cycle(snapshot, time.perf_counter() - start)
+
+    def update_derived_data(self):
+        refiner = self.refiner
+        return self.nom_data.update_derived_data(znn_price_usd=refiner.znn_price,
+                                                 qsr_price_usd=refiner.qsr_price,
+                                                 znn_eth_uniswap_pool=refiner.pool_snapshot,
+                                                 incremental=refiner.incremental)
+
+    def write_outputs(self, snapshot):
+        # Write pool data
+        self.__publish('znn_eth_pool_data.json',
+                       get_pool_data_json(self.refiner.pool_snapshot))
+
+        if not self.nom_data.changed:
+            return
+
+        # Write NoM data
+        nom_data_json = get_nom_data_json(snapshot)
+        self.__publish('nom_data.json', nom_data_json)
+
+        # Write Pillar data
+        self.__publish('pillar_data.json', get_pillar_data_json(snapshot))
+
+        # Serve the data of each Pillar by owner address
+        if self.refiner.api_server is not None:
+            self.refiner.api_server.set_group(
+                f'{self.api_prefix}/pillars', snapshot.pillars)
+
+        # Append to the history
+        if self.history_store is not None:
+            self.history_store.append(time.time(), get_history_values(
+                snapshot, self.refiner.pool_snapshot))
+
+        # Push the changes to the change feed subscribers
+        if self.change_feed is not None:
+            self.change_feed.publish(
+                snapshot.momentum_height, nom_data_json, snapshot.pillars)
+
+    def __record_cycle(self, snapshot, outputs_duration):
+        # A cycle is a node data update and the output update it triggers
+        cycle_duration = self.node_data_duration + outputs_duration
+        momentum_lag = max(0, self.nom_data.rpc.node_pool.get_max_height() -
+                           snapshot.momentum_height)
+        Metrics.observe('cycle_duration_seconds',
+                        cycle_duration, network=self.name)
+        Metrics.set('momentum_height', snapshot.momentum_height, network=self.name)
+        Metrics.set('momentum_lag', momentum_lag, network=self.name)
+
+        # Log the cycle as one JSON line
+        if self.refiner.metrics_log_enabled:
+            print(json.dumps({
+                'timestamp': math.trunc(time.time()),
+                'network': self.name,
+                'momentumHeight': snapshot.momentum_height,
+                'momentumLag': momentum_lag,
+                'changed': self.nom_data.changed,
+                'cycleMs': round(cycle_duration * 1000, 2),
+                'nodeDataMs': round(self.node_data_duration * 1000, 2),
+                'outputsMs': round(outputs_duration * 1000, 2),
+                'stepsMs': {step: round(duration * 1000, 2) for step, duration in self.nom_data.step_durations.items()}
+            }))
+
+        self.node_data_duration = 0
+        self.nom_data.step_durations.clear()
+
+    def get_history(self, params):
+        # Query parameters: series and either days (default 30) or start and end timestamps in seconds.
+        # Without a series the names of the series are returned. Invalid ranges raise ValueError.
+        if 'series' not in params:
+            return {'series': self.history_store.get_series_names(params.get('prefix', [''])[0])}
+        try:
+            name = params['series'][0]
+            end = int(params['end'][0]) if 'end' in params else int(time.time())
+            start = int(params['start'][0]) if 'start' in params else end - \
+                int(float(params.get('days', ['30'])[0]) * 86400)
+        except OverflowError:
+            raise ValueError('Invalid range')
+        if start >= end:
+            raise ValueError('Invalid range')
+        return {'series': name, 'start': start, 'end': end,
+                'points': self.history_store.get_range(name, start, end)}
+
+    def __publish(self, file_name, data):
+        # Write the data to the output file and/or serve it from the API server
+        if self.refiner.write_output_files:
+            self.refiner.output_writer.write(
+                data, f'{self.output_dir}/{file_name}')
+        if self.refiner.api_server is not None:
+            self.refiner.api_server.set(f'{self.api_prefix}/{file_name}', data)
+
+
+class Refiner(object):
+    # Refreshes each data source as an independent task on its own interval
+    # and recomputes the derived data whenever one of its inputs changes.
+    # The market and pool data are fetched once and shared by all networks.
+
+    # Default refresh intervals in seconds
+    DEFAULT_NODE_REFRESH_INTERVAL = 10
+    DEFAULT_MARKET_PRICES_REFRESH_INTERVAL = 30
+    DEFAULT_MARKET_HISTORY_REFRESH_INTERVAL = 600
+    DEFAULT_POOL_REFRESH_INTERVAL = 60
+
+    DEFAULT_API_SERVER_HOST = '127.0.0.1'
+    DEFAULT_API_SERVER_PORT = 8080
+
+    # Minimum APR change in percentage points that is pushed to the change feed
+    DEFAULT_CHANGE_FEED_APR_THRESHOLD = 0.01
+
+    # Seconds to wait for further momentums before updating on a new momentum
+    DEFAULT_NODE_SUBSCRIPTION_DEBOUNCE = 0.25
+
+    MARKET_HISTORY_CURRENCIES = ['usd', 'eur', 'gbp', 'cad', 'aud']
+
+    def __init__(self, cfg, data_store_dir):
+        self.cfg = cfg
+        self.data_store_dir = data_store_dir
+
+        # In incremental mode unchanged data is neither recomputed nor rewritten
+        self.incremental = cfg.get('incremental_refresh', False)
+
+        self.node_subscription_debounce = cfg.get(
+            'node_subscription_debounce', self.DEFAULT_NODE_SUBSCRIPTION_DEBOUNCE)
+
+        # Writes the output files atomically in the configured encoding
+        self.output_writer = OutputWriter(encoding=cfg.get('output_encoding', OutputWriter.ENCODING_PRETTY),
+                                          write_gzip=cfg.get(
+                                              'output_gzip', False),
+                                          write_brotli=cfg.get(
+                                              'output_brotli', False),
+                                          only_if_changed=self.incremental)
+
+        # The outputs can be written to files and/or served from memory by the API server
+        self.write_output_files = cfg.get('write_output_files', True)
+        self.api_server = None
+        if cfg.get('api_server_enabled', False):
+            self.api_server = ApiServer(cfg.get('api_server_host', self.DEFAULT_API_SERVER_HOST),
+                                        cfg.get('api_server_port',
+                                                self.DEFAULT_API_SERVER_PORT),
+                                        self.output_writer.encode)
+
+            # Serve the metrics in the Prometheus text format
+            if cfg.get('metrics_enabled', True):
+                self.api_server.set_handler(
+                    '/metrics', lambda params: Metrics.render(), Metrics.CONTENT_TYPE)
+
+        # Log a JSON line with the timings of each cycle
+        self.metrics_log_enabled = cfg.get('metrics_log_enabled', False)
+
+        # Cached upstream data, kept in memory and snapshotted to disk for restarts
+        self.cache = Cache(f'{data_store_dir}/cache_snapshot.json')
+
+        self.market = MarketWrapper()
+        self.znn_eth_uniswap_pool = ZnnEthUniswapPool()
+
+        # Latest pool data, read by the derived data and the outputs of every network
+        self.pool_snapshot = self.znn_eth_uniswap_pool.snapshot
+
+        # With several networks the API paths are prefixed with the network name
+        network_cfgs = get_network_configs(cfg, data_store_dir)
+        self.networks = [NetworkRefiner(self, network_cfg, f'/{network_cfg["name"]}' if len(network_cfgs) > 1 else '')
+                         for network_cfg in network_cfgs]
+
+        self.znn_price = None
+        self.qsr_price = None
+        self.eth_price = None
+        self.pool_updated = False
+
+        self.market_prices_available = asyncio.Event()
+
+        self.scheduler = Scheduler()
+        self.scheduler.add('Market prices update', self.update_market_prices,
+                           cfg.get('market_prices_refresh_interval', self.DEFAULT_MARKET_PRICES_REFRESH_INTERVAL))
+        self.scheduler.add('Market history update', self.update_market_history,
+                           cfg.get('market_history_refresh_interval', self.DEFAULT_MARKET_HISTORY_REFRESH_INTERVAL))
+        self.scheduler.add('Pool data update', self.update_pool_data,
+                           cfg.get('pool_refresh_interval', self.DEFAULT_POOL_REFRESH_INTERVAL))
+        for network in self.networks:
+            self.scheduler.add(f'{network.name} node data update', network.poll_node_data,
+                               cfg.get('node_refresh_interval', self.DEFAULT_NODE_REFRESH_INTERVAL))
+
+    async def run(self):
+        if self.api_server is not None:
+            await self.api_server.start()
+        tasks = [self.scheduler.run()]
+        for network in self.networks:
+            tasks.append(network.update_outputs())
+            if network.subscription is not None:
+                tasks.append(network.subscription.run())
+                tasks.append(network.update_node_data_on_momentums())
+        await asyncio.gather(*tasks)
+
+    def __set_inputs_changed(self):
+        # The market and pool data are inputs of every network
+        for network in self.networks:
+            network.inputs_changed.set()
+
+    async def update_market_prices(self):
+        znn_price = await self.market.get_price_usd(coin='zenon-2')
+        qsr_price = round(znn_price / 10, 2)
+        eth_price = await self.market.get_price_usd(coin='ethereum')
+
+        # If bad response use cached price data, else cache the new data.
+        if znn_price == 0 or eth_price == 0:
+            if self.znn_price is not None:
+                raise Exception('Unable to get market prices')
+
+            market_cache = self.cache.get('market')
+
+            # Use fallback data if nothing has been cached yet
+            if market_cache is None:
+                market_cache = {'znn_price_usd': 1.75,
+                                'qsr_price_usd': 0.175, 'eth_price_usd': 1800}
+
+            znn_price = market_cache['znn_price_usd']
+            qsr_price = market_cache['qsr_price_usd']
+            eth_price = market_cache['eth_price_usd']
+        else:
+            self.cache.set('market', {'znn_price_usd': znn_price,
+                                      'qsr_price_usd': qsr_price, 'eth_price_usd': eth_price})
+
+        if (znn_price, qsr_price, eth_price) != (self.znn_price, self.qsr_price, self.eth_price):
+            self.znn_price = znn_price
+            self.qsr_price = qsr_price
+            self.eth_price = eth_price
+            self.pool_snapshot = self.znn_eth_uniswap_pool.update_prices(
+                znn_price, eth_price)
+            self.market_prices_available.set()
+            self.__set_inputs_changed()
+
+    async def update_market_history(self):
+        # Open the market history store. Import the former JSON cache if the store is empty.
+        price_history_store = PriceHistoryStore(
+            f'{self.data_store_dir}/market_history')
+        if price_history_store.get_refresh_timestamp('znn') == 0 and os.path.exists(f'{self.data_store_dir}/market_history_cache.json'):
+            price_history_store.import_json(read_file(
+                f'{self.data_store_dir}/market_history_cache.json'))
+
+        try:
+            print('Updating market history cache')
+            currencies = self.MARKET_HISTORY_CURRENCIES
+            histories = await asyncio.gather(
+                *[self.market.get_price_history(coin='zenon-2', currency=currency,
+                                                days=get_history_days_to_fetch(price_history_store, 'znn', currency))
+                  for currency in currencies])
+            if not all(len(history) > 0 for history in histories):
+                raise Exception('Unable to update market history cache')
+
+            for currency, history in zip(currencies, histories):
+                price_history_store.merge('znn', currency, history)
+            price_history_store.set_refresh_timestamp(
+                'znn', math.trunc(time.time()))
+
+            # Export the history as JSON if requested
+            if self.cfg.get('export_market_history_json', False):
+                write_to_file_as_json(price_history_store.export_json('znn', currencies),
+                                      f'{self.data_store_dir}/market_history_cache.json')
+        finally:
+            price_history_store.close()
+
+    async def update_pool_data(self):
+        await self.market_prices_available.wait()
+
+        previous_pool_snapshot = self.pool_snapshot
+        pool_snapshot = await self.znn_eth_uniswap_pool.update(self.cache, self.znn_price, self.eth_price,
+                                                               self.cfg['bitquery_api_key'], self.cfg['ether_scan_api_key'])
+
+        # Market prices that arrived during the update are newer than the ones the update started with
+        if (pool_snapshot.wznn_price_usd, pool_snapshot.weth_price_usd) != (self.znn_price, self.eth_price):
+            pool_snapshot = self.znn_eth_uniswap_pool.update_prices(
+                self.znn_price, self.eth_price)
+        self.pool_snapshot = pool_snapshot
+
+        # Write the cache to disk if it's due
+        self.cache.save_snapshot()
+
+        self.pool_updated = True
+        if pool_snapshot != previous_pool_snapshot:
+            self.__set_inputs_changed()
 
-async def update():
 
+async def main():
     # Get file path
     path = os.path.dirname(os.path.abspath(__file__))
 
     # Read config
     cfg = read_file(f'{path}/config/config.json')
 
+    # Configure HTTP concurrency, connection pooling, timeouts and retries
+    configure_http(cfg)
+
     # Data store directory
     DATA_STORE_DIR = f'{path}/data_store'
 
@@ -140,85 +586,8 @@ async def update():
     if not os.path.exists(DATA_STORE_DIR):
         os.makedirs(DATA_STORE_DIR, exist_ok=True)
 
-    # Check if market cache exists. If not, create fallback data.
-    if not os.path.exists(f'{DATA_STORE_DIR}/market_cache.json'):
-        write_to_file_as_json(
-            {'timestamp': math.trunc(time.time()), 'znn_price_usd': 1.75, 'qsr_price_usd': 0.175, 'eth_price_usd': 1800}, f'{DATA_STORE_DIR}/market_cache.json')
-
-    # Check if market history cache exists. If not, create it.
-    if not os.path.exists(f'{DATA_STORE_DIR}/market_history_cache.json'):
-        write_to_file_as_json(
-            {'znn': {'timestamp': 0, 'usd': [], 'eur': [], 'gbp': [], 'cad': [], 'aud': []}, }, f'{DATA_STORE_DIR}/market_history_cache.json')
-
-    # Get coin prices.
-    market = MarketWrapper()
-    znn_price = await market.get_price_usd(coin='zenon-2')
-    qsr_price = round(znn_price / 10, 2)
-    eth_price = await market.get_price_usd(coin='ethereum')
-
-    # If bad response use cached price data, else cache the new data.
-    if znn_price == 0 or eth_price == 0:
-        market_cache = read_file(
-            f'{DATA_STORE_DIR}/market_cache.json')
-        znn_price = market_cache['znn_price_usd']
-        qsr_price = market_cache['qsr_price_usd']
-        eth_price = market_cache['eth_price_usd']
-    else:
-        write_to_file_as_json({'timestamp': math.trunc(time.time()), 'znn_price_usd': znn_price, 'qsr_price_usd': qsr_price, 'eth_price_usd': eth_price},
-                              f'{DATA_STORE_DIR}/market_cache.json')
-
-    # Update price history data
-    market_history_cache = read_file(
-        f'{DATA_STORE_DIR}/market_history_cache.json')
-    refresh_interval_secs = 600  # 10 minutes
-
-    if market_history_cache['znn']['timestamp'] + refresh_interval_secs < math.trunc(time.time()):
-        print('Updating market history cache')
-        znn_usd = await market.get_price_history(coin='zenon-2', currency='usd')
-        znn_eur = await market.get_price_history(coin='zenon-2', currency='eur')
-        znn_gbp = await market.get_price_history(coin='zenon-2', currency='gbp')
-        znn_cad = await market.get_price_history(coin='zenon-2', currency='cad')
-        znn_aud = await market.get_price_history(coin='zenon-2', currency='aud')
-        if len(znn_usd) > 0 and len(znn_eur) > 0 and len(znn_gbp) > 0 and len(znn_cad) > 0 and len(znn_aud) > 0:
-            write_to_file_as_json({'znn': {'timestamp': math.trunc(time.time()), 'usd': history_list_to_map(znn_usd),
-                                           'eur': history_list_to_map(znn_eur), 'gbp': history_list_to_map(znn_gbp),
-                                           'cad': history_list_to_map(znn_cad), 'aud': history_list_to_map(znn_aud)}, },
-                                  f'{DATA_STORE_DIR}/market_history_cache.json')
-        else:
-            print('Unable to update market history cache')
-
-    # Update pool data
-    znn_eth_uniswap_pool = ZnnEthUniswapPool()
-    await znn_eth_uniswap_pool.update(DATA_STORE_DIR, znn_price, eth_price, cfg['bitquery_api_key'], cfg['ether_scan_api_key'])
-
-    # Update NoM data
-    nom_data = NomData()
-    await nom_data.update(node_url=cfg['node_url_http'],
-                          reference_staking_address=cfg['reference_staking_address'],
-                          reference_lp_address=cfg['reference_lp_address'],
-                          znn_price_usd=znn_price,
-                          qsr_price_usd=qsr_price,
-                          znn_eth_uniswap_pool=znn_eth_uniswap_pool)
-
-    # Write pool data to file
-    write_pool_data_to_file(
-        znn_eth_uniswap_pool, f'{DATA_STORE_DIR}/znn_eth_pool_data.json')
-
-    # Write NoM data to file
-    write_nom_data_to_file(
-        nom_data, f'{DATA_STORE_DIR}/nom_data.json')
-
-    # Write Pillar data to file
-    write_pillar_data_to_file(
-        nom_data, f'{DATA_STORE_DIR}/pillar_data.json')
-
-
-async def main():
-    while True:
-        print(f'{str(datetime.datetime.now())}: Starting')
-        await update()
-        print(f'{str(datetime.datetime.now())}: Completed')
-        time.sleep(10)
+    print(f'{str(datetime.datetime.now())}: Starting')
+    await Refiner(cfg, DATA_STORE_DIR).run()
 
 
 if __name__ == '__main__':
@@ -1,50 +1,224 @@
 import asyncio
-import datetime
 import math
-from utils.http_wrapper import HttpWrapper
+import types
+from collections import namedtuple
+from emission_schedule import EmissionSchedule
+from pillar_engine import PillarRewardEngine
+from stake_index import StakeIndex
+from utils.rpc_client import RpcClient
+from utils.metrics import timed_step
 
 
 class NomPillar(object):
-    def __init__(self,
-                 name,
-                 rank,
-                 type,
-                 owner_address,
-                 producer_address,
-                 withdraw_address,
-                 is_revocable,
-                 revoke_cooldown,
-                 revoke_timestamp,
-                 give_momentum_reward_percentage,
-                 give_delegate_reward_percentage,
-                 produced_momentums,
-                 expected_momentums,
-                 weight,
-                 epoch_momentum_rewards,
-                 epoch_delegate_rewards,
-                 apr,
-                 delegate_apr):
-        self.name = name
-        self.rank = rank
-        self.type = type
-        self.owner_address = owner_address
-        self.producer_address = producer_address
-        self.withdraw_address = withdraw_address
-        self.is_revocable = is_revocable
-        self.revoke_cooldown = revoke_cooldown
-        self.revoke_timestamp = revoke_timestamp
-        self.give_momentum_reward_percentage = give_momentum_reward_percentage
-        self.give_delegate_reward_percentage = give_delegate_reward_percentage
-        self.produced_momentums = produced_momentums
-        self.expected_momentums = expected_momentums
-        self.weight = weight
-        self.epoch_momentum_rewards = epoch_momentum_rewards
-        self.epoch_delegate_rewards = epoch_delegate_rewards
-        self.apr = apr
-        self.delegate_apr = delegate_apr
+    # Pillar records are kept between updates. A record whose node data has
+    # changed is replaced by an updated copy, the rewards are updated in
+    # place. The JSON output of a record is cached until one of its fields
+    # changes.
+
+    FIELDS = ('name',
+              'rank',
+              'type',
+              'owner_address',
+              'producer_address',
+              'withdraw_address',
+              'is_revocable',
+              'revoke_cooldown',
+              'revoke_timestamp',
+              'give_momentum_reward_percentage',
+              'give_delegate_reward_percentage',
+              'produced_momentums',
+              'expected_momentums',
+              'weight',
+              'epoch_momentum_rewards',
+              'epoch_delegate_rewards',
+              'apr',
+              'delegate_apr')
+    REWARD_FIELDS = FIELDS[-4:]
+    RPC_FIELDS = FIELDS[:-4]
+    __slots__ = FIELDS + ('json',)
+
+    # How the fields other than the rewards are read from the RPC data of a Pillar
+    RPC_VALUES = {
+        'name': lambda p_data: p_data['name'],
+        'rank': lambda p_data: p_data['rank'],
+        'type': lambda p_data: p_data['type'],
+        'owner_address': lambda p_data: p_data['ownerAddress'],
+        'producer_address': lambda p_data: p_data['producerAddress'],
+        'withdraw_address': lambda p_data: p_data['withdrawAddress'],
+        'is_revocable': lambda p_data: p_data['isRevocable'],
+        'revoke_cooldown': lambda p_data: p_data['revokeCooldown'],
+        'revoke_timestamp': lambda p_data: p_data['revokeTimestamp'],
+        'give_momentum_reward_percentage': lambda p_data: p_data['giveMomentumRewardPercentage'],
+        'give_delegate_reward_percentage': lambda p_data: p_data['giveDelegateRewardPercentage'],
+        'produced_momentums': lambda p_data: p_data['currentStats']['producedMomentums'],
+        'expected_momentums': lambda p_data: p_data['currentStats']['expectedMomentums'],
+        'weight': lambda p_data: int(p_data['weight'])
+    }
+
+    def __init__(self):
+        # The rewards are zero until they are computed
+        self.json = None
+        self.__set_fields(self.REWARD_FIELDS, (0, 0, 0, 0))
+
+    @classmethod
+    def from_rpc(cls, p_data):
+        pillar = cls()
+        pillar.__set_fields(cls.RPC_FIELDS, pillar.__get_rpc_values(p_data))
+        return pillar
+
+    def copy_from_rpc(self, p_data):
+        # Copy on write: returns the record itself if none of the fields
+        # changed, otherwise an updated copy that keeps the rewards
+        values = self.__get_rpc_values(p_data)
+        if all(getattr(self, field) == value for field, value in zip(self.RPC_FIELDS, values)):
+            return self
+        pillar = NomPillar()
+        pillar.__set_fields(self.FIELDS, [getattr(self, field) for field in self.FIELDS])
+        pillar.__set_fields(self.RPC_FIELDS, values)
+        return pillar
+
+    def __get_rpc_values(self, p_data):
+        return [self.RPC_VALUES[field](p_data) for field in self.RPC_FIELDS]
+
+    def update_rewards(self, epoch_momentum_rewards, epoch_delegate_rewards, apr, delegate_apr):
+        return self.__set_fields(self.REWARD_FIELDS, (epoch_momentum_rewards, epoch_delegate_rewards, apr, delegate_apr))
+
+    def __set_fields(self, fields, values):
+        changed = False
+        for field, value in zip(fields, values):
+            if getattr(self, field, None) != value:
+                setattr(self, field, value)
+                changed = True
+        if changed:
+            self.json = None
+        return changed
+
+    def to_json(self):
+        if self.json is None:
+            self.json = {
+                'name': self.name,
+                'rank': self.rank,
+                # 'type': self.type,
+                # 'ownerAddress': self.owner_address,
+                # 'producerAddress': self.producer_address,
+                # 'withdrawAddress': self.withdraw_address,
+                # 'isRevocable': self.is_revocable,
+                # 'revokeCooldown': self.revoke_cooldown,
+                # 'revokeTimestamp': self.revoke_timestamp,
+                'giveMomentumRewardPercentage': self.give_momentum_reward_percentage,
+                'giveDelegateRewardPercentage': self.give_delegate_reward_percentage,
+                'producedMomentums': self.produced_momentums,
+                'expectedMomentums': self.expected_momentums,
+                'weight': self.weight,
+                'epochMomentumRewards': self.epoch_momentum_rewards,
+                'epochDelegateRewards': self.epoch_delegate_rewards,
+                'apr': self.apr,
+                'delegateApr': self.delegate_apr,
+            }
+        return self.json
+
+
+class NomPillarAggregator(object):
+    # Folds a stream of Pillar data into the group totals and the Pillar
+    # records in a single pass, so the Pillar list is never materialized.
+    # The records of the previous update are reused if unchanged and are
+    # never modified, changed Pillars get new records that keep the previous
+    # rewards until the rewards are recomputed. Nothing is visible to the
+    # previous update until the results are published after finish().
+
+    def __init__(self, previous_pillars, decimals):
+        self.previous_pillars = previous_pillars
+        self.decimals = decimals
+        self.pillars = {}
+        self.changed = False
+
+        self.total_delegated_znn = 0
+        self.total_delegated_znn_top_30 = 0
+        self.total_delegated_znn_not_top_30 = 0
+        self.total_momentum_reward_share_top_30 = 0
+        self.total_momentum_reward_share_not_top_30 = 0
+        self.total_delegate_reward_share_top_30 = 0
+        self.total_delegate_reward_share_not_top_30 = 0
+
+    def add(self, p_data):
+        delegated_znn = int(p_data['weight']) / self.decimals
+        momentum_reward_share = p_data['giveMomentumRewardPercentage'] / 100
+        delegate_reward_share = p_data['giveDelegateRewardPercentage'] / 100
+
+        # Add to total delegated and to total reward share rates (used to calculate averages)
+        self.total_delegated_znn = self.total_delegated_znn + delegated_znn
+        if p_data['rank'] < 30:
+            self.total_delegated_znn_top_30 = self.total_delegated_znn_top_30 + delegated_znn
+            self.total_momentum_reward_share_top_30 = self.total_momentum_reward_share_top_30 + \
+                momentum_reward_share
+            self.total_delegate_reward_share_top_30 = self.total_delegate_reward_share_top_30 + \
+                delegate_reward_share
+        else:
+            self.total_delegated_znn_not_top_30 = self.total_delegated_znn_not_top_30 + delegated_znn
+            self.total_momentum_reward_share_not_top_30 = self.total_momentum_reward_share_not_top_30 + \
+                momentum_reward_share
+            self.total_delegate_reward_share_not_top_30 = self.total_delegate_reward_share_not_top_30 + \
+                delegate_reward_share
+
+        # Update the Pillar record, keeping the rewards of the previous update
+        pillar = self.previous_pillars.get(p_data['ownerAddress'])
+        if pillar is None:
+            pillar = NomPillar.from_rpc(p_data)
+            self.changed = True
+        else:
+            updated_pillar = pillar.copy_from_rpc(p_data)
+            if updated_pillar is not pillar:
+                pillar = updated_pillar
+                self.changed = True
+        self.pillars[p_data['ownerAddress']] = pillar
+
+    def finish(self):
+        # Pillars that were removed or reordered also change the Pillar list
+        if list(self.pillars) != list(self.previous_pillars):
+            self.changed = True
+
+
+# Immutable result of a NomData update. The Pillars are a read-only mapping
+# of owner address to the Pillar's JSON output.
+NomDataSnapshot = namedtuple('NomDataSnapshot', [
+    'momentum_height',
+    'node_version',
+    'znn_price_usd',
+    'qsr_price_usd',
+    'total_staked_znn',
+    'total_staked_znn_eth_lp',
+    'avg_staking_lockup_time_in_days',
+    'avg_znn_eth_lp_lockup_time_in_days',
+    'staking_lockup_distribution',
+    'znn_eth_lp_lockup_distribution',
+    'znn_eth_lp_program_participation_rate',
+    'total_delegated_znn',
+    'sentinel_count',
+    'pillar_count',
+    'znn_supply',
+    'qsr_supply',
+    'staking_apr',
+    'delegate_apr',
+    'lp_apr',
+    'sentinel_apr',
+    'pillar_apr_top_30',
+    'pillar_apr_not_top_30',
+    'yearly_znn_reward_pool_for_lps',
+    'yearly_znn_reward_pool_for_sentinels',
+    'yearly_qsr_reward_pool_for_stakers',
+    'yearly_qsr_reward_pool_for_lps',
+    'yearly_qsr_reward_pool_for_sentinels',
+    'yearly_znn_momentum_reward_pool_for_pillars_top_30',
+    'yearly_znn_momentum_reward_pool_for_pillars_not_top_30',
+    'yearly_znn_delegate_reward_pool_for_pillars',
+    'orbital_multiplier',
+    'pillars'])
 
 
 class NomData(object):
+    # All state is owned by the instance, so several instances can be updated
+    # concurrently in one process. Every update produces a new immutable
+    # snapshot of the results.
 
     # Constants
     DAYS_PER_MONTH = 30
@@ -73,108 +247,179 @@ class NomData(object):
     STAKING_CONTRACT_ADDRESS = 'z1qxemdeddedxstakexxxxxxxxxxxxxxxxjv8v62'
     LIQUIDITY_CONTRACT_ADDRESS = 'z1qxemdeddedxlyquydytyxxxxxxxxxxxxflaaae'
 
-    # Daily reward emissions
-    DAILY_ZNN_REWARDS_BY_MONTH = [
-        14400, 8640, 7200, 10080, 7200, 5760, 10080, 5760, 4320, 10080, 4320, 4320
-    ]
-    DAILY_QSR_REWARDS_BY_MONTH = [
-        20000, 20000, 20000, 20000, 15000, 15000, 15000, 5000, 5000, 5000, 5000,
-        5000
-    ]
-
-    # Uniswap pool data
-    znn_eth_uniswap_pool = None
-
-    # A reference staking address is used to calculate the network's total weighted stake.
-    # It's assumed that the reference address is staking with a lockup period of 12 months.
-    reference_staking_address = ''
-    reference_staking_reward_previous_epoch = 0
-    reference_weighted_staking_amount = 0
-    avg_staking_lockup_time_in_days = 0
-
-    reference_znn_eth_lp_address = ''
-    reference_znn_eth_lp_reward_previous_epoch = 0
-    reference_weighted_znn_eth_lp_amount = 0
-    avg_znn_eth_lp_lockup_time_in_days = 0
-    znn_eth_lp_program_participation_rate = 0
-    orbital_multiplier = 1
-
-    momentum_height = 0
-    node_version = ''
-    momentum_month = 0
-
-    total_expected_daily_momentums_top_30 = 0
-    total_expected_daily_momentums_not_top_30 = 0
-
-    total_staked_znn = {
-        'amount': 0,
-        'weighted_amount': 0
-    }
-    total_staked_znn_eth_lp = {
-        'amount': 0,
-        'weighted_amount': 0
-    }
-    total_delegated_znn = 0
-    total_delegated_znn_top_30 = 0
-    total_delegated_znn_not_top_30 = 0
-    sentinel_count = 0
-    pillar_count = 0
-
-    sentinel_value_usd = 0
-    pillar_value_usd = 0
-
-    znn_supply = 0
-    qsr_supply = 0
-
-    staking_apr = 0
-    delegate_apr = 0
-    lp_apr = 0
-    sentinel_apr = 0
-    pillar_apr_top_30 = 0
-    pillar_apr_not_top_30 = 0
-
-    avg_pillars_momentum_reward_share_top_30 = 0
-    avg_pillars_momentum_reward_share_not_top_30 = 0
-    avg_pillars_delegate_reward_share_top_30 = 0
-    avg_pillars_delegate_reward_share_not_top_30 = 0
-
-    pillar_data_cache = {}
-    pillars = []
-
-    yearly_znn_reward_pool_for_lps = 0
-    yearly_znn_reward_pool_for_sentinels = 0
-    yearly_znn_momentum_reward_pool_for_pillars_top_30 = 0
-    yearly_znn_momentum_reward_pool_for_pillars_not_top_30 = 0
-    yearly_znn_delegate_reward_pool_for_pillars = 0
-
-    yearly_qsr_reward_pool_for_stakers = 0
-    yearly_qsr_reward_pool_for_lps = 0
-    yearly_qsr_reward_pool_for_sentinels = 0
-
-    yearly_znn_bonus_reward_pool_for_lps = 0
-    yearly_qsr_bonus_reward_pool_for_lps = 0
-
-    async def update(self, node_url, reference_staking_address, reference_lp_address, znn_price_usd, qsr_price_usd, znn_eth_uniswap_pool):
-        self.node_url = node_url
-        self.znn_price_usd = znn_price_usd
-        self.qsr_price_usd = qsr_price_usd
+    def __init__(self):
+        self.node_urls = []
+        self.rpc = None
+        self.znn_price_usd = 0
+        self.qsr_price_usd = 0
+
+        # Result of the latest update
+        self.snapshot = None
+
+        # Duration of the update steps since they were last cleared, by step
+        self.step_durations = {}
+
+        # Epoch, month and yearly reward emissions of the current epoch
+        self.emission_schedule = EmissionSchedule()
+
+        # Snapshot of the Uniswap pool data
+        self.znn_eth_uniswap_pool = None
+
+        # A reference staking address is used to calculate the network's total weighted stake.
+        # It's assumed that the reference address is staking with a lockup period of 12 months.
+        self.reference_staking_address = ''
+        self.reference_staking_reward_previous_epoch = 0
+        self.reference_weighted_staking_amount = 0
+        self.avg_staking_lockup_time_in_days = 0
+
+        self.reference_znn_eth_lp_address = ''
+        self.reference_znn_eth_lp_reward_previous_epoch = 0
+        self.reference_weighted_znn_eth_lp_amount = 0
+        self.avg_znn_eth_lp_lockup_time_in_days = 0
+        self.znn_eth_lp_program_participation_rate = 0
+        self.orbital_multiplier = 1
+
+        # Indexes of all stake entries give the exact total weighted stake when enabled.
+        # They're updated when the account height of their contract changes.
+        self.stake_index = None
+        self.znn_eth_lp_stake_index = None
+        self.staking_contract_height = 0
+        self.liquidity_contract_height = 0
+
+        # Staked amount by lockup period in months, only known from the stake indexes
+        self.staking_lockup_distribution = {}
+        self.znn_eth_lp_lockup_distribution = {}
+
+        self.momentum_height = 0
+        self.node_version = ''
+        self.momentum_month = 0
+
+        self.total_expected_daily_momentums_top_30 = 0
+        self.total_expected_daily_momentums_not_top_30 = 0
+
+        self.total_staked_znn = {
+            'amount': 0,
+            'weighted_amount': 0
+        }
+        self.total_staked_znn_eth_lp = {
+            'amount': 0,
+            'weighted_amount': 0
+        }
+        self.total_delegated_znn = 0
+        self.total_delegated_znn_top_30 = 0
+        self.total_delegated_znn_not_top_30 = 0
+        self.sentinel_count = 0
+        self.pillar_count = 0
+
+        self.sentinel_value_usd = 0
+        self.pillar_value_usd = 0
+
+        self.znn_supply = 0
+        self.qsr_supply = 0
+
+        self.staking_apr = 0
+        self.delegate_apr = 0
+        self.lp_apr = 0
+        self.sentinel_apr = 0
+        self.pillar_apr_top_30 = 0
+        self.pillar_apr_not_top_30 = 0
+
+        self.avg_pillars_momentum_reward_share_top_30 = 0
+        self.avg_pillars_momentum_reward_share_not_top_30 = 0
+        self.avg_pillars_delegate_reward_share_top_30 = 0
+        self.avg_pillars_delegate_reward_share_not_top_30 = 0
+
+        self.pillar_engine = None
+        self.pillar_data_changed = True
+        self.pillars = []
+        self.pillars_by_owner = {}
+
+        # Compute the Pillar stats with the vectorized engine if NumPy is installed.
+        # The scalar per-Pillar loop is kept as the reference implementation.
+        self.use_vectorized_pillar_engine = PillarRewardEngine.AVAILABLE
+
+        # Whether node data was fetched since the derived data was last updated
+        self.node_data_changed = False
+
+        # Inputs of the previous update and whether the previous update changed anything
+        self.inputs = None
+        self.changed = True
+
+        self.yearly_znn_reward_pool_for_lps = 0
+        self.yearly_znn_reward_pool_for_sentinels = 0
+        self.yearly_znn_momentum_reward_pool_for_pillars_top_30 = 0
+        self.yearly_znn_momentum_reward_pool_for_pillars_not_top_30 = 0
+        self.yearly_znn_delegate_reward_pool_for_pillars = 0
+
+        self.yearly_qsr_reward_pool_for_stakers = 0
+        self.yearly_qsr_reward_pool_for_lps = 0
+        self.yearly_qsr_reward_pool_for_sentinels = 0
+
+        self.yearly_znn_bonus_reward_pool_for_lps = 0
+        self.yearly_qsr_bonus_reward_pool_for_lps = 0
+
+    def enable_stake_indexes(self, directory):
+        self.stake_index = StakeIndex(self.STAKING_CONTRACT_ADDRESS,
+                                      'embedded.stake.getEntriesByAddress',
+                                      f'{directory}/stake_index.json')
+        self.znn_eth_lp_stake_index = StakeIndex(self.LIQUIDITY_CONTRACT_ADDRESS,
+                                                 'embedded.liquidity.getLiquidityStakeEntriesByAddress',
+                                                 f'{directory}/znn_eth_lp_stake_index.json',
+                                                 self.ZNN_ETH_LP_ZTS_ID)
+
+    async def update(self, node_url, reference_staking_address, reference_lp_address, znn_price_usd, qsr_price_usd, znn_eth_uniswap_pool, incremental=False):
+        await self.update_node_data(node_url, reference_staking_address, reference_lp_address, incremental)
+        return self.update_derived_data(znn_price_usd, qsr_price_usd, znn_eth_uniswap_pool, incremental)
+
+    async def update_node_data(self, node_url, reference_staking_address, reference_lp_address, incremental=False):
+        # The node URL can be a single URL or a list of URLs of the same network.
+        # The RPC client is kept between updates so it can track the nodes' latencies.
+        node_urls = [node_url] if isinstance(node_url, str) else list(node_url)
+        if self.rpc is None or node_urls != self.node_urls:
+            self.node_urls = node_urls
+            self.rpc = RpcClient(node_urls)
         self.reference_staking_address = reference_staking_address
         self.reference_znn_eth_lp_address = reference_lp_address
+
+        previous_height = self.momentum_height
+
+        if incremental:
+            # The node state can only change with a new momentum, so check the frontier momentum first
+            await self.__update_height()
+            if self.momentum_height != 0 and self.momentum_height == previous_height:
+                return False
+
+            await self.__fetch_node_data()
+        else:
+            await asyncio.gather(
+                self.__update_height(),
+                self.__fetch_node_data())
+
+        self.node_data_changed = True
+        return True
+
+    def update_derived_data(self, znn_price_usd, qsr_price_usd, znn_eth_uniswap_pool, incremental=False):
+        # Returns the snapshot of the results
+        self.znn_price_usd = znn_price_usd
+        self.qsr_price_usd = qsr_price_usd
         self.znn_eth_uniswap_pool = znn_eth_uniswap_pool
 
-        # Update data from the node
-        await asyncio.gather(
-            self.__update_height(),
-            self.__update_node_version(),
-            self.__update_znn_supply(),
-            self.__update_qsr_supply(),
-            self.__update_total_staked_znn(),
-            self.__update_total_staked_znn_eth_lp(),
-            self.__update_reference_staking_data(),
-            self.__update_reference_znn_eth_lp_staking_data(),
-            self.__update_sentinel_data(),
-            self.__update_pillar_data(),
-            self.__update_bonus_orbital_rewards())
+        # Only recalculated when a new epoch has started
+        self.emission_schedule.update()
+
+        previous_inputs = self.inputs
+        self.inputs = self.__get_inputs()
+
+        # Skip the update if neither the node data nor the other inputs have changed
+        if incremental and not self.node_data_changed and self.inputs == previous_inputs and self.snapshot is not None:
+            print(f'No changes at momentum height {self.momentum_height}')
+            self.changed = False
+            return self.snapshot
+
+        self.changed = True
+
+        # Update Sentinel and Pillar collateral values
+        self.__update_collateral_values()
 
         # Update expected momentums for top 30 Pillars and for non top 30 Pillars
         self.__update_total_expected_momentums_for_pillars()
@@ -189,7 +434,7 @@ class NomData(object):
         self.__update_znn_eth_lp_staking_data()
 
         # Update ZNN ETH LP program participation rate
-        await self.__update_znn_eth_lp_program_participation_rate()
+        self.__update_znn_eth_lp_program_participation_rate()
 
         # Update APRs
         self.__update_staking_apr()
@@ -198,35 +443,73 @@ class NomData(object):
         self.__update_pillar_apr_top_30()
         self.__update_pillar_apr_not_top_30()
 
-        # Update the Pillar stats
-        self.__update_pillars()
+        # The Pillar stats only need to be recomputed if the Pillar list or the inputs have changed
+        if not incremental or self.pillar_data_changed or self.inputs != previous_inputs:
+
+            if self.use_vectorized_pillar_engine:
+
+                # Update the Pillar stats and the delegate APR in one pass
+                self.__update_pillars_vectorized()
+            else:
+
+                # Update the Pillar stats and the delegate APR in one pass
+                self.__update_pillars()
+
+        self.node_data_changed = False
+        self.pillar_data_changed = False
+
+        self.snapshot = self.__create_snapshot()
+        return self.snapshot
+
+    def __create_snapshot(self):
+        values = {field: getattr(self, field)
+                  for field in NomDataSnapshot._fields}
+        values['total_staked_znn'] = types.MappingProxyType(
+            dict(self.total_staked_znn))
+        values['total_staked_znn_eth_lp'] = types.MappingProxyType(
+            dict(self.total_staked_znn_eth_lp))
+        values['staking_lockup_distribution'] = types.MappingProxyType(
+            dict(self.staking_lockup_distribution))
+        values['znn_eth_lp_lockup_distribution'] = types.MappingProxyType(
+            dict(self.znn_eth_lp_lockup_distribution))
+        values['pillars'] = types.MappingProxyType(
+            {pillar.owner_address: pillar.to_json() for pillar in self.pillars})
+        return NomDataSnapshot(**values)
+
+    async def __fetch_node_data(self):
+        # Update data from the node. The calls are sent as one batch request.
+        await asyncio.gather(
+            self.__update_node_version(),
+            self.__update_znn_supply(),
+            self.__update_qsr_supply(),
+            self.__update_total_staked_znn(),
+            self.__update_total_staked_znn_eth_lp(),
+            self.__update_reference_staking_data(),
+            self.__update_reference_znn_eth_lp_staking_data(),
+            self.__update_sentinel_data(),
+            self.__update_pillar_data(),
+            self.__update_bonus_orbital_rewards())
 
-        # Update delegate APR after Pillars have been updated
-        self.__update_delegate_apr()
+        # The stake indexes need the contract heights from the calls above
+        await self.__update_stake_indexes()
 
-    def __create_request(self, method, params=[]):
-        return {'jsonrpc': '2.0', 'id': 1,
-                'method': method, 'params': params}
+    def __get_inputs(self):
+        # Values other than the node state that the derived data depends on
+        return (self.znn_price_usd,
+                self.qsr_price_usd,
+                self.znn_eth_uniswap_pool.lp_token_total_supply,
+                self.znn_eth_uniswap_pool.liquidity_usd,
+                self.znn_eth_uniswap_pool.yearly_trading_fees_usd,
+                self.__get_current_epoch_month())
 
     def __get_current_yearly_znn_rewards(self):
-        month = self.__get_current_epoch_month()
-        month = month if month < 12 else 11
-        return self.DAILY_ZNN_REWARDS_BY_MONTH[month] * self.DAYS_PER_MONTH * self.MONTHS_PER_YEAR
+        return self.emission_schedule.yearly_znn_rewards
 
     def __get_current_yearly_qsr_rewards(self):
-        month = self.__get_current_epoch_month()
-        month = month if month < 12 else 11
-        return self.DAILY_QSR_REWARDS_BY_MONTH[month] * self.DAYS_PER_MONTH * self.MONTHS_PER_YEAR
+        return self.emission_schedule.yearly_qsr_rewards
 
     def __get_current_epoch_month(self):
-        genesis = datetime.datetime(
-            year=2021, month=11, day=24, hour=12, tzinfo=datetime.timezone.utc)
-        now = datetime.datetime.now(datetime.timezone.utc)
-        epoch = (now - genesis).days
-        for i in range(0, 1000):
-            if epoch < self.DAYS_PER_MONTH * (i + 1):
-                return i
-        return 0
+        return self.emission_schedule.month
 
     def __get_pillar_count_top_30(self):
         return 30 if self.pillar_count >= 30 else self.pillar_count
@@ -234,65 +517,93 @@ class NomData(object):
     def __get_pillar_count_not_top_30(self):
         return 0 if self.pillar_count < 30 else self.pillar_count - 30
 
+    @timed_step
     async def __update_height(self):
-        r = await HttpWrapper.post(self.node_url, self.__create_request('ledger.getFrontierMomentum'))
+        r = await self.rpc.call('ledger.getFrontierMomentum')
         try:
             self.momentum_height = r['result']['height']
         except KeyError:
             print('Error: __update_height')
 
+    @timed_step
     async def __update_node_version(self):
-        r = await HttpWrapper.post(self.node_url, self.__create_request('stats.processInfo'))
+        r = await self.rpc.call('stats.processInfo')
         try:
             self.node_version = r['result']['version']
         except KeyError:
             print('Error: __update_node_version')
 
+    @timed_step
     async def __update_znn_supply(self):
-        r = await HttpWrapper.post(self.node_url, self.__create_request('embedded.token.getByZts', [
+        r = await self.rpc.call('embedded.token.getByZts', [
             self.ZNN_ZTS_ID
-        ]))
+        ])
         try:
             self.znn_supply = int(r['result']['totalSupply'])
         except KeyError:
             print('Error: __update_znn_supply')
 
+    @timed_step
     async def __update_qsr_supply(self):
-        r = await HttpWrapper.post(self.node_url, self.__create_request('embedded.token.getByZts', [
+        r = await self.rpc.call('embedded.token.getByZts', [
             self.QSR_ZTS_ID
-        ]))
+        ])
         try:
             self.qsr_supply = int(r['result']['totalSupply'])
         except KeyError:
             print('Error: __update_qsr_supply')
 
+    @timed_step
     async def __update_total_staked_znn(self):
-        r = await HttpWrapper.post(self.node_url, self.__create_request('ledger.getAccountInfoByAddress', [
+        r = await self.rpc.call('ledger.getAccountInfoByAddress', [
             self.STAKING_CONTRACT_ADDRESS
-        ]))
+        ])
         try:
             self.total_staked_znn['amount'] = int(
                 r['result']['balanceInfoMap'][self.ZNN_ZTS_ID]['balance']) / self.DECIMALS
+            self.staking_contract_height = r['result'].get('accountHeight', 0)
         except KeyError:
             print('Error: __update_total_staked_znn')
 
+    @timed_step
     async def __update_total_staked_znn_eth_lp(self):
-        r = await HttpWrapper.post(self.node_url, self.__create_request('ledger.getAccountInfoByAddress', [
+        r = await self.rpc.call('ledger.getAccountInfoByAddress', [
             self.LIQUIDITY_CONTRACT_ADDRESS
-        ]))
+        ])
         try:
             self.total_staked_znn_eth_lp['amount'] = int(
                 r['result']['balanceInfoMap'][self.ZNN_ETH_LP_ZTS_ID]['balance']) / self.LP_TOKEN_DECIMALS
+            self.liquidity_contract_height = r['result'].get('accountHeight', 0)
         except KeyError:
             print('Error: __update_total_staked_znn_eth_lp')
 
+    @timed_step
+    async def __update_stake_indexes(self):
+        if self.stake_index is None:
+            return
+
+        try:
+            await asyncio.gather(
+                self.stake_index.update(
+                    self.rpc, self.staking_contract_height),
+                self.znn_eth_lp_stake_index.update(
+                    self.rpc, self.liquidity_contract_height))
+        except Exception as e:
+            print(f'Error: __update_stake_indexes: {str(e)}')
+
+    @timed_step
     async def __update_reference_staking_data(self):
         if len(self.reference_staking_address) == 0:
             return
 
-        r = await HttpWrapper.post(self.node_url, self.__create_request('embedded.stake.getFrontierRewardByPage', [
-            self.reference_staking_address, 0, 1
-        ]))
+        # Request both at once so they go out in the same batch
+        r, r_entries = await asyncio.gather(
+            self.rpc.call('embedded.stake.getFrontierRewardByPage', [
+                self.reference_staking_address, 0, 1
+            ]),
+            self.rpc.call('embedded.stake.getEntriesByAddress', [
+                self.reference_staking_address, 0, 1
+            ]))
         try:
             if r['result']['count'] > 0:
                 self.reference_staking_reward_previous_epoch = int(r[
@@ -300,9 +611,7 @@ class NomData(object):
         except KeyError:
             print('Error: __update_reference_staking_data')
 
-        r = await HttpWrapper.post(self.node_url, self.__create_request('embedded.stake.getEntriesByAddress', [
-            self.reference_staking_address, 0, 1
-        ]))
+        r = r_entries
         try:
             if r['result']['count'] > 0:
                 self.reference_weighted_staking_amount = int(r['result'][
@@ -310,13 +619,19 @@ class NomData(object):
         except KeyError:
             print('Error: __update_reference_staking_data')
 
+    @timed_step
     async def __update_reference_znn_eth_lp_staking_data(self):
         if len(self.reference_znn_eth_lp_address) == 0:
             return
 
-        r = await HttpWrapper.post(self.node_url, self.__create_request('embedded.liquidity.getFrontierRewardByPage', [
-            self.reference_znn_eth_lp_address, 0, 1
-        ]))
+        # Request both at once so they go out in the same batch
+        r, r_entries = await asyncio.gather(
+            self.rpc.call('embedded.liquidity.getFrontierRewardByPage', [
+                self.reference_znn_eth_lp_address, 0, 1
+            ]),
+            self.rpc.call('embedded.liquidity.getLiquidityStakeEntriesByAddress', [
+                self.reference_znn_eth_lp_address, 0, 1
+            ]))
         try:
             if r['result']['count'] > 0:
                 self.reference_znn_eth_lp_reward_previous_epoch = int(r[
@@ -324,9 +639,7 @@ class NomData(object):
         except KeyError:
             print('Error: __update_reference_lp_staking_data')
 
-        r = await HttpWrapper.post(self.node_url, self.__create_request('embedded.liquidity.getLiquidityStakeEntriesByAddress', [
-            self.reference_znn_eth_lp_address, 0, 1
-        ]))
+        r = r_entries
         try:
             if r['result']['count'] > 0:
                 self.reference_weighted_znn_eth_lp_amount = int(r['result'][
@@ -334,73 +647,58 @@ class NomData(object):
         except KeyError:
             print('Error: __update_reference_lp_staking_data')
 
+    @timed_step
     async def __update_bonus_orbital_rewards(self):
-        r = await HttpWrapper.post(self.node_url, self.__create_request('embedded.liquidity.getLiquidityInfo'))
+        r = await self.rpc.call('embedded.liquidity.getLiquidityInfo')
         self.yearly_znn_bonus_reward_pool_for_lps = (int(r['result']['znnReward']) /
                                                      self.DECIMALS) * self.DAYS_PER_YEAR
         self.yearly_qsr_bonus_reward_pool_for_lps = (int(r['result']['qsrReward']) /
                                                      self.DECIMALS) * self.DAYS_PER_YEAR
 
+    @timed_step
     async def __update_sentinel_data(self):
-        r = await HttpWrapper.post(self.node_url, self.__create_request('embedded.sentinel.getAllActive', [0, 1000]))
+        # Only the count is needed, which covers all active Sentinels regardless of the page size
+        r = await self.rpc.call('embedded.sentinel.getAllActive', [0, 1])
         try:
-            # Update sentinel count and value
+            # Update sentinel count
             self.sentinel_count = r['result']['count']
-            self.sentinel_value_usd = self.SENTINEL_COLLATERAL_ZNN * \
-                self.znn_price_usd + self.SENTINEL_COLLATERAL_QSR * self.qsr_price_usd
         except KeyError:
             print('Error: __update_sentinel_data')
 
+    @timed_step
     async def __update_pillar_data(self):
-        r = await HttpWrapper.post(self.node_url, self.__create_request('embedded.pillar.getAll', [0, 1000]))
         try:
-            # Update Pillar data cache for later use
-            self.pillar_data_cache = r
-
-            # Update Pillar count and value
-            self.pillar_count = r['result']['count']
-            self.pillar_value_usd = self.PILLAR_COLLATERAL_ZNN * \
-                self.znn_price_usd + self.PILLAR_COLLATERAL_QSR * self.qsr_price_usd
-
-            # Reset variables
-            self.total_delegated_znn = 0
-            self.total_delegated_znn_top_30 = 0
-            self.total_delegated_znn_not_top_30 = 0
-            self.avg_pillars_momentum_reward_share_top_30 = 0
-            self.avg_pillars_momentum_reward_share_not_top_30 = 0
-            self.avg_pillars_delegate_reward_share_top_30 = 0
-            self.avg_pillars_delegate_reward_share_not_top_30 = 0
-            self.pillars = []
-
-            total_momentum_reward_share_top_30 = 0
-            total_momentum_reward_share_not_top_30 = 0
-            total_delegate_reward_share_top_30 = 0
-            total_delegate_reward_share_not_top_30 = 0
-
-            # Loop through the Pillars
-            for p_data in r['result']['list']:
-
-                # Add to total delegated
-                self.total_delegated_znn = self.total_delegated_znn + \
-                    int(p_data['weight']) / self.DECIMALS
-                if p_data['rank'] < 30:
-                    self.total_delegated_znn_top_30 = self.total_delegated_znn_top_30 + \
-                        int(p_data['weight']) / self.DECIMALS
-                else:
-                    self.total_delegated_znn_not_top_30 = self.total_delegated_znn_not_top_30 + \
-                        int(p_data['weight']) / self.DECIMALS
-
-                # Add to total reward share rates (used to calculate averages)
-                if p_data['rank'] < 30:
-                    total_momentum_reward_share_top_30 = total_momentum_reward_share_top_30 + \
-                        p_data['giveMomentumRewardPercentage'] / 100
-                    total_delegate_reward_share_top_30 = total_delegate_reward_share_top_30 + \
-                        p_data['giveDelegateRewardPercentage'] / 100
-                else:
-                    total_momentum_reward_share_not_top_30 = total_momentum_reward_share_not_top_30 + \
-                        p_data['giveMomentumRewardPercentage'] / 100
-                    total_delegate_reward_share_not_top_30 = total_delegate_reward_share_not_top_30 + \
-                        p_data['giveDelegateRewardPercentage'] / 100
+            aggregator = NomPillarAggregator(
+                self.pillars_by_owner, self.DECIMALS)
+
+            # Fold the Pillars into the totals and records page by page as the pages arrive.
+            # Nothing is assigned until the last page is in, so a failed page keeps the previous data
+            # and the derived data never sees a partly updated Pillar list.
+            pillar_count = 0
+            async for page in self.rpc.get_all_pages('embedded.pillar.getAll'):
+                pillar_count = page['count']
+
+                for p_data in page['list']:
+                    aggregator.add(p_data)
+
+            aggregator.finish()
+
+            # Update Pillar count and totals
+            self.pillar_count = pillar_count
+            self.total_delegated_znn = aggregator.total_delegated_znn
+            self.total_delegated_znn_top_30 = aggregator.total_delegated_znn_top_30
+            self.total_delegated_znn_not_top_30 = aggregator.total_delegated_znn_not_top_30
+            total_momentum_reward_share_top_30 = aggregator.total_momentum_reward_share_top_30
+            total_momentum_reward_share_not_top_30 = aggregator.total_momentum_reward_share_not_top_30
+            total_delegate_reward_share_top_30 = aggregator.total_delegate_reward_share_top_30
+            total_delegate_reward_share_not_top_30 = aggregator.total_delegate_reward_share_not_top_30
+
+            # Update the Pillar records. A change stays flagged until the derived data is updated.
+            self.pillar_data_changed = self.pillar_data_changed or aggregator.changed
+            self.pillars = list(aggregator.pillars.values())
+            self.pillars_by_owner = aggregator.pillars
+            if self.use_vectorized_pillar_engine and (self.pillar_data_changed or self.pillar_engine is None):
+                self.pillar_engine = PillarRewardEngine(self.pillars)
 
             # Update avg momentum and delegate reward sharing rates for top 30
             pillar_count_top_30 = self.__get_pillar_count_top_30()
@@ -427,14 +725,32 @@ class NomData(object):
         except KeyError:
             print('Error: __update_pillar_data')
 
+    @timed_step
+    def __update_collateral_values(self):
+        self.sentinel_value_usd = self.SENTINEL_COLLATERAL_ZNN * \
+            self.znn_price_usd + self.SENTINEL_COLLATERAL_QSR * self.qsr_price_usd
+        self.pillar_value_usd = self.PILLAR_COLLATERAL_ZNN * \
+            self.znn_price_usd + self.PILLAR_COLLATERAL_QSR * self.qsr_price_usd
+
+    @timed_step
     def __update_staking_data(self):
         # Calculations based on https://github.com/zenon-network/go-zenon/blob/1baa7c4e057da4f2708a970b4fedf70a8de77fbe/vm/embedded/implementation/stake.go
 
         rewards_per_epoch = (self.__get_current_yearly_qsr_rewards(
         ) * self.QSR_REWARD_SHARE_FOR_STAKERS) / (self.DAYS_PER_YEAR * self.EPOCH_LENGTH_IN_DAYS)
 
+        # Use the exact total weighted stake if the stake index is built.
+        if self.stake_index is not None and self.stake_index.is_ready() and self.stake_index.amount > 0:
+            self.total_staked_znn['weighted_amount'] = self.stake_index.weighted_amount / self.DECIMALS
+
+            self.avg_staking_lockup_time_in_days = round(
+                (((self.stake_index.weighted_amount * 10) / self.stake_index.amount) - 9) * self.DAYS_PER_MONTH)
+
+            self.staking_lockup_distribution = {str(months): amount / self.DECIMALS
+                                                for months, amount in sorted(self.stake_index.lockup_distribution.items())}
+
         # If no reference staking address is provided use a guesstimation to calculate total weighted stake.
-        if len(self.reference_staking_address) == 0 or self.reference_staking_reward_previous_epoch == 0:
+        elif len(self.reference_staking_address) == 0 or self.reference_staking_reward_previous_epoch == 0:
             estimated_avg_staking_lockup_time_in_months = 3
             self.total_staked_znn['weighted_amount'] = (
                 (9 + estimated_avg_staking_lockup_time_in_months) * self.total_staked_znn['amount']) / 10
@@ -449,19 +765,31 @@ class NomData(object):
             self.avg_staking_lockup_time_in_days = round(
                 (((self.total_staked_znn['weighted_amount'] * 10) / self.total_staked_znn['amount']) - 9) * self.DAYS_PER_MONTH)
 
+    @timed_step
     def __update_znn_eth_lp_staking_data(self):
         # Calculations based on https://github.com/zenon-network/go-zenon/blob/a892f3cdef00ab0dbefdf90a4d62d081dc53daf3/vm/embedded/implementation/liquidity.go
 
         rewards_per_epoch = (self.__get_current_yearly_znn_rewards(
         ) * self.ZNN_REWARD_SHARE_FOR_LPS) / (self.DAYS_PER_YEAR * self.EPOCH_LENGTH_IN_DAYS) * self.orbital_multiplier
 
+        # Use the exact total weighted stake if the stake index is built.
+        if self.znn_eth_lp_stake_index is not None and self.znn_eth_lp_stake_index.is_ready() and self.znn_eth_lp_stake_index.amount > 0:
+            self.total_staked_znn_eth_lp['weighted_amount'] = self.znn_eth_lp_stake_index.weighted_amount / \
+                self.LP_TOKEN_DECIMALS
+
+            self.avg_znn_eth_lp_lockup_time_in_days = round(
+                (self.znn_eth_lp_stake_index.weighted_amount / self.znn_eth_lp_stake_index.amount) * self.DAYS_PER_MONTH)
+
+            self.znn_eth_lp_lockup_distribution = {str(months): amount / self.LP_TOKEN_DECIMALS
+                                                   for months, amount in sorted(self.znn_eth_lp_stake_index.lockup_distribution.items())}
+
         # If no reference staking address is provided use a guesstimation to calculate total weighted stake.
-        if len(self.reference_znn_eth_lp_address) == 0 or self.reference_znn_eth_lp_reward_previous_epoch == 0:
+        elif len(self.reference_znn_eth_lp_address) == 0 or self.reference_znn_eth_lp_reward_previous_epoch == 0:
             estimated_avg_staking_lockup_time_in_months = 3
             self.total_staked_znn_eth_lp['weighted_amount'] = self.total_staked_znn_eth_lp['amount'] * \
                 estimated_avg_staking_lockup_time_in_months
 
-            self.avg_staking_lockup_time_in_days = estimated_avg_staking_lockup_time_in_months * \
+            self.avg_znn_eth_lp_lockup_time_in_days = estimated_avg_staking_lockup_time_in_months * \
                 self.DAYS_PER_MONTH
 
         else:
@@ -471,6 +799,7 @@ class NomData(object):
             self.avg_znn_eth_lp_lockup_time_in_days = round(
                 (self.total_staked_znn_eth_lp['weighted_amount'] / self.total_staked_znn_eth_lp['amount']) * self.DAYS_PER_MONTH)
 
+    @timed_step
     def __update_total_expected_momentums_for_pillars(self):
         # Group B size (includes half of the top 30 pillars and all non top 30 pillars)
         group_b_size = self.pillar_count - 15
@@ -484,6 +813,7 @@ class NomData(object):
         self.total_expected_daily_momentums_not_top_30 = momentums_allocated_for_group_b * \
             ((group_b_size - 15) / group_b_size)
 
+    @timed_step
     def __update_current_yearly_reward_pools(self):
         total_yearly_znn_rewards = self.__get_current_yearly_znn_rewards()
         total_yearly_qsr_rewards = self.__get_current_yearly_qsr_rewards()
@@ -510,12 +840,14 @@ class NomData(object):
         self.yearly_qsr_reward_pool_for_sentinels = total_yearly_qsr_rewards * \
             self.QSR_REWARD_SHARE_FOR_SENTINELS
 
-    async def __update_znn_eth_lp_program_participation_rate(self):
+    @timed_step
+    def __update_znn_eth_lp_program_participation_rate(self):
         self.znn_eth_lp_program_participation_rate = self.total_staked_znn_eth_lp[
             'amount'] / self.znn_eth_uniswap_pool.lp_token_total_supply
         print('LP participation rate: ' +
               str(self.znn_eth_lp_program_participation_rate))
 
+    @timed_step
     def __update_staking_apr(self):
         reward_pool_in_usd = self.yearly_qsr_reward_pool_for_stakers * self.qsr_price_usd
         total_staked_value_in_usd = self.total_staked_znn['amount'] * \
@@ -523,17 +855,7 @@ class NomData(object):
         self.staking_apr = reward_pool_in_usd / total_staked_value_in_usd * \
             100 if total_staked_value_in_usd > 0 else 0
 
-    def __update_delegate_apr(self):
-        total_apr = 0
-        sharing_pillars_count = 0
-        for pillar in self.pillars:
-            # Only include Pillars that have over 0% delegate APR and a weight of at least 10k ZNN
-            if pillar.delegate_apr > 0 and pillar.weight / self.DECIMALS >= 10000:
-                total_apr = total_apr + pillar.delegate_apr
-                sharing_pillars_count = sharing_pillars_count + 1
-        self.delegate_apr = total_apr / \
-            sharing_pillars_count if sharing_pillars_count > 0 else 0
-
+    @timed_step
     def __update_lp_apr(self):
         total_rewards_usd = self.yearly_znn_reward_pool_for_lps * self.znn_price_usd + \
             self.yearly_qsr_reward_pool_for_lps * self.qsr_price_usd
@@ -547,6 +869,7 @@ class NomData(object):
         else:
             self.lp_apr = 0
 
+    @timed_step
     def __update_sentinel_apr(self):
         total_rewards_usd = self.yearly_znn_reward_pool_for_sentinels * self.znn_price_usd + \
             self.yearly_qsr_reward_pool_for_sentinels * self.qsr_price_usd
@@ -556,6 +879,7 @@ class NomData(object):
         else:
             self.sentinel_apr = 0
 
+    @timed_step
     def __update_pillar_apr_top_30(self):
         # Calculate average yearly momentum rewards per Pillar
         yearly_momentum_rewards = self.__get_yearly_momentum_rewards_top_30()
@@ -580,6 +904,7 @@ class NomData(object):
         else:
             self.pillar_apr_top_30 = 0
 
+    @timed_step
     def __update_pillar_apr_not_top_30(self):
         # Calculate average yearly momentum rewards per Pillar
         yearly_momentum_rewards = self.__get_yearly_momentum_rewards_not_top_30()
@@ -605,16 +930,17 @@ class NomData(object):
         else:
             self.pillar_apr_not_top_30 = 0
 
+    @timed_step
     def __update_pillars(self):
-        self.pillars = []
+        pillar_count_top_30 = self.__get_pillar_count_top_30()
+        pillar_count_not_top_30 = self.__get_pillar_count_not_top_30()
+        total_delegate_apr = 0
+        sharing_pillars_count = 0
 
         # Loop through the Pillars
-        for p_data in self.pillar_data_cache['result']['list']:
-            pillar_count_top_30 = self.__get_pillar_count_top_30()
-            pillar_count_not_top_30 = self.__get_pillar_count_not_top_30()
-
-            produced = p_data['currentStats']['producedMomentums']
-            expected = p_data['currentStats']['expectedMomentums']
+        for pillar in self.pillars:
+            produced = pillar.produced_momentums
+            expected = pillar.expected_momentums
 
             # Use a reward multiplier based on produced / expected momentums. Allow a tolerance of 2 momentum.
             if expected - produced > 2 and expected > 0:
@@ -623,7 +949,7 @@ class NomData(object):
                 reward_multiplier = 1
 
             # Calculate yearly momentum rewards for Pillar based on currently produced momentums
-            if p_data['rank'] < 30 and pillar_count_top_30 > 0:
+            if pillar.rank < 30 and pillar_count_top_30 > 0:
 
                 # Calculate the daily expected momentums for a top 30 Pillar
                 daily_expected_momentums_per_pillar = self.total_expected_daily_momentums_top_30 / \
@@ -650,15 +976,15 @@ class NomData(object):
             # Calculate yearly delegate rewards for Pillar based on current weight
             if self.total_delegated_znn > 0:
                 yearly_delegate_rewards = (
-                    int(p_data['weight']) / self.DECIMALS / self.total_delegated_znn) * self.__get_current_yearly_znn_rewards() * self.ZNN_REWARD_SHARE_FOR_PILLAR_DELEGATES
+                    pillar.weight / self.DECIMALS / self.total_delegated_znn) * self.__get_current_yearly_znn_rewards() * self.ZNN_REWARD_SHARE_FOR_PILLAR_DELEGATES
                 yearly_delegate_rewards = yearly_delegate_rewards * reward_multiplier
             else:
                 yearly_delegate_rewards = 0
 
             # Get Pillar stats
-            momentum_reward_sharing = p_data['giveMomentumRewardPercentage'] / 100
-            delegate_reward_sharing = p_data['giveDelegateRewardPercentage'] / 100
-            delegated_znn = int(p_data['weight']) / self.DECIMALS
+            momentum_reward_sharing = pillar.give_momentum_reward_percentage / 100
+            delegate_reward_sharing = pillar.give_delegate_reward_percentage / 100
+            delegated_znn = pillar.weight / self.DECIMALS
 
             # Calculate the Pillar's APR
             p_apr = self.__get_single_pillar_apr(
@@ -674,27 +1000,45 @@ class NomData(object):
             epoch_delegate_rewards = yearly_delegate_rewards / \
                 self.DAYS_PER_YEAR * self.EPOCH_LENGTH_IN_DAYS
 
-            # Create Pillar object
-            self.pillars.append(
-                NomPillar(
-                    p_data['name'],
-                    p_data['rank'],
-                    p_data['type'],
-                    p_data['ownerAddress'],
-                    p_data['producerAddress'],
-                    p_data['withdrawAddress'],
-                    p_data['isRevocable'],
-                    p_data['revokeCooldown'],
-                    p_data['revokeTimestamp'],
-                    p_data['giveMomentumRewardPercentage'],
-                    p_data['giveDelegateRewardPercentage'],
-                    p_data['currentStats']['producedMomentums'],
-                    p_data['currentStats']['expectedMomentums'],
-                    int(p_data['weight']),
-                    epoch_momentum_rewards,
-                    epoch_delegate_rewards,
-                    p_apr * 100,
-                    d_apr * 100))
+            # Update the Pillar record
+            pillar.update_rewards(epoch_momentum_rewards,
+                                  epoch_delegate_rewards, p_apr * 100, d_apr * 100)
+
+            # Only include Pillars that have over 0% delegate APR and a weight of at least 10k ZNN in the average
+            if pillar.delegate_apr > 0 and delegated_znn >= 10000:
+                total_delegate_apr = total_delegate_apr + pillar.delegate_apr
+                sharing_pillars_count = sharing_pillars_count + 1
+
+        self.delegate_apr = total_delegate_apr / \
+            sharing_pillars_count if sharing_pillars_count > 0 else 0
+
+    @timed_step
+    def __update_pillars_vectorized(self):
+        engine = self.pillar_engine
+        engine.compute(pillar_count_top_30=self.__get_pillar_count_top_30(),
+                       pillar_count_not_top_30=self.__get_pillar_count_not_top_30(),
+                       total_expected_daily_momentums_top_30=self.total_expected_daily_momentums_top_30,
+                       total_expected_daily_momentums_not_top_30=self.total_expected_daily_momentums_not_top_30,
+                       yearly_momentum_rewards_top_30=self.__get_yearly_momentum_rewards_top_30(),
+                       yearly_momentum_rewards_not_top_30=self.__get_yearly_momentum_rewards_not_top_30(),
+                       yearly_delegate_rewards=self.__get_current_yearly_znn_rewards(
+                       ) * self.ZNN_REWARD_SHARE_FOR_PILLAR_DELEGATES,
+                       total_delegated_znn=self.total_delegated_znn,
+                       znn_price_usd=self.znn_price_usd,
+                       pillar_value_usd=self.pillar_value_usd,
+                       decimals=self.DECIMALS,
+                       epochs_per_year=self.DAYS_PER_YEAR / self.EPOCH_LENGTH_IN_DAYS)
+
+        epoch_momentum_rewards = engine.epoch_momentum_rewards.tolist()
+        epoch_delegate_rewards = engine.epoch_delegate_rewards.tolist()
+        apr = engine.apr.tolist()
+        delegate_apr = engine.delegate_apr.tolist()
+
+        for i, pillar in enumerate(self.pillars):
+            pillar.update_rewards(epoch_momentum_rewards[i],
+                                  epoch_delegate_rewards[i], apr[i], delegate_apr[i])
+
+        self.delegate_apr = engine.avg_delegate_apr
 
     def __get_single_pillar_apr(self, yearly_momentum_rewards, yearly_delegate_rewards, momentum_reward_sharing, delegate_reward_sharing):
         rewards_value_usd = yearly_momentum_rewards * \
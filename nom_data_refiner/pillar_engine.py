@@ -0,0 +1,102 @@
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+class PillarRewardEngine(object):
+    # Computes the rewards and APRs of all Pillars in one vectorized pass over
+    # column arrays. The per-Pillar loop in NomData is the scalar reference
+    # implementation of the same calculation. Requires NumPy.
+
+    # Whether NumPy is installed
+    AVAILABLE = np is not None
+
+    # Minimum delegated ZNN for a Pillar to be included in the average delegate APR
+    MIN_DELEGATE_APR_WEIGHT = 10000
+
+    def __init__(self, pillars):
+        # Load the Pillar records once into column arrays
+        count = len(pillars)
+        self.count = count
+        self.rank = np.fromiter(
+            (p.rank for p in pillars), dtype=np.int64, count=count)
+        self.weight = np.fromiter(
+            (p.weight for p in pillars), dtype=np.float64, count=count)
+        self.produced_momentums = np.fromiter(
+            (p.produced_momentums for p in pillars), dtype=np.float64, count=count)
+        self.expected_momentums = np.fromiter(
+            (p.expected_momentums for p in pillars), dtype=np.float64, count=count)
+        self.momentum_reward_sharing = np.fromiter(
+            (p.give_momentum_reward_percentage for p in pillars), dtype=np.float64, count=count) / 100
+        self.delegate_reward_sharing = np.fromiter(
+            (p.give_delegate_reward_percentage for p in pillars), dtype=np.float64, count=count) / 100
+
+        self.epoch_momentum_rewards = np.zeros(count)
+        self.epoch_delegate_rewards = np.zeros(count)
+        self.apr = np.zeros(count)
+        self.delegate_apr = np.zeros(count)
+        self.avg_delegate_apr = 0
+
+    def compute(self, pillar_count_top_30, pillar_count_not_top_30,
+                total_expected_daily_momentums_top_30, total_expected_daily_momentums_not_top_30,
+                yearly_momentum_rewards_top_30, yearly_momentum_rewards_not_top_30,
+                yearly_delegate_rewards, total_delegated_znn, znn_price_usd, pillar_value_usd,
+                decimals, epochs_per_year):
+        produced = self.produced_momentums
+        expected = self.expected_momentums
+
+        # Use a reward multiplier based on produced / expected momentums. Allow a tolerance of 2 momentum.
+        reward_multiplier = np.ones(self.count)
+        penalized = (expected - produced > 2) & (expected > 0)
+        reward_multiplier[penalized] = produced[penalized] / \
+            expected[penalized]
+
+        # Calculate yearly momentum rewards based on currently produced momentums
+        yearly_momentum_rewards = np.zeros(self.count)
+        top_30 = (self.rank < 30) & (pillar_count_top_30 > 0)
+        if pillar_count_top_30 > 0:
+            daily_expected_momentums_per_pillar = total_expected_daily_momentums_top_30 / \
+                pillar_count_top_30
+            yearly_momentum_rewards[top_30] = yearly_momentum_rewards_top_30 * \
+                ((daily_expected_momentums_per_pillar *
+                 reward_multiplier[top_30]) / total_expected_daily_momentums_top_30)
+        not_top_30 = ~top_30 & (pillar_count_not_top_30 > 0)
+        if pillar_count_not_top_30 > 0:
+            daily_expected_momentums_per_pillar = total_expected_daily_momentums_not_top_30 / \
+                pillar_count_not_top_30
+            yearly_momentum_rewards[not_top_30] = yearly_momentum_rewards_not_top_30 * \
+                ((daily_expected_momentums_per_pillar *
+                 reward_multiplier[not_top_30]) / total_expected_daily_momentums_not_top_30)
+
+        # Calculate yearly delegate rewards based on current weight
+        delegated_znn = self.weight / decimals
+        if total_delegated_znn > 0:
+            yearly_delegate_rewards = (
+                delegated_znn / total_delegated_znn) * yearly_delegate_rewards * reward_multiplier
+        else:
+            yearly_delegate_rewards = np.zeros(self.count)
+
+        # Calculate the APRs
+        if pillar_value_usd > 0:
+            self.apr = (yearly_momentum_rewards * (1 - self.momentum_reward_sharing) * znn_price_usd +
+                        yearly_delegate_rewards * (1 - self.delegate_reward_sharing) * znn_price_usd) / pillar_value_usd * 100
+        else:
+            self.apr = np.zeros(self.count)
+
+        rewards_value_znn = yearly_momentum_rewards * self.momentum_reward_sharing + \
+            yearly_delegate_rewards * self.delegate_reward_sharing
+        self.delegate_apr = np.zeros(self.count)
+        delegating = delegated_znn > 0
+        self.delegate_apr[delegating] = rewards_value_znn[delegating] / \
+            delegated_znn[delegating] * 100
+
+        # Get rewards for current epoch
+        self.epoch_momentum_rewards = yearly_momentum_rewards / epochs_per_year
+        self.epoch_delegate_rewards = yearly_delegate_rewards / epochs_per_year
+
+        # Only include Pillars that have over 0% delegate APR and enough weight in the average
+        sharing = (self.delegate_apr > 0) & (
+            delegated_znn >= self.MIN_DELEGATE_APR_WEIGHT)
+        self.avg_delegate_apr = float(
+            self.delegate_apr[sharing].mean()) if sharing.any() else 0
@@ -0,0 +1,216 @@
+import asyncio
+import json
+import os
+import time
+from utils.rpc_client import RpcClient
+
+
+class StakeIndex(object):
+    # Index of all stake entries of an embedded contract, so the exact
+    # network-wide totals don't have to be estimated. The addresses that
+    # interacted with the contract are found in the contract's account
+    # blocks, their entries are then requested by address. After the initial
+    # scan only the blocks since the indexed contract height are processed,
+    # and only the entries of the addresses in those blocks are replaced.
+    # The totals and the lockup distribution are kept up to date with every
+    # change, so reading them is O(1).
+
+    # Number of block pages and of entry requests sent at the same time
+    MAX_PAGES_IN_FLIGHT = 4
+    MAX_ENTRY_REQUESTS_IN_FLIGHT = 64
+
+    # Times a failed call is retried before the update is given up
+    MAX_RETRIES = 3
+
+    # Seconds between writes of the index file
+    SAVE_INTERVAL = 60
+
+    SECONDS_PER_MONTH = 30 * 24 * 60 * 60
+
+    # Embedded contract addresses share this prefix
+    EMBEDDED_ADDRESS_PREFIX = 'z1qxemdeddedx'
+
+    def __init__(self, contract_address, entries_method, index_file, token_standard=None):
+        self.contract_address = contract_address
+        self.entries_method = entries_method
+        self.index_file = index_file
+        self.token_standard = token_standard
+
+        # Contract account height up to which the blocks are indexed
+        self.height = 0
+
+        # Entries by id as [address, amount, weighted amount, expiration timestamp, lockup months]
+        self.entries = {}
+        self.entry_ids_by_address = {}
+
+        self.amount = 0
+        self.weighted_amount = 0
+
+        # Staked amount by lockup period in months
+        self.lockup_distribution = {}
+
+        self.build_task = None
+        self.save_timestamp = 0
+        self.dirty = False
+        self.load()
+
+    def is_ready(self):
+        return self.height > 0
+
+    async def update(self, rpc, contract_height):
+        # Once the index is built it's updated in line, so the totals match the
+        # momentum. The initial scan runs in the background.
+        if contract_height <= self.height:
+            return
+        if self.is_ready():
+            await self.__index(rpc, contract_height)
+        elif self.build_task is None:
+            print(f'Building the stake index of {self.contract_address}')
+            self.build_task = asyncio.ensure_future(
+                self.__build(rpc, contract_height))
+
+    def load(self):
+        try:
+            with open(self.index_file) as f:
+                index = json.load(f)
+        except (OSError, ValueError):
+            return
+
+        for entry_id, entry in index['entries'].items():
+            self.__add_entry(entry_id, entry)
+        self.height = index['height']
+
+    def save(self, force=False):
+        # Write-behind: the index is written at most once per save interval
+        if not self.dirty or (not force and self.save_timestamp + self.SAVE_INTERVAL > time.time()):
+            return
+
+        os.makedirs(os.path.dirname(self.index_file), exist_ok=True)
+        tmp_file = f'{self.index_file}.tmp'
+        with open(tmp_file, 'w') as outfile:
+            json.dump({'height': self.height, 'entries': self.entries}, outfile)
+        os.replace(tmp_file, self.index_file)
+        self.save_timestamp = time.time()
+        self.dirty = False
+
+    async def __build(self, rpc, contract_height):
+        try:
+            start = time.monotonic()
+            await self.__index(rpc, contract_height)
+            self.save(force=True)
+            print(f'Indexed {len(self.entries)} stake entries of {self.contract_address} '
+                  f'in {time.monotonic() - start:.1f}s')
+        except Exception as e:
+            print(f'Error: __build: {str(e)}')
+        finally:
+            self.build_task = None
+
+    async def __index(self, rpc, contract_height):
+        # The index is only changed once all requests have succeeded, so a
+        # failed update is retried in full on the next momentum
+        addresses = await self.__get_addresses(rpc, self.height + 1, contract_height)
+        entries_by_address = await self.__get_entries(rpc, addresses)
+        for address, entries in entries_by_address.items():
+            self.__set_address_entries(address, entries)
+        self.height = contract_height
+        self.dirty = True
+        self.save()
+
+    async def __get_addresses(self, rpc, start_height, end_height):
+        # Addresses that sent blocks to the contract or received blocks from it
+        heights = range(start_height, end_height + 1, RpcClient.MAX_PAGE_SIZE)
+        pages = await self.__gather(rpc, [('ledger.getAccountBlocksByHeight',
+                                           [self.contract_address, height, min(RpcClient.MAX_PAGE_SIZE, end_height - height + 1)])
+                                          for height in heights], self.MAX_PAGES_IN_FLIGHT)
+
+        addresses = set()
+        for page in pages:
+            for block in page['list'] or []:
+                paired_block = block.get('pairedAccountBlock') or {}
+                for address in (paired_block.get('address'), block.get('toAddress')):
+                    if address and not address.startswith(self.EMBEDDED_ADDRESS_PREFIX):
+                        addresses.add(address)
+        return addresses
+
+    async def __get_entries(self, rpc, addresses):
+        # Requests the first page of every address, then the remaining pages of addresses with more entries
+        addresses = list(addresses)
+        pages = await self.__gather(rpc, [(self.entries_method, [address, 0, RpcClient.MAX_PAGE_SIZE])
+                                          for address in addresses], self.MAX_ENTRY_REQUESTS_IN_FLIGHT)
+        entries_by_address = {address: list(page['list'] or [])
+                              for address, page in zip(addresses, pages)}
+
+        calls = []
+        for address, page in zip(addresses, pages):
+            page_count = (page['count'] + RpcClient.MAX_PAGE_SIZE - 1) // RpcClient.MAX_PAGE_SIZE
+            for page_index in range(1, page_count):
+                calls.append((address, page_index))
+        pages = await self.__gather(rpc, [(self.entries_method, [address, page_index, RpcClient.MAX_PAGE_SIZE])
+                                          for address, page_index in calls], self.MAX_ENTRY_REQUESTS_IN_FLIGHT)
+        for (address, _), page in zip(calls, pages):
+            entries_by_address[address].extend(page['list'] or [])
+        return entries_by_address
+
+    async def __gather(self, rpc, calls, max_in_flight):
+        # Calls made together are sent as one batch by the RPC client. Failed
+        # calls are retried, a call that keeps failing aborts the update.
+        results = []
+        for i in range(0, len(calls), max_in_flight):
+            batch = calls[i:i + max_in_flight]
+            batch_results = [None] * len(batch)
+            pending = list(range(len(batch)))
+            for _ in range(self.MAX_RETRIES + 1):
+                responses = await asyncio.gather(*[rpc.call(*batch[j]) for j in pending])
+                failed = []
+                for j, r in zip(pending, responses):
+                    if 'result' in r:
+                        batch_results[j] = r['result']
+                    else:
+                        failed.append(j)
+                pending = failed
+                if len(pending) == 0:
+                    break
+            if len(pending) > 0:
+                method, params = batch[pending[0]]
+                raise Exception(f'{method} failed for {params[0]}')
+            results.extend(batch_results)
+        return results
+
+    def __set_address_entries(self, address, entries):
+        for entry_id in self.entry_ids_by_address.get(address, set()).copy():
+            self.__remove_entry(entry_id)
+
+        for entry in entries:
+            if self.token_standard is not None and entry.get('tokenStandard') != self.token_standard:
+                continue
+
+            # Revoked liquidity stakes no longer count
+            if entry.get('revokeTime', 0) != 0:
+                continue
+            start = entry.get('startTimestamp', entry.get('startTime', 0))
+            expiration = entry.get('expirationTimestamp', entry.get('expirationTime', 0))
+            self.__add_entry(entry['id'], [address, int(entry['amount']), int(entry['weightedAmount']), expiration,
+                                           round((expiration - start) / self.SECONDS_PER_MONTH)])
+
+    def __add_entry(self, entry_id, entry):
+        if entry_id in self.entries:
+            self.__remove_entry(entry_id)
+        address, amount, weighted_amount, _, lockup_months = entry
+        self.entries[entry_id] = entry
+        self.entry_ids_by_address.setdefault(address, set()).add(entry_id)
+        self.amount = self.amount + amount
+        self.weighted_amount = self.weighted_amount + weighted_amount
+        self.lockup_distribution[lockup_months] = self.lockup_distribution.get(
+            lockup_months, 0) + amount
+
+    def __remove_entry(self, entry_id):
+        address, amount, weighted_amount, _, lockup_months = self.entries.pop(entry_id)
+        entry_ids = self.entry_ids_by_address[address]
+        entry_ids.discard(entry_id)
+        if len(entry_ids) == 0:
+            del self.entry_ids_by_address[address]
+        self.amount = self.amount - amount
+        self.weighted_amount = self.weighted_amount - weighted_amount
+        self.lockup_distribution[lockup_months] = self.lockup_distribution[lockup_months] - amount
+        if self.lockup_distribution[lockup_months] == 0:
+            del self.lockup_distribution[lockup_months]
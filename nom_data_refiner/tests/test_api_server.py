@@ -0,0 +1,113 @@
+import asyncio
+import gzip
+import json
+import unittest
+from utils.api_server import ApiServer
+
+# Run from the nom_data_refiner directory:
+#   python -m unittest discover tests
+
+
+class TestApiServer(unittest.IsolatedAsyncioTestCase):
+
+    async def asyncSetUp(self):
+        self.server = ApiServer('127.0.0.1', 0, lambda data: json.dumps(data).encode())
+        await self.server.start()
+        port = self.server.server.sockets[0].getsockname()[1]
+        self.reader, self.writer = await asyncio.open_connection('127.0.0.1', port)
+
+    async def asyncTearDown(self):
+        self.writer.close()
+        self.server.close()
+
+    async def request(self, target, headers={}, method='GET'):
+        # Sends a request on the keep-alive connection and returns the status, headers and body
+        lines = [f'{method} {target} HTTP/1.1', 'Host: localhost']
+        lines.extend(f'{name}: {value}' for name, value in headers.items())
+        self.writer.write(('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1'))
+
+        status = int((await self.reader.readline()).split()[1])
+        response_headers = {}
+        while True:
+            line = (await self.reader.readline()).decode('latin-1')
+            if line == '\r\n':
+                break
+            name, _, value = line.partition(':')
+            response_headers[name.strip().lower()] = value.strip()
+        body = b''
+        if method != 'HEAD':
+            body = await self.reader.readexactly(int(response_headers.get('content-length', 0)))
+        return status, response_headers, body
+
+    async def test_matching_etag_is_answered_with_304(self):
+        self.server.set('/data', {'apr': 1})
+        status, headers, body = await self.request('/data')
+        self.assertEqual(status, 200)
+        self.assertEqual(json.loads(body), {'apr': 1})
+
+        status, not_modified_headers, body = await self.request('/data', {'If-None-Match': headers['etag']})
+        self.assertEqual(status, 304)
+        self.assertEqual(body, b'')
+        self.assertEqual(not_modified_headers['etag'], headers['etag'])
+
+        status, _, _ = await self.request('/data', {'If-None-Match': f'"other", {headers["etag"]}'})
+        self.assertEqual(status, 304)
+        status, _, _ = await self.request('/data', {'If-None-Match': '*'})
+        self.assertEqual(status, 304)
+
+    async def test_changed_document_gets_a_new_etag(self):
+        self.server.set('/data', {'apr': 1})
+        _, headers, _ = await self.request('/data')
+
+        self.server.set('/data', {'apr': 2})
+        status, changed_headers, body = await self.request('/data', {'If-None-Match': headers['etag']})
+        self.assertEqual(status, 200)
+        self.assertEqual(json.loads(body), {'apr': 2})
+        self.assertNotEqual(changed_headers['etag'], headers['etag'])
+
+    async def test_same_document_keeps_its_etag(self):
+        data = {'apr': 1}
+        self.server.set('/data', data)
+        _, headers, _ = await self.request('/data')
+        self.server.set('/data', dict(data))
+        _, same_headers, _ = await self.request('/data')
+        self.assertEqual(same_headers['etag'], headers['etag'])
+
+    async def test_gzip_is_only_sent_when_accepted(self):
+        data = {'pillars': [{'name': f'Pillar{i}', 'apr': i} for i in range(100)]}
+        self.server.set('/data', data)
+
+        _, headers, body = await self.request('/data')
+        self.assertNotIn('content-encoding', headers)
+        self.assertEqual(json.loads(body), data)
+
+        _, gzip_headers, body = await self.request('/data', {'Accept-Encoding': 'gzip, br'})
+        self.assertEqual(gzip_headers['content-encoding'], 'gzip')
+        self.assertEqual(gzip_headers['etag'], headers['etag'])
+        self.assertEqual(json.loads(gzip.decompress(body)), data)
+
+    async def test_head_sends_no_body(self):
+        self.server.set('/data', {'apr': 1})
+        status, headers, _ = await self.request('/data', method='HEAD')
+        self.assertEqual(status, 200)
+        self.assertEqual(int(headers['content-length']), len(b'{"apr": 1}'))
+
+        # The connection is still usable, so no body was sent
+        status, _, body = await self.request('/data')
+        self.assertEqual((status, body), (200, b'{"apr": 1}'))
+
+    async def test_errors(self):
+        def handler(params):
+            if 'days' in params:
+                raise ValueError('Invalid range')
+            return None
+        self.server.set_handler('/history', handler)
+
+        self.assertEqual((await self.request('/missing'))[0], 404)
+        self.assertEqual((await self.request('/history'))[0], 404)
+        self.assertEqual((await self.request('/history?days=x'))[0], 400)
+        self.assertEqual((await self.request('/history', method='POST'))[0], 405)
+
+
+if __name__ == '__main__':
+    unittest.main()
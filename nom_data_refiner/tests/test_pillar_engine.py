@@ -0,0 +1,121 @@
+import asyncio
+import math
+import random
+import unittest
+from nom_data import NomData
+from pillar_engine import PillarRewardEngine
+
+# Run from the nom_data_refiner directory:
+#   python -m unittest discover tests
+
+
+def create_pillars(count, seed):
+    # Pillars with mainnet-like weights, reward shares and momentum stats
+    rnd = random.Random(seed)
+    pillars = []
+    for i in range(count):
+        weight = int((15000 + 2000000 / (1 + i) ** 0.8 * rnd.uniform(0.8, 1.2)) * NomData.DECIMALS)
+        expected_momentums = rnd.randint(10, 40)
+        pillars.append({
+            'name': f'Pillar{i}',
+            'rank': i,
+            'type': 1,
+            'ownerAddress': f'z1qpillarowner{i:026d}',
+            'producerAddress': f'z1qpillarproducer{i:023d}',
+            'withdrawAddress': f'z1qpillarwithdraw{i:023d}',
+            'isRevocable': False,
+            'revokeCooldown': 0,
+            'revokeTimestamp': 0,
+            'giveMomentumRewardPercentage': rnd.choice((0, 10, 25, 50, 75, 100)),
+            'giveDelegateRewardPercentage': rnd.choice((0, 50, 75, 90, 100)),
+            'currentStats': {'producedMomentums': rnd.randint(0, expected_momentums),
+                             'expectedMomentums': expected_momentums},
+            'weight': str(weight)
+        })
+    pillars.sort(key=lambda p: -int(p['weight']))
+    for rank, pillar in enumerate(pillars):
+        pillar['rank'] = rank
+    return pillars
+
+
+class FakeRpc(object):
+    # Answers the NomData calls with a fixed node state
+
+    def __init__(self, pillars):
+        self.pillars = pillars
+        self.results = {
+            'ledger.getFrontierMomentum': lambda params: {'height': 5000000, 'timestamp': 0},
+            'stats.processInfo': lambda params: {'version': 'v0.0.7'},
+            'embedded.token.getByZts': lambda params: {
+                'totalSupply': str((9800000 if params[0] == NomData.ZNN_ZTS_ID else 180000000) * NomData.DECIMALS)},
+            'ledger.getAccountInfoByAddress': lambda params: {'balanceInfoMap': {
+                NomData.ZNN_ZTS_ID: {'balance': str(4000000 * NomData.DECIMALS)},
+                NomData.ZNN_ETH_LP_ZTS_ID: {'balance': str(150 * 10 ** 18)}}},
+            'embedded.liquidity.getLiquidityInfo': lambda params: {
+                'znnReward': str(1000 * NomData.DECIMALS), 'qsrReward': str(5000 * NomData.DECIMALS)},
+            'embedded.sentinel.getAllActive': lambda params: {'count': 100, 'list': []},
+            'embedded.pillar.getAll': lambda params: {
+                'count': len(self.pillars),
+                'list': self.pillars[params[0] * params[1]:(params[0] + 1) * params[1]]}
+        }
+
+    async def call(self, method, params=[]):
+        return {'jsonrpc': '2.0', 'id': 1, 'result': self.results[method](params)}
+
+    async def get_all_pages(self, method, params=[], page_size=1024):
+        page_index = 0
+        while True:
+            result = (await self.call(method, params + [page_index, page_size]))['result']
+            yield result
+            page_index = page_index + 1
+            if page_index * page_size >= result['count']:
+                break
+
+
+class FakePool(object):
+    lp_token_total_supply = 1500
+    liquidity_usd = 2000000
+    yearly_trading_fees_usd = 150000
+
+
+@unittest.skipUnless(PillarRewardEngine.AVAILABLE, 'NumPy is not installed')
+class TestPillarRewardEngine(unittest.TestCase):
+    # The vectorized engine has to match the scalar per-Pillar loop
+
+    PILLAR_COUNT = 500
+
+    # Relative tolerance of the float differences between the two paths
+    TOLERANCE = 1e-9
+
+    def get_snapshot(self, vectorized):
+        # Each path gets its own node with the same Pillar set
+        nom_data = NomData()
+        nom_data.node_urls = ['fake']
+        nom_data.rpc = FakeRpc(create_pillars(self.PILLAR_COUNT, seed=1))
+        nom_data.use_vectorized_pillar_engine = vectorized
+        return asyncio.run(nom_data.update('fake', '', '', 2.5, 0.3, FakePool()))
+
+    def assert_close(self, a, b, name):
+        self.assertTrue(math.isclose(a, b, rel_tol=self.TOLERANCE, abs_tol=1e-12),
+                        f'{name}: {a} != {b}')
+
+    def test_vectorized_matches_scalar(self):
+        scalar = self.get_snapshot(vectorized=False)
+        vectorized = self.get_snapshot(vectorized=True)
+
+        self.assertEqual(len(scalar.pillars), self.PILLAR_COUNT)
+        self.assertEqual(list(scalar.pillars), list(vectorized.pillars))
+        for owner_address, pillar in scalar.pillars.items():
+            vectorized_pillar = vectorized.pillars[owner_address]
+            for key in ('apr', 'delegateApr', 'epochMomentumRewards', 'epochDelegateRewards'):
+                self.assert_close(pillar[key], vectorized_pillar[key], f'{owner_address} {key}')
+
+        for field in ('delegate_apr', 'pillar_apr_top_30', 'pillar_apr_not_top_30'):
+            self.assert_close(getattr(scalar, field), getattr(vectorized, field), field)
+
+        # The Pillars must actually earn rewards for the comparison to mean anything
+        self.assertGreater(scalar.delegate_apr, 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
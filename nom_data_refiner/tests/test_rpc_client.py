@@ -0,0 +1,109 @@
+import asyncio
+import unittest
+from utils.rpc_client import RpcClient
+
+# Run from the nom_data_refiner directory:
+#   python -m unittest discover tests
+
+
+class FakeNodePool(object):
+    # Records the posted requests and answers them like a node would
+
+    def __init__(self, item_count=0, batch_response=None):
+        self.item_count = item_count
+        self.batch_response = batch_response
+        self.posts = []
+
+    async def post(self, data):
+        self.posts.append(data)
+        if isinstance(data, list):
+            if self.batch_response is not None:
+                return self.batch_response
+            return [self.answer(request) for request in data]
+        return self.answer(data)
+
+    def answer(self, request):
+        if request['method'] == 'embedded.pillar.getAll':
+            page_index, page_size = request['params']
+            start = page_index * page_size
+            end = min(start + page_size, self.item_count)
+            return {'jsonrpc': '2.0', 'id': request['id'], 'result': {
+                'count': self.item_count, 'list': list(range(start, end))}}
+        return {'jsonrpc': '2.0', 'id': request['id'], 'result': request['params']}
+
+
+class TestRpcClient(unittest.TestCase):
+
+    def create_client(self, node_pool):
+        client = RpcClient('fake')
+        client.node_pool = node_pool
+        return client
+
+    def call_concurrently(self, client, count):
+        async def run():
+            return await asyncio.gather(
+                *[client.call('test.echo', [i]) for i in range(count)])
+        return asyncio.run(run())
+
+    def test_concurrent_calls_are_sent_as_one_batch(self):
+        node_pool = FakeNodePool()
+        responses = self.call_concurrently(self.create_client(node_pool), 3)
+
+        self.assertEqual(len(node_pool.posts), 1)
+        self.assertEqual(len(node_pool.posts[0]), 3)
+        self.assertEqual([r['result'] for r in responses], [[0], [1], [2]])
+
+    def test_batch_error_falls_back_to_individual_calls(self):
+        node_pool = FakeNodePool(batch_response={
+            'jsonrpc': '2.0', 'id': None, 'error': {'code': -32600, 'message': 'batch'}})
+        client = self.create_client(node_pool)
+        responses = self.call_concurrently(client, 3)
+
+        self.assertFalse(client.batch_supported)
+        self.assertEqual(len(node_pool.posts), 4)
+        self.assertEqual([r['result'] for r in responses], [[0], [1], [2]])
+
+    def test_transport_failure_is_not_resent(self):
+        node_pool = FakeNodePool(batch_response={})
+        client = self.create_client(node_pool)
+        responses = self.call_concurrently(client, 3)
+
+        self.assertTrue(client.batch_supported)
+        self.assertEqual(len(node_pool.posts), 1)
+        self.assertEqual(responses, [{}, {}, {}])
+
+    def test_missing_responses_are_resent_individually(self):
+        node_pool = FakeNodePool()
+        node_pool.batch_response = [{'jsonrpc': '2.0', 'id': 1, 'result': [0]}]
+        responses = self.call_concurrently(self.create_client(node_pool), 3)
+
+        self.assertEqual(len(node_pool.posts), 3)
+        self.assertEqual([r['result'] for r in responses], [[0], [1], [2]])
+
+    def get_all_items(self, item_count, page_size):
+        node_pool = FakeNodePool(item_count)
+        client = self.create_client(node_pool)
+
+        async def run():
+            items = []
+            async for result in client.get_all_pages('embedded.pillar.getAll', [], page_size):
+                items.extend(result['list'])
+            return items
+        return asyncio.run(run()), node_pool
+
+    def test_get_all_pages_returns_every_item_in_order(self):
+        for item_count in (0, 1, 10, 11, 95):
+            items, _ = self.get_all_items(item_count, 10)
+            self.assertEqual(items, list(range(item_count)))
+
+    def test_get_all_pages_requests_each_page_once(self):
+        _, node_pool = self.get_all_items(95, 10)
+        page_indexes = []
+        for data in node_pool.posts:
+            requests = data if isinstance(data, list) else [data]
+            page_indexes.extend(request['params'][0] for request in requests)
+        self.assertEqual(sorted(page_indexes), list(range(10)))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,114 @@
+import shutil
+import tempfile
+import unittest
+from utils.time_series_store import TimeSeriesSegment, TimeSeriesStore
+
+# Run from the nom_data_refiner directory:
+#   python -m unittest discover tests
+
+# Start of a UTC day
+DAY_START = 1700006400
+HOUR = 3600
+
+
+class TestTimeSeriesSegment(unittest.TestCase):
+
+    def test_decode_returns_the_encoded_frames(self):
+        segment = TimeSeriesSegment(DAY_START)
+        frames = [(DAY_START + 10, {0: 5, 1: -3}),
+                  (DAY_START + 20, {0: 5, 1: 7}),
+                  (DAY_START + 25, {1: -100000000000}),
+                  (DAY_START + 40, {0: 1, 2: 0})]
+        data = b''.join(segment.encode_frame(timestamp, values) for timestamp, values in frames)
+
+        decoded = TimeSeriesSegment(DAY_START)
+        decoded.decode(data)
+        self.assertEqual(decoded.size, len(data))
+        self.assertEqual(decoded.timestamps, [timestamp for timestamp, _ in frames])
+        self.assertEqual(decoded.get_points(0, 0, DAY_START + 60),
+                         [[DAY_START + 10, 5], [DAY_START + 20, 5], [DAY_START + 40, 1]])
+        self.assertEqual(decoded.get_points(1, 0, DAY_START + 60),
+                         [[DAY_START + 10, -3], [DAY_START + 20, 7], [DAY_START + 25, -100000000000]])
+        self.assertEqual(decoded.get_points(2, DAY_START + 30, DAY_START + 60), [[DAY_START + 40, 0]])
+
+    def test_decode_leaves_out_a_truncated_frame(self):
+        segment = TimeSeriesSegment(DAY_START)
+        data = segment.encode_frame(DAY_START + 1, {0: 1}) + \
+            segment.encode_frame(DAY_START + 2, {0: 1000000})
+
+        decoded = TimeSeriesSegment(DAY_START)
+        decoded.decode(data[:-1])
+        self.assertEqual(decoded.timestamps, [DAY_START + 1])
+
+    def test_rollup_averages_the_frames_of_each_bucket(self):
+        segment = TimeSeriesSegment(DAY_START)
+        segment.encode_frame(DAY_START, {0: 10})
+        segment.encode_frame(DAY_START + 600, {0: 20, 1: 4})
+        segment.encode_frame(DAY_START + HOUR + 60, {0: 30})
+        self.assertEqual(segment.get_rollup(HOUR),
+                         [(DAY_START, {0: 15, 1: 4}), (DAY_START + HOUR, {0: 30})])
+
+
+class TestTimeSeriesStore(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def append_hours(self, store, day_start, hours):
+        # Four samples per hour, the value is the hour
+        for hour in hours:
+            for minute in (0, 15, 30, 45):
+                store.append(day_start + hour * HOUR + minute * 60, {'a': hour + 0.5, 'b': None})
+
+    def test_raw_points_are_read_back_after_a_restart(self):
+        store = TimeSeriesStore(self.directory)
+        store.append(DAY_START + 1, {'a': 1.25, 'b': 2})
+        store.append(DAY_START + 2, {'a': 1.25})
+        store.append(DAY_START + 3, {'a': -0.000001, 'b': 3})
+
+        store = TimeSeriesStore(self.directory)
+        self.assertEqual(store.get_range('a', DAY_START, DAY_START + 10),
+                         [[DAY_START + 1, 1.25], [DAY_START + 2, 1.25], [DAY_START + 3, -0.000001]])
+        self.assertEqual(store.get_range('b', DAY_START, DAY_START + 10),
+                         [[DAY_START + 1, 2], [DAY_START + 3, 3]])
+        self.assertEqual(store.get_range('c', DAY_START, DAY_START + 10), [])
+
+    def test_closed_days_are_rolled_up(self):
+        store = TimeSeriesStore(self.directory)
+        self.append_hours(store, DAY_START, range(24))
+        store.append(DAY_START + 86400, {'a': 0})
+
+        store = TimeSeriesStore(self.directory)
+        hourly = store.get_range('a', DAY_START, DAY_START + 86400, HOUR)
+        self.assertEqual(hourly, [[DAY_START + hour * HOUR, hour + 0.5] for hour in range(24)])
+        daily = store.get_range('a', DAY_START, DAY_START + 86400, 86400)
+        self.assertEqual(daily, [[DAY_START, 12]])
+
+    def test_latest_day_is_not_rolled_up_before_it_is_closed(self):
+        store = TimeSeriesStore(self.directory)
+        self.append_hours(store, DAY_START - 2 * 86400, range(24))
+        self.append_hours(store, DAY_START, range(6))
+
+        # After a restart a query long enough for the hourly rollups arrives
+        # before the first append of the day
+        store = TimeSeriesStore(self.directory)
+        hourly = store.get_range('a', DAY_START - 2 * 86400, DAY_START + 86400)
+        self.assertEqual(len(hourly), 24 + 6)
+        self.append_hours(store, DAY_START, range(6, 24))
+        store.append(DAY_START + 86400, {'a': 0})
+
+        hourly = store.get_range('a', DAY_START, DAY_START + 86400, HOUR)
+        self.assertEqual(hourly, [[DAY_START + hour * HOUR, hour + 0.5] for hour in range(24)])
+
+    def test_query_is_limited_to_the_stored_days(self):
+        store = TimeSeriesStore(self.directory)
+        store.append(DAY_START + 1, {'a': 1})
+        self.assertEqual(store.get_range('a', 0, 10 ** 12), [[DAY_START + 1, 1]])
+        self.assertEqual(store.get_range('a', DAY_START + 2, DAY_START + 1), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,200 @@
+import asyncio
+import gzip
+import hashlib
+import urllib.parse
+
+
+class ApiResource(object):
+    # An encoded document with its gzip encoding and ETag, computed once
+    # when the document is set.
+
+    # Bodies smaller than this are not worth compressing
+    MIN_GZIP_SIZE = 256
+
+    __slots__ = ('data', 'body', 'content_type', 'gzip_body', 'etag')
+
+    def __init__(self, data, body, content_type='application/json'):
+        self.data = data
+        self.body = body
+        self.content_type = content_type
+        self.gzip_body = gzip.compress(
+            body, mtime=0) if len(body) >= self.MIN_GZIP_SIZE else None
+        self.etag = '"' + hashlib.blake2b(body, digest_size=16).hexdigest() + '"'
+
+
+class ApiServer(object):
+    # Minimal asyncio HTTP/1.1 server that serves JSON documents from memory.
+    # Supports GET and HEAD, keep-alive connections, ETag/If-None-Match and
+    # gzip content encoding. Change feeds are streamed as Server-Sent Events.
+    # Query handlers compute their documents per request.
+
+    # Maximum number of request headers
+    MAX_HEADERS = 100
+
+    # Seconds an idle keep-alive connection is kept open
+    KEEP_ALIVE_TIMEOUT = 30
+
+    # Seconds between heartbeats on idle event streams
+    HEARTBEAT_INTERVAL = 15
+
+    REASONS = {200: 'OK', 304: 'Not Modified', 400: 'Bad Request',
+               404: 'Not Found', 405: 'Method Not Allowed'}
+
+    def __init__(self, host, port, encode):
+        self.host = host
+        self.port = port
+        self.encode = encode
+        self.resources = {}
+        self.groups = {}
+        self.feeds = {}
+        self.handlers = {}
+        self.server = None
+
+    async def start(self):
+        self.server = await asyncio.start_server(self.__handle, self.host, self.port)
+        print(f'API server listening on {self.host}:{self.port}')
+
+    def close(self):
+        if self.server is not None:
+            self.server.close()
+
+    def set(self, path, data):
+        # Documents are only encoded again if a different object is set
+        resource = self.resources.get(path)
+        if resource is None or resource.data is not data:
+            self.resources[path] = ApiResource(data, self.encode(data))
+
+    def set_group(self, prefix, documents):
+        # Sets one document per key under the prefix and removes the documents
+        # of keys that are no longer present
+        paths = set()
+        for key, data in documents.items():
+            path = f'{prefix}/{key}'
+            self.set(path, data)
+            paths.add(path)
+        for path in self.groups.get(prefix, set()) - paths:
+            self.resources.pop(path, None)
+        self.groups[prefix] = paths
+
+    def set_feed(self, path, feed):
+        self.feeds[path] = feed
+
+    def set_handler(self, path, handler, content_type='application/json'):
+        # The handler is called with the parsed query parameters and returns
+        # the document or None if there is none. Documents of other content
+        # types than JSON are returned as text. Invalid parameters raise
+        # ValueError, which is answered with 400.
+        self.handlers[path] = (handler, content_type)
+
+    async def __handle(self, reader, writer):
+        try:
+            while True:
+                request_line = await asyncio.wait_for(reader.readline(), self.KEEP_ALIVE_TIMEOUT)
+                if not request_line:
+                    break
+
+                headers = await self.__read_headers(reader)
+                parts = request_line.decode('latin-1').split()
+                if headers is None or len(parts) != 3:
+                    writer.write(self.__get_response(400, b''))
+                    break
+                method, target, version = parts
+
+                # Discard request bodies, they are not used
+                content_length = int(headers.get('content-length', 0))
+                if content_length > 0:
+                    await reader.readexactly(content_length)
+
+                feed = self.feeds.get(target.split('?', 1)[0].rstrip('/'))
+                if feed is not None and method == 'GET':
+                    await self.__stream(feed, writer)
+                    break
+
+                keep_alive = version == 'HTTP/1.1' and headers.get(
+                    'connection', '').lower() != 'close'
+                writer.write(self.__respond(method, target, headers))
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (asyncio.TimeoutError, asyncio.IncompleteReadError, ConnectionError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    async def __stream(self, feed, writer):
+        writer.write(self.__get_response(200, b'', {'Content-Type': 'text/event-stream',
+                                                    'Cache-Control': 'no-cache',
+                                                    'Access-Control-Allow-Origin': '*'}, head=True, stream=True))
+        queue = feed.subscribe()
+        try:
+            while True:
+                try:
+                    event = await asyncio.wait_for(queue.get(), self.HEARTBEAT_INTERVAL)
+                except asyncio.TimeoutError:
+                    event = b': heartbeat\n\n'
+
+                # None ends the subscription of a subscriber that fell behind
+                if event is None:
+                    break
+                writer.write(event)
+                await writer.drain()
+        finally:
+            feed.unsubscribe(queue)
+
+    async def __read_headers(self, reader):
+        headers = {}
+        for _ in range(self.MAX_HEADERS):
+            line = await reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                return headers
+            name, _, value = line.decode('latin-1').partition(':')
+            headers[name.strip().lower()] = value.strip()
+        return None
+
+    def __respond(self, method, target, headers):
+        if method not in ('GET', 'HEAD'):
+            return self.__get_response(405, b'', {'Allow': 'GET, HEAD'})
+
+        path, _, query = target.partition('?')
+        path = path.rstrip('/')
+        resource = self.resources.get(path)
+        handler = self.handlers.get(path)
+        if handler is not None:
+            handler, content_type = handler
+            try:
+                data = handler(urllib.parse.parse_qs(query))
+            except ValueError:
+                return self.__get_response(400, b'', head=method == 'HEAD')
+            if data is None:
+                resource = None
+            elif content_type == 'application/json':
+                resource = ApiResource(data, self.encode(data))
+            else:
+                resource = ApiResource(data, data.encode(), content_type)
+        if resource is None:
+            return self.__get_response(404, b'', head=method == 'HEAD')
+
+        response_headers = {'Content-Type': resource.content_type,
+                            'ETag': resource.etag,
+                            'Cache-Control': 'no-cache',
+                            'Vary': 'Accept-Encoding',
+                            'Access-Control-Allow-Origin': '*'}
+
+        if_none_match = headers.get('if-none-match')
+        if if_none_match is not None and (if_none_match.strip() == '*' or resource.etag in if_none_match):
+            return self.__get_response(304, b'', response_headers, head=True)
+
+        body = resource.body
+        if resource.gzip_body is not None and 'gzip' in headers.get('accept-encoding', ''):
+            body = resource.gzip_body
+            response_headers['Content-Encoding'] = 'gzip'
+        return self.__get_response(200, body, response_headers, head=method == 'HEAD')
+
+    def __get_response(self, status, body, headers={}, head=False, stream=False):
+        lines = [f'HTTP/1.1 {status} {self.REASONS[status]}']
+        for name, value in headers.items():
+            lines.append(f'{name}: {value}')
+        if status != 304 and not stream:
+            lines.append(f'Content-Length: {len(body)}')
+        head_bytes = ('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1')
+        return head_bytes if head else head_bytes + body
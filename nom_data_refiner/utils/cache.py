@@ -0,0 +1,98 @@
+import asyncio
+import json
+import os
+import time
+from utils.metrics import Metrics
+
+
+class Cache(object):
+    # Keeps cached values in memory with a TTL per lookup. Expired values are
+    # still served while they are refreshed in the background. The entries
+    # are written to a snapshot file at most every snapshot interval, so the
+    # cache survives restarts without touching the disk on every lookup.
+
+    DEFAULT_SNAPSHOT_INTERVAL = 60
+
+    def __init__(self, snapshot_file=None, snapshot_interval=DEFAULT_SNAPSHOT_INTERVAL):
+        self.entries = {}
+        self.refresh_tasks = {}
+        self.snapshot_file = snapshot_file
+        self.snapshot_interval = snapshot_interval
+        self.snapshot_timestamp = 0
+        self.dirty = False
+        if snapshot_file is not None:
+            self.load_snapshot()
+
+    def get(self, key):
+        entry = self.entries.get(key)
+        return entry['value'] if entry is not None else None
+
+    def set(self, key, value):
+        self.entries[key] = {'value': value, 'timestamp': time.time()}
+        self.dirty = True
+
+    async def get_or_refresh(self, key, ttl, refresh, max_stale=None):
+        # The refresh coroutine function returns the new value or None on failure.
+        # Values older than ttl + max_stale are refreshed before returning.
+        max_stale = ttl if max_stale is None else max_stale
+        entry = self.entries.get(key)
+        age = time.time() - entry['timestamp'] if entry is not None else None
+
+        if entry is None or age > ttl + max_stale:
+            Metrics.inc('cache_requests_total', key=key, result='miss')
+            task = self.refresh_tasks.get(key)
+            value = await (task if task is not None else self.__refresh(key, refresh))
+            if value is None and entry is not None:
+                print(f'Refresh failed. Used {key} cache')
+                return entry['value']
+            return value
+
+        if age > ttl:
+            Metrics.inc('cache_requests_total', key=key, result='stale')
+        else:
+            Metrics.inc('cache_requests_total', key=key, result='hit')
+
+        if age > ttl and key not in self.refresh_tasks:
+            print(f'Used {key} cache, refreshing in the background')
+            self.refresh_tasks[key] = asyncio.ensure_future(
+                self.__refresh(key, refresh))
+        else:
+            print(f'Used {key} cache')
+        return entry['value']
+
+    async def __refresh(self, key, refresh):
+        try:
+            value = await refresh()
+            if value is not None:
+                self.set(key, value)
+            else:
+                Metrics.inc('cache_refresh_failures_total', key=key)
+            return value
+        except Exception as e:
+            Metrics.inc('cache_refresh_failures_total', key=key)
+            print(f'Cache refresh for {key} failed: {str(e)}')
+            return None
+        finally:
+            self.refresh_tasks.pop(key, None)
+
+    def load_snapshot(self):
+        try:
+            with open(self.snapshot_file) as f:
+                self.entries = json.load(f)
+        except (OSError, ValueError):
+            self.entries = {}
+
+    def save_snapshot(self, force=False):
+        # Write-behind: only write changed entries once per snapshot interval
+        if self.snapshot_file is None or not self.dirty:
+            return
+        if not force and self.snapshot_timestamp + self.snapshot_interval > time.time():
+            return
+
+        os.makedirs(os.path.dirname(self.snapshot_file), exist_ok=True)
+        tmp_file = f'{self.snapshot_file}.tmp'
+        with open(tmp_file, 'w') as outfile:
+            json.dump(self.entries, outfile)
+        os.replace(tmp_file, self.snapshot_file)
+        self.snapshot_timestamp = time.time()
+        self.dirty = False
@@ -0,0 +1,96 @@
+import asyncio
+import json
+
+
+class ChangeFeed(object):
+    # Publishes the changes of the NoM data and the Pillar data as
+    # Server-Sent Events. A new subscriber first receives the full state,
+    # after that only the changed fields are sent, keyed by momentum height.
+    # APR changes smaller than the threshold are held back until they add up.
+
+    # Events queued for a subscriber before it is dropped as too slow
+    MAX_QUEUED_EVENTS = 100
+
+    # Keys excluded from the diffs. They change on every update and the
+    # momentum height is already the key of every event.
+    IGNORED_KEYS = ('timestamp', 'momentumHeight')
+
+    def __init__(self, apr_threshold=0):
+        self.apr_threshold = apr_threshold
+        self.momentum_height = 0
+        self.nom_data = {}
+        self.pillars = {}
+        self.subscribers = set()
+        self.snapshot_event = None
+
+    def subscribe(self):
+        # One extra slot for the None that ends a dropped subscription
+        queue = asyncio.Queue(self.MAX_QUEUED_EVENTS + 1)
+        if self.snapshot_event is None:
+            self.snapshot_event = self.__encode_event('snapshot', {
+                'momentumHeight': self.momentum_height,
+                'nomData': self.nom_data,
+                'pillars': self.pillars
+            })
+        queue.put_nowait(self.snapshot_event)
+        self.subscribers.add(queue)
+        return queue
+
+    def unsubscribe(self, queue):
+        self.subscribers.discard(queue)
+
+    def publish(self, momentum_height, nom_data, pillars):
+        nom_data_diff = self.__get_diff(self.nom_data, nom_data)
+        pillars_diff = {}
+        for owner_address, pillar in pillars.items():
+            previous_pillar = self.pillars.get(owner_address)
+            if previous_pillar is pillar:
+                continue
+            if previous_pillar is None:
+                pillars_diff[owner_address] = pillar
+                self.pillars[owner_address] = pillar
+                continue
+            diff = self.__get_diff(previous_pillar, pillar)
+            if len(diff) > 0:
+                pillars_diff[owner_address] = diff
+                self.pillars[owner_address] = {**previous_pillar, **diff}
+        removed_pillars = [
+            owner_address for owner_address in self.pillars if owner_address not in pillars]
+        for owner_address in removed_pillars:
+            del self.pillars[owner_address]
+
+        self.nom_data = {**self.nom_data, **nom_data_diff}
+        self.momentum_height = momentum_height
+        self.snapshot_event = None
+        if len(nom_data_diff) == 0 and len(pillars_diff) == 0 and len(removed_pillars) == 0:
+            return
+
+        event = self.__encode_event('diff', {
+            'momentumHeight': momentum_height,
+            'nomData': nom_data_diff,
+            'pillars': pillars_diff,
+            'removedPillars': removed_pillars
+        })
+        for queue in list(self.subscribers):
+            if queue.qsize() >= self.MAX_QUEUED_EVENTS:
+                # Drop subscribers that don't keep up, they reconnect for a new snapshot
+                self.subscribers.discard(queue)
+                queue.put_nowait(None)
+            else:
+                queue.put_nowait(event)
+
+    def __get_diff(self, previous, current):
+        # The state keeps the values as last sent, so small APR moves add up until they pass the threshold
+        diff = {}
+        for key, value in current.items():
+            if key in self.IGNORED_KEYS or previous.get(key) == value:
+                continue
+            if key not in previous or not self.__is_apr(key) or abs(value - previous[key]) >= self.apr_threshold:
+                diff[key] = value
+        return diff
+
+    def __is_apr(self, key):
+        return key.endswith('Apr') or key == 'apr' or key.startswith('pillarApr')
+
+    def __encode_event(self, event, data):
+        return f'id: {self.momentum_height}\nevent: {event}\ndata: {json.dumps(data, separators=(",", ":"))}\n\n'.encode()
@@ -0,0 +1,65 @@
+import time
+
+
+class CircuitBreaker(object):
+    # Stops sending requests to a failing upstream. After a number of
+    # consecutive failures the circuit opens and requests fail fast. When the
+    # reset timeout has passed a single probe request is let through
+    # (half-open): a success closes the circuit, a failure opens it again for
+    # twice as long, up to the maximum reset timeout.
+
+    CLOSED = 'closed'
+    HALF_OPEN = 'half_open'
+    OPEN = 'open'
+
+    STATES = (CLOSED, HALF_OPEN, OPEN)
+
+    def __init__(self, failure_threshold, reset_timeout, max_reset_timeout):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.max_reset_timeout = max_reset_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self.open_timeout = reset_timeout
+        self.open_until = 0
+        self.probe_timestamp = 0
+
+    def allow_request(self):
+        if self.state == self.CLOSED:
+            return True
+
+        now = time.monotonic()
+        if self.state == self.OPEN:
+            if now < self.open_until:
+                return False
+            self.state = self.HALF_OPEN
+            self.probe_timestamp = now
+            return True
+
+        # Only one probe at a time. A probe that never finished, because it
+        # was cancelled, is replaced after the reset timeout.
+        if now - self.probe_timestamp < self.reset_timeout:
+            return False
+        self.probe_timestamp = now
+        return True
+
+    def record_success(self):
+        self.state = self.CLOSED
+        self.failures = 0
+        self.open_timeout = self.reset_timeout
+
+    def record_failure(self):
+        self.failures = self.failures + 1
+        if self.state == self.HALF_OPEN:
+            self.open_timeout = min(
+                self.open_timeout * 2, self.max_reset_timeout)
+            self.__open()
+        elif self.state == self.CLOSED and self.failures >= self.failure_threshold:
+            self.__open()
+
+    def get_state_index(self):
+        return self.STATES.index(self.state)
+
+    def __open(self):
+        self.state = self.OPEN
+        self.open_until = time.monotonic() + self.open_timeout
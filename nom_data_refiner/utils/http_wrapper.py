@@ -1,27 +1,243 @@
+import asyncio
 import requests
 import json
+import random
+import threading
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
+from urllib.parse import urlsplit
+from utils.metrics import Metrics
+from utils.circuit_breaker import CircuitBreaker
+from utils.retry_budget import RetryBudget
 
 
 class HttpWrapper(object):
 
-    @staticmethod
-    async def get(url):
+    # Default maximum number of requests in flight at the same time
+    DEFAULT_MAX_CONCURRENCY = 16
+
+    # Default number of pooled connections kept open per host
+    DEFAULT_POOL_SIZE = 10
+
+    # Default time in seconds an idle pooled connection is reused
+    DEFAULT_KEEP_ALIVE_TIMEOUT = 60
+
+    # Default timeouts in seconds for connecting and for waiting for the response
+    DEFAULT_CONNECT_TIMEOUT = 3.05
+    DEFAULT_READ_TIMEOUT = 15
+
+    # Default maximum number of retries of a failed request
+    DEFAULT_MAX_RETRIES = 2
+
+    # Consecutive failures after which a host's circuit opens, and the seconds
+    # until a probe request is let through, doubled on each failed probe
+    DEFAULT_CIRCUIT_FAILURE_THRESHOLD = 5
+    DEFAULT_CIRCUIT_RESET_TIMEOUT = 30
+    MAX_CIRCUIT_RESET_TIMEOUT = 600
+
+    # Backoff before the first retry in seconds, doubled for each further retry
+    RETRY_BACKOFF = 0.25
+    MAX_RETRY_BACKOFF = 4
+
+    # Retries per host are limited to this share of the requests in the
+    # window, with a minimum number of retries per window
+    RETRY_BUDGET_RATIO = 0.2
+    RETRY_BUDGET_MIN_RETRIES = 10
+    RETRY_BUDGET_WINDOW = 60
+
+    max_concurrency = DEFAULT_MAX_CONCURRENCY
+    pool_size = DEFAULT_POOL_SIZE
+    keep_alive_timeout = DEFAULT_KEEP_ALIVE_TIMEOUT
+    connect_timeout = DEFAULT_CONNECT_TIMEOUT
+    read_timeout = DEFAULT_READ_TIMEOUT
+    max_retries = DEFAULT_MAX_RETRIES
+    circuit_failure_threshold = DEFAULT_CIRCUIT_FAILURE_THRESHOLD
+    circuit_reset_timeout = DEFAULT_CIRCUIT_RESET_TIMEOUT
+
+    executor = None
+
+    # Calls submitted to the executor that haven't finished. A call whose
+    # coroutine was cancelled keeps its thread until the request returns.
+    calls_in_flight = 0
+    calls_in_flight_lock = threading.Lock()
+
+    # Pooled sessions and the time they were last used, keyed by host
+    sessions = {}
+    sessions_last_used = {}
+
+    # Circuit breakers and retry budgets, keyed by host
+    circuit_breakers = {}
+    retry_budgets = {}
+
+    @classmethod
+    def configure(cls, max_concurrency=DEFAULT_MAX_CONCURRENCY, pool_size=DEFAULT_POOL_SIZE,
+                  keep_alive_timeout=DEFAULT_KEEP_ALIVE_TIMEOUT, connect_timeout=DEFAULT_CONNECT_TIMEOUT,
+                  read_timeout=DEFAULT_READ_TIMEOUT, max_retries=DEFAULT_MAX_RETRIES,
+                  circuit_failure_threshold=DEFAULT_CIRCUIT_FAILURE_THRESHOLD,
+                  circuit_reset_timeout=DEFAULT_CIRCUIT_RESET_TIMEOUT):
+        max_concurrency = max(1, max_concurrency)
+        if max_concurrency != cls.max_concurrency and cls.executor is not None:
+            cls.executor.shutdown(wait=False)
+            cls.executor = None
+        cls.max_concurrency = max_concurrency
+
+        pool_size = max(1, pool_size)
+        if pool_size != cls.pool_size:
+            cls.close()
+        cls.pool_size = pool_size
+        cls.keep_alive_timeout = keep_alive_timeout
+        cls.connect_timeout = connect_timeout
+        cls.read_timeout = read_timeout
+        cls.max_retries = max(0, max_retries)
+        cls.circuit_failure_threshold = max(1, circuit_failure_threshold)
+        cls.circuit_reset_timeout = circuit_reset_timeout
+        cls.circuit_breakers = {}
+
+    @classmethod
+    def close(cls):
+        for session in cls.sessions.values():
+            session.close()
+        cls.sessions = {}
+        cls.sessions_last_used = {}
+
+    @classmethod
+    def __get_session(cls, url):
+        # Reuse one long-lived session per host so connections are kept alive
+        # across calls and refresh cycles instead of being reopened every time.
+        host = cls.__get_host(url)
+        now = time.monotonic()
+
+        # Servers drop idle connections, so recycle sessions that have been
+        # idle for longer than the keep-alive timeout.
+        session = cls.sessions.get(host)
+        if session is not None and now - cls.sessions_last_used[host] > cls.keep_alive_timeout:
+            session.close()
+            session = None
+
+        if session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=1,
+                                  pool_maxsize=cls.pool_size)
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+            cls.sessions[host] = session
+
+        cls.sessions_last_used[host] = now
+        return session
+
+    @classmethod
+    async def __run(cls, fn, *args, **kwargs):
+        # The requests library is blocking, so run the calls on a bounded
+        # thread pool to let concurrent coroutines overlap their round-trips.
+        # The pool size is the concurrency limit, further calls are queued.
+        if cls.executor is None:
+            cls.executor = ThreadPoolExecutor(
+                max_workers=cls.max_concurrency, thread_name_prefix='http')
+
+        with cls.calls_in_flight_lock:
+            cls.calls_in_flight = cls.calls_in_flight + 1
+        future = cls.executor.submit(lambda: fn(*args, **kwargs))
+        future.add_done_callback(cls.__finish_call)
+        return await asyncio.wrap_future(future)
+
+    @classmethod
+    def __finish_call(cls, future):
+        with cls.calls_in_flight_lock:
+            cls.calls_in_flight = cls.calls_in_flight - 1
+
+    @classmethod
+    def get_free_capacity(cls):
+        # Number of calls that can start without waiting for a thread
+        return cls.max_concurrency - cls.calls_in_flight
+
+    @classmethod
+    def __get_host(cls, url):
+        parts = urlsplit(url)
+        return f'{parts.scheme}://{parts.netloc}'
+
+    @classmethod
+    async def __request(cls, fn, url, retry, **kwargs):
+        # Returns the decoded response, or {} if the request failed. Requests to
+        # a host whose circuit is open fail immediately. Connection errors,
+        # timeouts, 429 and 5xx responses are retried with exponential backoff
+        # while the host's retry budget allows it.
+        key = cls.__get_host(url)
+        circuit_breaker = cls.circuit_breakers.get(key)
+        if circuit_breaker is None:
+            circuit_breaker = CircuitBreaker(cls.circuit_failure_threshold,
+                                             cls.circuit_reset_timeout, cls.MAX_CIRCUIT_RESET_TIMEOUT)
+            cls.circuit_breakers[key] = circuit_breaker
+        retry_budget = cls.retry_budgets.get(key)
+        if retry_budget is None:
+            retry_budget = RetryBudget(cls.RETRY_BUDGET_RATIO,
+                                       cls.RETRY_BUDGET_MIN_RETRIES, cls.RETRY_BUDGET_WINDOW)
+            cls.retry_budgets[key] = retry_budget
+        retry_budget.add_request()
+
+        host = urlsplit(url).netloc
+        attempt = 0
+        while True:
+            if not circuit_breaker.allow_request():
+                Metrics.inc('upstream_rejections_total', host=host)
+                return {}
+
+            r, retryable = await cls.__send(fn, url, host, circuit_breaker, **kwargs)
+            Metrics.set('circuit_breaker_state',
+                        circuit_breaker.get_state_index(), host=host)
+            if not retryable or not retry or attempt >= cls.max_retries or not retry_budget.try_retry():
+                return r
+
+            attempt = attempt + 1
+            Metrics.inc('upstream_retries_total', host=host)
+            await asyncio.sleep(min(cls.RETRY_BACKOFF * 2 ** (attempt - 1),
+                                    cls.MAX_RETRY_BACKOFF) * random.uniform(0.5, 1))
+
+    @classmethod
+    async def __send(cls, fn, url, host, circuit_breaker, **kwargs):
+        # Returns the decoded response or {}, and whether a failure is worth retrying.
+        # The latency and the errors are recorded per upstream host.
+        start = time.perf_counter()
         try:
-            response = requests.get(
-                url, timeout=10)
-            return json.loads(response.text) if response.status_code == 200 else {}
-        except requests.ReadTimeout as e:
-            print(f'Request timeout: {e}')
-            return {}
+            response = await cls.__run(fn, url, timeout=(cls.connect_timeout, cls.read_timeout), **kwargs)
+        except requests.RequestException as e:
+            Metrics.inc('upstream_errors_total', host=host)
+            circuit_breaker.record_failure()
+            print(f'Request to {host} failed: {e}')
+            return {}, True
+        finally:
+            Metrics.observe('upstream_request_duration_seconds',
+                            time.perf_counter() - start, host=host)
+
+        if response.status_code == 200:
+            try:
+                r = json.loads(response.text)
+            except ValueError:
+                Metrics.inc('upstream_errors_total', host=host)
+                circuit_breaker.record_failure()
+                print(f'Invalid response from {host}')
+                return {}, False
+            circuit_breaker.record_success()
+            return r, False
+
+        # Rate limits and server errors count against the host, other errors
+        # are caused by the request itself
+        Metrics.inc('upstream_errors_total', host=host)
+        if response.status_code == 429 or response.status_code >= 500:
+            circuit_breaker.record_failure()
+            return {}, True
+        circuit_breaker.record_success()
+        return {}, False
+
+    @staticmethod
+    async def get(url, retry=True):
+        session = HttpWrapper.__get_session(url)
+        return await HttpWrapper.__request(session.get, url, retry)
 
     @staticmethod
     async def post(url, data, headers={
         'Content-type': 'application/json',
-    }):
-        try:
-            response = requests.post(
-                url, headers=headers, json=data, timeout=15)
-            return json.loads(response.text) if response.status_code == 200 else {}
-        except requests.ReadTimeout as e:
-            print(f'Request timeout: {e}')
-            return {}
+    }, retry=True):
+        session = HttpWrapper.__get_session(url)
+        return await HttpWrapper.__request(session.post, url, retry, headers=headers, json=data)
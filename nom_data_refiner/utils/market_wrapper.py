@@ -11,8 +11,8 @@ class MarketWrapper(object):
             print(f'get_price_usd: {str(e)}')
             return 0
 
-    async def get_price_history(self, coin, currency):
-        r = await HttpWrapper.get(f'{self.BASE_URL}/coins/{coin}/market_chart?vs_currency={currency}&days=max&interval=daily')
+    async def get_price_history(self, coin, currency, days='max'):
+        r = await HttpWrapper.get(f'{self.BASE_URL}/coins/{coin}/market_chart?vs_currency={currency}&days={days}&interval=daily')
         try:
             return r['prices']
         except Exception as e:
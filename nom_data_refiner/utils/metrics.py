@@ -0,0 +1,148 @@
+import bisect
+import functools
+import inspect
+import time
+
+
+class Metrics(object):
+    # Process-wide counters, gauges and histograms, rendered in the
+    # Prometheus text format. Every metric is declared with its type and
+    # help text, the values are kept per set of label values.
+
+    PREFIX = 'nom_data_refiner_'
+
+    CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+    COUNTER = 'counter'
+    GAUGE = 'gauge'
+    HISTOGRAM = 'histogram'
+
+    # Upper bounds of the histogram buckets in seconds
+    BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+               0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+    METRICS = {
+        'rpc_request_duration_seconds': (HISTOGRAM, 'Duration of the node RPC calls by method'),
+        'rpc_errors_total': (COUNTER, 'Node RPC calls that failed or returned an error by method'),
+        'upstream_request_duration_seconds': (HISTOGRAM, 'Duration of the HTTP requests by upstream host'),
+        'upstream_errors_total': (COUNTER, 'HTTP requests that timed out, failed or returned an error status by upstream host'),
+        'upstream_retries_total': (COUNTER, 'Retried HTTP requests by upstream host'),
+        'upstream_rejections_total': (COUNTER, 'HTTP requests failed fast by an open circuit breaker by upstream host'),
+        'circuit_breaker_state': (GAUGE, 'State of the circuit breaker by upstream host (0 closed, 1 half-open, 2 open)'),
+        'cache_requests_total': (COUNTER, 'Cache lookups by key and result (hit, stale or miss)'),
+        'cache_refresh_failures_total': (COUNTER, 'Failed cache refreshes by key'),
+        'step_duration_seconds': (HISTOGRAM, 'Duration of the NoM data update steps'),
+        'task_duration_seconds': (HISTOGRAM, 'Duration of the scheduled refresh tasks'),
+        'task_failures_total': (COUNTER, 'Failed runs of the scheduled refresh tasks'),
+        'cycle_duration_seconds': (HISTOGRAM, 'Duration of a node data update and the output update it triggers by network'),
+        'momentum_height': (GAUGE, 'Momentum height of the latest outputs by network'),
+        'momentum_lag': (GAUGE, 'Momentums the latest outputs are behind the highest known frontier by network'),
+        'node_height': (GAUGE, 'Frontier momentum height by node'),
+        'subscription_connected': (GAUGE, 'Whether the momentum subscription is connected by node'),
+        'subscription_momentums_total': (COUNTER, 'Momentum notifications received by node')
+    }
+
+    # Values keyed by metric name and the sorted label items. Histograms keep
+    # the non-cumulative bucket counts followed by the sum and the count.
+    values = {}
+
+    @classmethod
+    def inc(cls, name, value=1, **labels):
+        series = cls.__get_series(name)
+        key = tuple(sorted(labels.items()))
+        series[key] = series.get(key, 0) + value
+
+    @classmethod
+    def set(cls, name, value, **labels):
+        cls.__get_series(name)[tuple(sorted(labels.items()))] = value
+
+    @classmethod
+    def observe(cls, name, value, **labels):
+        series = cls.__get_series(name)
+        key = tuple(sorted(labels.items()))
+        histogram = series.get(key)
+        if histogram is None:
+            histogram = [0] * (len(cls.BUCKETS) + 3)
+            series[key] = histogram
+
+        # The last bucket is +Inf
+        histogram[bisect.bisect_left(cls.BUCKETS, value)] += 1
+        histogram[-2] += value
+        histogram[-1] += 1
+
+    @classmethod
+    def reset(cls):
+        cls.values = {}
+
+    @classmethod
+    def render(cls):
+        lines = []
+        for name, series in cls.values.items():
+            metric_type, description = cls.METRICS[name]
+            full_name = cls.PREFIX + name
+            lines.append(f'# HELP {full_name} {description}')
+            lines.append(f'# TYPE {full_name} {metric_type}')
+            for key, value in series.items():
+                if metric_type != cls.HISTOGRAM:
+                    lines.append(f'{full_name}{cls.__format_labels(key)} {value}')
+                    continue
+
+                count = 0
+                for bound, bucket_count in zip(cls.BUCKETS + ('+Inf',), value):
+                    count = count + bucket_count
+                    lines.append(
+                        f'{full_name}_bucket{cls.__format_labels(key + (("le", bound),))} {count}')
+                lines.append(f'{full_name}_sum{cls.__format_labels(key)} {value[-2]}')
+                lines.append(f'{full_name}_count{cls.__format_labels(key)} {value[-1]}')
+        return '\n'.join(lines) + '\n'
+
+    @classmethod
+    def __get_series(cls, name):
+        if name not in cls.METRICS:
+            raise KeyError(f'Unknown metric {name}')
+        series = cls.values.get(name)
+        if series is None:
+            series = {}
+            cls.values[name] = series
+        return series
+
+    @classmethod
+    def __format_labels(cls, key):
+        if len(key) == 0:
+            return ''
+        return '{' + ','.join(f'{name}="{cls.__escape(value)}"' for name, value in key) + '}'
+
+    @staticmethod
+    def __escape(value):
+        return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def timed_step(fn):
+    # Times an update step of an object. The duration is observed in the step
+    # histogram and kept in the object's step_durations for the cycle log line.
+    # The step is named after the method without its __update_ prefix.
+    step = fn.__name__.replace('__update_', '', 1)
+
+    def record(self, start):
+        duration = time.perf_counter() - start
+        self.step_durations[step] = duration
+        Metrics.observe('step_duration_seconds', duration, step=step)
+
+    if inspect.iscoroutinefunction(fn):
+        @functools.wraps(fn)
+        async def timed_async(self, *args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return await fn(self, *args, **kwargs)
+            finally:
+                record(self, start)
+        return timed_async
+
+    @functools.wraps(fn)
+    def timed(self, *args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return fn(self, *args, **kwargs)
+        finally:
+            record(self, start)
+    return timed
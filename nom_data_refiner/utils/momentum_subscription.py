@@ -0,0 +1,95 @@
+import asyncio
+import json
+import time
+from utils.metrics import Metrics
+
+try:
+    import websockets
+except ImportError:
+    websockets = None
+
+
+class MomentumSubscription(object):
+    # Subscribes to the momentums of a node over WebSocket and calls the
+    # callback with the height of each new momentum. A dropped connection is
+    # reopened after a backoff that doubles with each failed attempt, trying
+    # the node URLs in turn.
+
+    AVAILABLE = websockets is not None
+
+    # Seconds before reconnecting, doubled on each failed attempt
+    RECONNECT_DELAY = 1
+    MAX_RECONNECT_DELAY = 60
+
+    # Seconds between pings that check that the connection is alive
+    PING_INTERVAL = 20
+
+    def __init__(self, urls, on_momentum):
+        self.urls = [urls] if isinstance(urls, str) else list(urls)
+        self.on_momentum = on_momentum
+        self.url = None
+        self.connected = False
+        self.momentum_height = 0
+
+        # Monotonic time of the latest notification or of the subscription
+        self.momentum_timestamp = 0
+
+    def is_live(self, timeout):
+        # Whether momentums are being received, or the subscription is new
+        return self.connected and time.monotonic() - self.momentum_timestamp < timeout
+
+    async def run(self):
+        delay = self.RECONNECT_DELAY
+        url_index = 0
+        while True:
+            self.url = self.urls[url_index % len(self.urls)]
+            try:
+                async with websockets.connect(self.url, ping_interval=self.PING_INTERVAL,
+                                              ping_timeout=self.PING_INTERVAL) as websocket:
+                    await websocket.send(json.dumps({'jsonrpc': '2.0', 'id': 1,
+                                                     'method': 'ledger.subscribe', 'params': ['momentums']}))
+                    async for message in websocket:
+                        self.__handle(message)
+                        if self.connected:
+                            delay = self.RECONNECT_DELAY
+                print(f'Momentum subscription to {self.url} closed')
+            except Exception as e:
+                print(f'Momentum subscription to {self.url} failed: {str(e)}')
+            finally:
+                self.__set_connected(False)
+
+            url_index = url_index + 1
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, self.MAX_RECONNECT_DELAY)
+
+    def __handle(self, message):
+        r = json.loads(message)
+
+        # The response to the subscribe request
+        if 'id' in r:
+            if 'error' in r:
+                raise Exception(r['error'].get('message', 'subscribe failed'))
+            print(f'Subscribed to the momentums of {self.url}')
+            self.momentum_timestamp = time.monotonic()
+            self.__set_connected(True)
+            return
+
+        if r.get('method') != 'ledger.subscription':
+            return
+        try:
+            result = r['params']['result']
+            momentums = result if isinstance(result, list) else [result]
+            height = max(momentum['height'] for momentum in momentums)
+        except (KeyError, TypeError, ValueError):
+            print('Error: __handle')
+            return
+
+        self.momentum_timestamp = time.monotonic()
+        Metrics.inc('subscription_momentums_total', node=self.url)
+        if height > self.momentum_height:
+            self.momentum_height = height
+            self.on_momentum(height)
+
+    def __set_connected(self, connected):
+        self.connected = connected
+        Metrics.set('subscription_connected', 1 if connected else 0, node=self.url)
@@ -0,0 +1,176 @@
+import asyncio
+import collections
+import time
+from utils.http_wrapper import HttpWrapper
+from utils.metrics import Metrics
+
+
+class NodeEndpoint(object):
+    # Keeps the recent latencies, the frontier height and the health of a node.
+
+    # Number of latency samples kept per node
+    LATENCY_WINDOW = 100
+
+    def __init__(self, url):
+        self.url = url
+        self.latencies = collections.deque(maxlen=self.LATENCY_WINDOW)
+        self.height = 0
+        self.failures = 0
+        self.unhealthy_until = 0
+
+    def add_latency(self, latency):
+        self.latencies.append(latency)
+
+    def add_success(self, latency):
+        self.add_latency(latency)
+        self.failures = 0
+        self.unhealthy_until = 0
+
+    def add_failure(self, cooldown, max_cooldown):
+        # The node is skipped for a cooldown that doubles with each consecutive failure
+        self.failures = self.failures + 1
+        self.unhealthy_until = time.monotonic() + \
+            min(cooldown * 2 ** (self.failures - 1), max_cooldown)
+
+    def is_healthy(self):
+        return time.monotonic() >= self.unhealthy_until
+
+    def get_latency_percentile(self, percentile):
+        if len(self.latencies) == 0:
+            return None
+        latencies = sorted(self.latencies)
+        return latencies[min(int(len(latencies) * percentile), len(latencies) - 1)]
+
+
+class NodePool(object):
+    # Sends requests to the fastest healthy node that is in sync. A request
+    # that is slower than the node's usual latency is hedged to the next
+    # node and the first successful response is used, as long as the HTTP
+    # thread pool has a free thread. Failed requests fail over to the next
+    # node. The frontier height of every node is probed
+    # periodically, nodes that are behind the highest frontier are skipped.
+
+    # Latency percentile of a node after which a request is hedged
+    HEDGE_PERCENTILE = 0.9
+
+    # Bounds and default of the hedge delay in seconds
+    MIN_HEDGE_DELAY = 0.05
+    MAX_HEDGE_DELAY = 2
+    DEFAULT_HEDGE_DELAY = 1
+
+    # Maximum number of nodes a request is sent to
+    MAX_ATTEMPTS = 3
+
+    # Nodes more than this many momentums behind the highest frontier are considered syncing
+    MAX_HEIGHT_LAG = 10
+
+    # Seconds between frontier height probes
+    PROBE_INTERVAL = 30
+
+    # Seconds a failed node is skipped for, doubled on each consecutive failure
+    FAILURE_COOLDOWN = 5
+    MAX_FAILURE_COOLDOWN = 300
+
+    def __init__(self, urls):
+        self.endpoints = [NodeEndpoint(url) for url in urls]
+        self.probe_timestamp = 0
+        self.probe_task = None
+
+    def get_max_height(self):
+        return max(endpoint.height for endpoint in self.endpoints)
+
+    def get_ranked_endpoints(self):
+        # Healthy nodes that are in sync come first, ordered by median latency.
+        # Nodes without latency samples are tried first so they get measured.
+        max_height = self.get_max_height()
+
+        def get_rank(endpoint):
+            in_sync = endpoint.height >= max_height - self.MAX_HEIGHT_LAG
+            latency = endpoint.get_latency_percentile(0.5)
+            return (not endpoint.is_healthy(), not in_sync, latency if latency is not None else 0)
+
+        return sorted(self.endpoints, key=get_rank)
+
+    async def post(self, body):
+        # Returns the response of the first node that answers, or {} if all attempts fail
+        if len(self.endpoints) > 1 and self.probe_task is None and time.monotonic() - self.probe_timestamp > self.PROBE_INTERVAL:
+            self.probe_task = asyncio.ensure_future(self.probe())
+
+        endpoints = self.get_ranked_endpoints()[:self.MAX_ATTEMPTS]
+        next_index = 1
+        pending = {asyncio.ensure_future(self.__post(endpoints[0], body))}
+        try:
+            while len(pending) > 0:
+                hedge_delay = self.__get_hedge_delay(
+                    endpoints[next_index - 1]) if next_index < len(endpoints) else None
+                done, pending = await asyncio.wait(pending, timeout=hedge_delay, return_when=asyncio.FIRST_COMPLETED)
+
+                for task in done:
+                    r = task.result()
+                    if r is not None:
+                        return r
+
+                # Hedge a slow request or fail over a failed one to the next node. A request that
+                # loses a hedge keeps its thread until it returns, so only hedge with a thread free.
+                if next_index < len(endpoints) and (len(done) > 0 or HttpWrapper.get_free_capacity() > 0):
+                    pending.add(asyncio.ensure_future(
+                        self.__post(endpoints[next_index], body)))
+                    next_index = next_index + 1
+            return {}
+        finally:
+            for task in pending:
+                task.cancel()
+
+    async def probe(self):
+        # Update the latency and frontier height of every node
+        try:
+            request = {'jsonrpc': '2.0', 'id': 0,
+                       'method': 'ledger.getFrontierMomentum', 'params': []}
+            await asyncio.gather(*[self.__post(endpoint, request) for endpoint in self.endpoints])
+            self.probe_timestamp = time.monotonic()
+        finally:
+            self.probe_task = None
+
+    def __get_hedge_delay(self, endpoint):
+        latency = endpoint.get_latency_percentile(self.HEDGE_PERCENTILE)
+        if latency is None:
+            return self.DEFAULT_HEDGE_DELAY
+        return min(max(latency, self.MIN_HEDGE_DELAY), self.MAX_HEDGE_DELAY)
+
+    async def __post(self, endpoint, body):
+        start = time.monotonic()
+        try:
+            # The pool fails over to the next node itself, so the request isn't retried
+            r = await HttpWrapper.post(endpoint.url, body, retry=False)
+        except asyncio.CancelledError:
+            # A request that lost a hedge took at least this long. The node's health is unknown.
+            endpoint.add_latency(time.monotonic() - start)
+            raise
+        except Exception as e:
+            print(f'Request to {endpoint.url} failed: {str(e)}')
+            r = None
+
+        # Empty responses are timeouts or HTTP errors
+        if not r:
+            endpoint.add_failure(self.FAILURE_COOLDOWN,
+                                 self.MAX_FAILURE_COOLDOWN)
+            return None
+
+        endpoint.add_success(time.monotonic() - start)
+        self.__update_height(endpoint, body, r)
+        return r
+
+    def __update_height(self, endpoint, body, r):
+        # Track the node's frontier height from frontier momentum responses
+        requests = body if isinstance(body, list) else [body]
+        responses = r if isinstance(r, list) else [r]
+        ids = [request['id'] for request in requests if isinstance(
+            request, dict) and request.get('method') == 'ledger.getFrontierMomentum']
+        for response in responses:
+            try:
+                if response['id'] in ids:
+                    endpoint.height = max(
+                        endpoint.height, response['result']['height'])
+                    Metrics.set('node_height', endpoint.height, node=endpoint.url)
+            except (KeyError, TypeError):
+                pass
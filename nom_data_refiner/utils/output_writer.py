@@ -0,0 +1,74 @@
+import gzip
+import json
+import os
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+class OutputWriter(object):
+    # Writes output files atomically: the data is written to a temporary file
+    # in the same directory which is then renamed over the destination, so
+    # readers never see a partially written file. Optionally writes
+    # precompressed .gz and .br siblings for static file serving.
+
+    ENCODING_COMPACT = 'compact'
+    ENCODING_PRETTY = 'pretty'
+
+    def __init__(self, encoding=ENCODING_PRETTY, write_gzip=False, write_brotli=False, only_if_changed=False):
+        self.encoding = encoding
+        self.write_gzip = write_gzip
+        self.write_brotli = write_brotli
+        self.only_if_changed = only_if_changed
+
+        if write_brotli and brotli is None:
+            print('Brotli is not installed, .br files are not written')
+            self.write_brotli = False
+
+        # Content of the files as last written, without their timestamps
+        self.written_content = {}
+
+    def encode(self, data):
+        # Pretty output keeps the 4 space indent of the original files, which
+        # orjson doesn't support
+        if self.encoding == self.ENCODING_PRETTY:
+            return json.dumps(data, indent=4).encode()
+        if orjson is not None:
+            return orjson.dumps(data)
+        return json.dumps(data, separators=(',', ':')).encode()
+
+    def write(self, data, file_name):
+        content = None
+        if self.only_if_changed:
+            content = {k: v for k, v in data.items() if k != 'timestamp'}
+            if self.written_content.get(file_name) == content and os.path.exists(file_name):
+                return
+
+        body = self.encode(data)
+
+        # Write the compressed siblings first so they are never older than the file
+        if self.write_gzip:
+            self.__write_atomically(gzip.compress(
+                body, mtime=0), f'{file_name}.gz')
+        if self.write_brotli:
+            self.__write_atomically(brotli.compress(body), f'{file_name}.br')
+        self.__write_atomically(body, file_name)
+
+        # Only recorded once written, so a failed write is retried on the next update
+        if content is not None:
+            self.written_content[file_name] = content
+
+    def __write_atomically(self, body, file_name):
+        tmp_file_name = f'{file_name}.tmp'
+        with open(tmp_file_name, 'wb') as outfile:
+            outfile.write(body)
+            outfile.flush()
+            os.fsync(outfile.fileno())
+        os.replace(tmp_file_name, file_name)
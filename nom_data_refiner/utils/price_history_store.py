@@ -0,0 +1,145 @@
+import bisect
+import json
+import mmap
+import os
+import struct
+
+
+class PriceHistoryStore(object):
+    # Stores price histories in a columnar binary format. Each coin/currency
+    # pair has a file of int64 millisecond timestamps and a file of float64
+    # prices with one entry per point, both sorted by timestamp. The files
+    # are memory-mapped on first use, so lookups don't parse the history.
+
+    TIMESTAMPS_FILE_EXTENSION = 'ts'
+    PRICES_FILE_EXTENSION = 'px'
+    META_FILE_NAME = 'meta.json'
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.columns = {}
+        os.makedirs(directory, exist_ok=True)
+
+    def get_refresh_timestamp(self, coin):
+        return self.__read_meta().get(coin, {}).get('timestamp', 0)
+
+    def set_refresh_timestamp(self, coin, timestamp):
+        meta = self.__read_meta()
+        meta[coin] = {'timestamp': timestamp}
+        with open(self.__get_file_name(self.META_FILE_NAME), 'w') as outfile:
+            json.dump(meta, outfile)
+
+    def get_count(self, coin, currency):
+        timestamps, _ = self.__get_columns(coin, currency)
+        return len(timestamps)
+
+    def get_last_timestamp(self, coin, currency):
+        timestamps, _ = self.__get_columns(coin, currency)
+        return timestamps[-1] if len(timestamps) > 0 else None
+
+    def get_range(self, coin, currency, start_timestamp, end_timestamp):
+        # Returns the [timestamp, price] points with start <= timestamp < end
+        timestamps, prices = self.__get_columns(coin, currency)
+        start = bisect.bisect_left(timestamps, start_timestamp)
+        end = bisect.bisect_left(timestamps, end_timestamp, lo=start)
+        return [[timestamps[i], prices[i]] for i in range(start, end)]
+
+    def get_price_at(self, coin, currency, timestamp):
+        # Returns the price of the last point at or before the timestamp
+        timestamps, prices = self.__get_columns(coin, currency)
+        i = bisect.bisect_right(timestamps, timestamp)
+        return prices[i - 1] if i > 0 else None
+
+    def merge(self, coin, currency, points):
+        # Replaces all stored points from the first new point onwards with the
+        # new points. Only the replaced tail of the files is rewritten.
+        if len(points) == 0:
+            return
+        timestamps, _ = self.__get_columns(coin, currency)
+        keep_count = bisect.bisect_left(timestamps, int(points[0][0]))
+        self.__close_columns(coin, currency)
+
+        with open(self.__get_column_file_name(coin, currency, self.TIMESTAMPS_FILE_EXTENSION), 'r+b') as f:
+            f.truncate(keep_count * 8)
+            f.seek(0, os.SEEK_END)
+            f.write(struct.pack(f'<{len(points)}q',
+                    *[int(p[0]) for p in points]))
+        with open(self.__get_column_file_name(coin, currency, self.PRICES_FILE_EXTENSION), 'r+b') as f:
+            f.truncate(keep_count * 8)
+            f.seek(0, os.SEEK_END)
+            f.write(struct.pack(f'<{len(points)}d',
+                    *[float(p[1]) for p in points]))
+
+    def export_json(self, coin, currencies):
+        # Same structure as the former market history JSON cache
+        data = {'timestamp': self.get_refresh_timestamp(coin)}
+        for currency in currencies:
+            timestamps, prices = self.__get_columns(coin, currency)
+            data[currency] = {str(timestamps[i]): prices[i]
+                              for i in range(len(timestamps))}
+        return {coin: data}
+
+    def import_json(self, data):
+        for coin, history in data.items():
+            for currency, m in history.items():
+                if currency == 'timestamp' or len(m) == 0:
+                    continue
+                points = sorted([[int(float(k)), v] for k, v in m.items()])
+                self.merge(coin, currency, points)
+            self.set_refresh_timestamp(coin, history.get('timestamp', 0))
+
+    def close(self):
+        for key in list(self.columns.keys()):
+            self.__close_columns(*key)
+
+    def __get_columns(self, coin, currency):
+        key = (coin, currency)
+        if key not in self.columns:
+            timestamps_file_name = self.__get_column_file_name(
+                coin, currency, self.TIMESTAMPS_FILE_EXTENSION)
+            prices_file_name = self.__get_column_file_name(
+                coin, currency, self.PRICES_FILE_EXTENSION)
+
+            # Both columns are written separately, so only use complete points
+            count = min(self.__get_file_size(timestamps_file_name),
+                        self.__get_file_size(prices_file_name)) // 8
+
+            self.columns[key] = (
+                self.__map_column(timestamps_file_name, count, 'q'),
+                self.__map_column(prices_file_name, count, 'd'))
+        timestamps, prices = self.columns[key]
+        return timestamps[1], prices[1]
+
+    def __map_column(self, file_name, count, type_code):
+        if not os.path.exists(file_name):
+            open(file_name, 'wb').close()
+        if count == 0:
+            return (None, memoryview(b'').cast(type_code))
+        with open(file_name, 'rb') as f:
+            m = mmap.mmap(f.fileno(), count * 8, access=mmap.ACCESS_READ)
+        return (m, memoryview(m).cast(type_code))
+
+    def __get_file_size(self, file_name):
+        return os.path.getsize(file_name) if os.path.exists(file_name) else 0
+
+    def __close_columns(self, coin, currency):
+        columns = self.columns.pop((coin, currency), None)
+        if columns is None:
+            return
+        for m, view in columns:
+            view.release()
+            if m is not None:
+                m.close()
+
+    def __get_column_file_name(self, coin, currency, extension):
+        return self.__get_file_name(f'{coin}_{currency}.{extension}')
+
+    def __get_file_name(self, file_name):
+        return f'{self.directory}/{file_name}'
+
+    def __read_meta(self):
+        try:
+            with open(self.__get_file_name(self.META_FILE_NAME)) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
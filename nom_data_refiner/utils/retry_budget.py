@@ -0,0 +1,35 @@
+import collections
+import time
+
+
+class RetryBudget(object):
+    # Limits the retries to a share of the requests in a sliding window, so
+    # retries can't multiply the load on an upstream that is struggling. A
+    # minimum number of retries per window is always allowed, so hosts with
+    # few requests can still retry.
+
+    def __init__(self, ratio, min_retries, window):
+        self.ratio = ratio
+        self.min_retries = min_retries
+        self.window = window
+        self.requests = collections.deque()
+        self.retries = collections.deque()
+
+    def add_request(self):
+        now = time.monotonic()
+        self.requests.append(now)
+        self.__expire(now)
+
+    def try_retry(self):
+        # Returns whether a retry is allowed and takes it from the budget if so
+        now = time.monotonic()
+        self.__expire(now)
+        if len(self.retries) >= max(self.min_retries, len(self.requests) * self.ratio):
+            return False
+        self.retries.append(now)
+        return True
+
+    def __expire(self, now):
+        for timestamps in (self.requests, self.retries):
+            while len(timestamps) > 0 and timestamps[0] < now - self.window:
+                timestamps.popleft()
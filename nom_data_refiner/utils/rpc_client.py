@@ -0,0 +1,137 @@
+import asyncio
+import collections
+import itertools
+import math
+import time
+from utils.node_pool import NodePool
+from utils.metrics import Metrics
+
+
+class RpcClient(object):
+
+    # Largest page size accepted by the node
+    MAX_PAGE_SIZE = 1024
+
+    # Number of pages requested at the same time when paging through a list
+    MAX_PAGES_IN_FLIGHT = 4
+
+    def __init__(self, node_urls):
+        # Requests are sent through a pool of one or more node endpoints
+        self.node_urls = [node_urls] if isinstance(
+            node_urls, str) else list(node_urls)
+        self.node_pool = NodePool(self.node_urls)
+        self.batch_supported = True
+        self.ids = itertools.count(1)
+        self.pending = []
+        self.flush_task = None
+
+    async def call(self, method, params=[]):
+        # Calls made in the same event loop iteration are queued and sent
+        # together as one JSON-RPC 2.0 batch.
+        start = time.perf_counter()
+        future = asyncio.get_running_loop().create_future()
+        self.pending.append((self.__create_request(method, params), future))
+        if self.flush_task is None:
+            self.flush_task = asyncio.ensure_future(self.__flush())
+        try:
+            r = await future
+        except Exception:
+            Metrics.inc('rpc_errors_total', method=method)
+            raise
+        finally:
+            Metrics.observe('rpc_request_duration_seconds',
+                            time.perf_counter() - start, method=method)
+        if not r or 'error' in r:
+            Metrics.inc('rpc_errors_total', method=method)
+        return r
+
+    async def get_all_pages(self, method, params=[], page_size=MAX_PAGE_SIZE):
+        # Yields the result of each page in order. The first page tells the
+        # total count, the remaining pages are then requested concurrently,
+        # with a bounded number of pages in flight.
+        r = await self.call(method, params + [0, page_size])
+        result = r['result']
+        page_count = math.ceil(result['count'] / page_size)
+        yield result
+
+        pages = collections.deque()
+        next_page_index = 1
+        try:
+            while next_page_index < page_count or len(pages) > 0:
+                while next_page_index < page_count and len(pages) < self.MAX_PAGES_IN_FLIGHT:
+                    pages.append(asyncio.ensure_future(
+                        self.call(method, params + [next_page_index, page_size])))
+                    next_page_index = next_page_index + 1
+                r = await pages.popleft()
+                yield r['result']
+        finally:
+            for page in pages:
+                page.cancel()
+
+    def __create_request(self, method, params):
+        return {'jsonrpc': '2.0', 'id': next(self.ids),
+                'method': method, 'params': params}
+
+    async def __flush(self):
+        # Yield to the event loop until no more calls are being queued
+        count = -1
+        while count != len(self.pending):
+            count = len(self.pending)
+            await asyncio.sleep(0)
+
+        batch = self.pending
+        self.pending = []
+        self.flush_task = None
+
+        try:
+            await self.__send(batch)
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+
+    async def __send(self, batch):
+        if len(batch) == 1 or not self.batch_supported:
+            await self.__send_individually(batch)
+            return
+
+        r = await self.node_pool.post([request for request, _ in batch])
+
+        # Nodes that do not support batches answer with a single error object.
+        # Anything else that is not a list is a transport failure, which is
+        # not retried call by call.
+        if not isinstance(r, list):
+            if isinstance(r, dict) and 'error' in r:
+                print('Node rejected batch request, using individual requests')
+                self.batch_supported = False
+                await self.__send_individually(batch)
+                return
+            for _, future in batch:
+                if not future.done():
+                    future.set_result({})
+            return
+
+        # Match the responses to the requests by id
+        responses = {}
+        for response in r:
+            if isinstance(response, dict) and 'id' in response:
+                responses[response['id']] = response
+
+        missing = []
+        for request, future in batch:
+            if future.done():
+                continue
+            if request['id'] in responses:
+                future.set_result(responses[request['id']])
+            else:
+                missing.append((request, future))
+
+        if len(missing) > 0:
+            await self.__send_individually(missing)
+
+    async def __send_individually(self, batch):
+        responses = await asyncio.gather(
+            *[self.node_pool.post(request) for request, _ in batch])
+        for (_, future), response in zip(batch, responses):
+            if not future.done():
+                future.set_result(response)
@@ -0,0 +1,42 @@
+import asyncio
+import random
+import time
+from utils.metrics import Metrics
+
+
+class Scheduler(object):
+    # Runs each added task as an independent loop on its own interval. The
+    # intervals are jittered so the tasks don't line up, and a failing task
+    # is retried with exponential backoff.
+
+    DEFAULT_JITTER = 0.1
+
+    def __init__(self):
+        self.tasks = []
+
+    def add(self, name, fn, interval, jitter=DEFAULT_JITTER, max_backoff=None):
+        # fn is a coroutine function. It fails by raising an exception.
+        max_backoff = interval * 16 if max_backoff is None else max_backoff
+        self.tasks.append((name, fn, interval, jitter, max_backoff))
+
+    async def run(self):
+        await asyncio.gather(*[self.__run_task(*task) for task in self.tasks])
+
+    async def __run_task(self, name, fn, interval, jitter, max_backoff):
+        failures = 0
+        while True:
+            start = time.monotonic()
+            try:
+                await fn()
+                failures = 0
+                delay = interval
+            except Exception as e:
+                Metrics.inc('task_failures_total', task=name)
+                failures = failures + 1
+                delay = min(interval * 2 ** failures, max(interval, max_backoff))
+                print(f'{name} failed: {str(e)}. Retrying in {delay:.0f}s')
+            Metrics.observe('task_duration_seconds',
+                            time.monotonic() - start, task=name)
+
+            delay = delay * (1 + random.uniform(-jitter, jitter))
+            await asyncio.sleep(max(0, delay - (time.monotonic() - start)))
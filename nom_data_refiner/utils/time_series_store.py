@@ -0,0 +1,375 @@
+import collections
+import datetime
+import json
+import os
+
+
+class TimeSeriesSegment(object):
+    # Decoded frames of a segment file. A frame is a timestamp with the values
+    # of the series that changed since the previous frame of the segment:
+    #
+    #   varint  timestamp delta to the previous frame (to the segment start for the first frame)
+    #   varint  number of entries
+    #   entries varint (series id << 1 | removed flag), followed by a
+    #           zigzag varint of the fixed-point value delta unless removed
+    #
+    # The values of a series carry forward until it changes or is removed.
+
+    def __init__(self, start_timestamp):
+        self.start_timestamp = start_timestamp
+        self.timestamps = []
+        self.points = collections.defaultdict(list)
+        self.values = {}
+        self.size = 0
+
+    def decode(self, data):
+        # Truncated frames at the end of the data are left out
+        offset = 0
+        timestamp = self.start_timestamp
+        try:
+            while offset < len(data):
+                delta, offset = read_varint(data, offset)
+                count, offset = read_varint(data, offset)
+                entries = []
+                for _ in range(count):
+                    key, offset = read_varint(data, offset)
+                    if key & 1:
+                        entries.append((key >> 1, None))
+                    else:
+                        value_delta, offset = read_varint(data, offset)
+                        entries.append((key >> 1, unzigzag(value_delta)))
+                timestamp = timestamp + delta
+                self.__add_frame(timestamp, entries)
+                self.size = offset
+        except IndexError:
+            pass
+
+    def encode_frame(self, timestamp, values):
+        # Returns the encoded frame of the values and adds it to the segment
+        previous_timestamp = self.timestamps[-1] if len(
+            self.timestamps) > 0 else self.start_timestamp
+        entries = []
+        for series_id, value in values.items():
+            if self.values.get(series_id) != value:
+                entries.append((series_id, value - self.values.get(series_id, 0)))
+        for series_id in self.values:
+            if series_id not in values:
+                entries.append((series_id, None))
+
+        frame = bytearray()
+        write_varint(frame, timestamp - previous_timestamp)
+        write_varint(frame, len(entries))
+        for series_id, value_delta in entries:
+            if value_delta is None:
+                write_varint(frame, series_id << 1 | 1)
+            else:
+                write_varint(frame, series_id << 1)
+                write_varint(frame, zigzag(value_delta))
+
+        self.__add_frame(timestamp, entries)
+        self.size = self.size + len(frame)
+        return bytes(frame)
+
+    def get_points(self, series_id, start_timestamp, end_timestamp):
+        # Returns the [timestamp, fixed-point value] of every frame with start <= timestamp < end
+        # in which the series has a value
+        points = []
+        changes = self.points.get(series_id, [])
+        for i, (frame_index, value) in enumerate(changes):
+            next_frame_index = changes[i + 1][0] if i + \
+                1 < len(changes) else len(self.timestamps)
+            if value is None:
+                continue
+            for j in range(frame_index, next_frame_index):
+                if start_timestamp <= self.timestamps[j] < end_timestamp:
+                    points.append([self.timestamps[j], value])
+        return points
+
+    def get_rollup(self, resolution):
+        # Returns the frames of the bucket averages as (bucket timestamp, {series id: value})
+        buckets = []
+        for i, timestamp in enumerate(self.timestamps):
+            bucket_timestamp = timestamp - (timestamp - self.start_timestamp) % resolution
+            if len(buckets) == 0 or buckets[-1][0] != bucket_timestamp:
+                buckets.append([bucket_timestamp, i, i + 1])
+            else:
+                buckets[-1][2] = i + 1
+
+        # Average the values of each series over the frames of each bucket
+        sums = [collections.defaultdict(int) for _ in buckets]
+        counts = [collections.defaultdict(int) for _ in buckets]
+        for series_id, changes in self.points.items():
+            bucket_index = 0
+            for i, (frame_index, value) in enumerate(changes):
+                next_frame_index = changes[i + 1][0] if i + \
+                    1 < len(changes) else len(self.timestamps)
+                if value is None:
+                    continue
+                while buckets[bucket_index][2] <= frame_index:
+                    bucket_index = bucket_index + 1
+                j = bucket_index
+                while j < len(buckets) and buckets[j][1] < next_frame_index:
+                    overlap = min(next_frame_index, buckets[j][2]) - \
+                        max(frame_index, buckets[j][1])
+                    sums[j][series_id] = sums[j][series_id] + value * overlap
+                    counts[j][series_id] = counts[j][series_id] + overlap
+                    j = j + 1
+                bucket_index = j - 1
+
+        return [(bucket[0], {series_id: round(sums[i][series_id] / counts[i][series_id]) for series_id in sums[i]})
+                for i, bucket in enumerate(buckets)]
+
+    def __add_frame(self, timestamp, entries):
+        frame_index = len(self.timestamps)
+        self.timestamps.append(timestamp)
+        for series_id, value_delta in entries:
+            if value_delta is None:
+                self.values.pop(series_id, None)
+                self.points[series_id].append((frame_index, None))
+            else:
+                value = self.values.get(series_id, 0) + value_delta
+                self.values[series_id] = value
+                self.points[series_id].append((frame_index, value))
+
+
+class TimeSeriesStore(object):
+    # Append-only store for numeric time series. Samples are appended to one
+    # raw segment file per UTC day. Values are stored as fixed-point integers
+    # with a precision of 1 / VALUE_SCALE and only changes are written,
+    # delta and varint encoded. Once a day is over its segment is downsampled
+    # into hourly and daily rollup segments, and raw segments are deleted
+    # after the raw retention. Range queries read the coarsest resolution
+    # that still gives enough points for the requested span.
+
+    VALUE_SCALE = 1000000
+    SECONDS_PER_DAY = 86400
+
+    RAW_DIRECTORY = 'raw'
+    ROLLUP_RESOLUTIONS = (3600, 86400)
+    SERIES_FILE_NAME = 'series.json'
+    SEGMENT_FILE_EXTENSION = 'seg'
+
+    # Days raw segments are kept
+    DEFAULT_RAW_RETENTION_DAYS = 7
+
+    # Longest spans in seconds that are queried from the raw and the hourly segments
+    MAX_RAW_QUERY_SPAN = 2 * 86400
+    MAX_HOURLY_QUERY_SPAN = 90 * 86400
+
+    # Number of decoded closed segments kept in memory
+    MAX_CACHED_SEGMENTS = 64
+
+    def __init__(self, directory, raw_retention_days=DEFAULT_RAW_RETENTION_DAYS):
+        self.directory = directory
+        self.raw_retention_days = raw_retention_days
+        self.series = {}
+        self.segment = None
+        self.segments = collections.OrderedDict()
+
+        # Start timestamps of the first and the last day with a segment, queries are limited to these days
+        self.first_day_start = None
+        self.last_day_start = None
+        for resolution in (self.RAW_DIRECTORY,) + self.ROLLUP_RESOLUTIONS:
+            os.makedirs(f'{directory}/{resolution}', exist_ok=True)
+            for file_name in os.listdir(f'{directory}/{resolution}'):
+                self.__add_day(self.__get_segment_day_start(file_name))
+        self.__read_series()
+
+    def append(self, timestamp, values):
+        # Appends the values ({series name: number}) sampled at the timestamp in seconds
+        timestamp = int(timestamp)
+        day_start = timestamp - timestamp % self.SECONDS_PER_DAY
+        if self.segment is None or self.segment.start_timestamp != day_start:
+            self.__open_segment(day_start)
+            self.__add_day(day_start)
+        if len(self.segment.timestamps) > 0 and timestamp < self.segment.timestamps[-1]:
+            return
+
+        # New series are written to the series file once, before the frame that uses them
+        series_count = len(self.series)
+        scaled_values = {self.__get_series_id(name): round(value * self.VALUE_SCALE)
+                         for name, value in values.items() if value is not None}
+        if len(self.series) != series_count:
+            self.__write_series()
+
+        frame = self.segment.encode_frame(timestamp, scaled_values)
+        with open(self.__get_segment_file_name(self.RAW_DIRECTORY, day_start), 'ab') as f:
+            f.write(frame)
+
+    def get_series_names(self, prefix=''):
+        return [name for name in self.series if name.startswith(prefix)]
+
+    def get_range(self, name, start_timestamp, end_timestamp, resolution=None):
+        # Returns the [timestamp, value] points with start <= timestamp < end.
+        # Without a resolution the resolution is chosen based on the span.
+        # The span is limited to the days that have segments.
+        series_id = self.series.get(name)
+        if series_id is None or self.first_day_start is None:
+            return []
+        start_timestamp = max(start_timestamp, self.first_day_start)
+        end_timestamp = min(end_timestamp, self.last_day_start + self.SECONDS_PER_DAY)
+        if start_timestamp >= end_timestamp:
+            return []
+        if resolution is None:
+            resolution = self.get_resolution(end_timestamp - start_timestamp)
+
+        points = []
+        day_start = start_timestamp - start_timestamp % self.SECONDS_PER_DAY
+        while day_start < end_timestamp:
+            segment = self.__get_segment(resolution, day_start)
+            if segment is not None:
+                points.extend([[timestamp, value / self.VALUE_SCALE] for timestamp, value in segment.get_points(
+                    series_id, start_timestamp, end_timestamp)])
+            day_start = day_start + self.SECONDS_PER_DAY
+        return points
+
+    def get_resolution(self, span):
+        if span <= self.MAX_RAW_QUERY_SPAN:
+            return self.RAW_DIRECTORY
+        if span <= self.MAX_HOURLY_QUERY_SPAN:
+            return self.ROLLUP_RESOLUTIONS[0]
+        return self.ROLLUP_RESOLUTIONS[1]
+
+    def __add_day(self, day_start):
+        if day_start is None:
+            return
+        if self.first_day_start is None or day_start < self.first_day_start:
+            self.first_day_start = day_start
+        if self.last_day_start is None or day_start > self.last_day_start:
+            self.last_day_start = day_start
+
+    def __open_segment(self, day_start):
+        self.segment = self.__read_segment(self.RAW_DIRECTORY, day_start)
+
+        # Cut off a partially written frame
+        file_name = self.__get_segment_file_name(self.RAW_DIRECTORY, day_start)
+        if os.path.exists(file_name) and os.path.getsize(file_name) != self.segment.size:
+            with open(file_name, 'r+b') as f:
+                f.truncate(self.segment.size)
+
+        self.__close_days(day_start)
+
+    def __close_days(self, current_day_start):
+        # Roll up the raw segments of past days and delete expired raw segments
+        for file_name in sorted(os.listdir(f'{self.directory}/{self.RAW_DIRECTORY}')):
+            day_start = self.__get_segment_day_start(file_name)
+            if day_start is None or day_start >= current_day_start:
+                continue
+            for resolution in self.ROLLUP_RESOLUTIONS:
+                if not os.path.exists(self.__get_segment_file_name(resolution, day_start)):
+                    self.__write_rollup(resolution, day_start)
+            if day_start < current_day_start - self.raw_retention_days * self.SECONDS_PER_DAY:
+                os.remove(self.__get_segment_file_name(
+                    self.RAW_DIRECTORY, day_start))
+
+    def __create_rollup(self, raw_segment, resolution):
+        # Returns the rollup segment of a raw segment and its encoded data
+        segment = TimeSeriesSegment(raw_segment.start_timestamp)
+        data = bytearray()
+        for timestamp, values in raw_segment.get_rollup(resolution):
+            data.extend(segment.encode_frame(timestamp, values))
+        return segment, data
+
+    def __write_rollup(self, resolution, day_start):
+        _, data = self.__create_rollup(
+            self.__read_segment(self.RAW_DIRECTORY, day_start), resolution)
+
+        file_name = self.__get_segment_file_name(resolution, day_start)
+        with open(f'{file_name}.tmp', 'wb') as f:
+            f.write(data)
+        os.replace(f'{file_name}.tmp', file_name)
+
+    def __get_segment(self, resolution, day_start):
+        # The open day is rolled up on the fly
+        if self.segment is not None and day_start == self.segment.start_timestamp:
+            if resolution == self.RAW_DIRECTORY:
+                return self.segment
+            return self.__create_rollup(self.segment, resolution)[0]
+
+        key = (resolution, day_start)
+        if key in self.segments:
+            self.segments.move_to_end(key)
+            return self.segments[key]
+
+        if not os.path.exists(self.__get_segment_file_name(resolution, day_start)):
+            if resolution == self.RAW_DIRECTORY or not os.path.exists(self.__get_segment_file_name(self.RAW_DIRECTORY, day_start)):
+                return None
+            # Before the first append after a restart the latest day may still get samples,
+            # so it is rolled up on the fly and its rollups are only written once it is closed
+            if day_start >= self.last_day_start:
+                return self.__create_rollup(self.__read_segment(self.RAW_DIRECTORY, day_start), resolution)[0]
+            self.__write_rollup(resolution, day_start)
+
+        segment = self.__read_segment(resolution, day_start)
+        self.segments[key] = segment
+        if len(self.segments) > self.MAX_CACHED_SEGMENTS:
+            self.segments.popitem(last=False)
+        return segment
+
+    def __read_segment(self, resolution, day_start):
+        segment = TimeSeriesSegment(day_start)
+        file_name = self.__get_segment_file_name(resolution, day_start)
+        if os.path.exists(file_name):
+            with open(file_name, 'rb') as f:
+                segment.decode(f.read())
+        return segment
+
+    def __get_series_id(self, name):
+        series_id = self.series.get(name)
+        if series_id is None:
+            series_id = len(self.series)
+            self.series[name] = series_id
+        return series_id
+
+    def __read_series(self):
+        try:
+            with open(f'{self.directory}/{self.SERIES_FILE_NAME}') as f:
+                self.series = json.load(f)
+        except (OSError, ValueError):
+            self.series = {}
+
+    def __write_series(self):
+        file_name = f'{self.directory}/{self.SERIES_FILE_NAME}'
+        with open(f'{file_name}.tmp', 'w') as f:
+            json.dump(self.series, f)
+        os.replace(f'{file_name}.tmp', file_name)
+
+    def __get_segment_file_name(self, resolution, day_start):
+        day = datetime.datetime.fromtimestamp(
+            day_start, datetime.timezone.utc).strftime('%Y-%m-%d')
+        return f'{self.directory}/{resolution}/{day}.{self.SEGMENT_FILE_EXTENSION}'
+
+    def __get_segment_day_start(self, file_name):
+        try:
+            day = datetime.datetime.strptime(
+                file_name, f'%Y-%m-%d.{self.SEGMENT_FILE_EXTENSION}')
+        except ValueError:
+            return None
+        return int(day.replace(tzinfo=datetime.timezone.utc).timestamp())
+
+
+def zigzag(value):
+    return value << 1 if value >= 0 else (-value << 1) - 1
+
+
+def unzigzag(value):
+    return value >> 1 if value & 1 == 0 else -((value + 1) >> 1)
+
+
+def write_varint(buffer, value):
+    while value >= 0x80:
+        buffer.append(value & 0x7f | 0x80)
+        value = value >> 7
+    buffer.append(value)
+
+
+def read_varint(data, offset):
+    value = 0
+    shift = 0
+    while True:
+        byte = data[offset]
+        offset = offset + 1
+        value = value | (byte & 0x7f) << shift
+        if byte < 0x80:
+            return value, offset
+        shift = shift + 7
@@ -1,12 +1,27 @@
 import math
-import json
-import time
 
+from collections import namedtuple
 from datetime import datetime, timezone, timedelta
 from utils.http_wrapper import HttpWrapper
 
 
+# Immutable result of a pool update
+ZnnEthUniswapPoolSnapshot = namedtuple('ZnnEthUniswapPoolSnapshot', [
+    'wznn_reserve',
+    'weth_reserve',
+    'wznn_price_usd',
+    'weth_price_usd',
+    'liquidity_usd',
+    'weekly_volume_usd',
+    'yearly_trading_fees_usd',
+    'impermanent_loss',
+    'lp_token_total_supply'])
+
+
 class ZnnEthUniswapPool(object):
+    # The pool data is only read through the snapshots returned by the
+    # updates. An update fetches everything before it changes any state, so
+    # a snapshot never mixes new and old data.
 
     # Constants
     BITQUERY_API_URL = 'https://graphql.bitquery.io'
@@ -18,53 +33,65 @@ class ZnnEthUniswapPool(object):
     POOL_REWARD_FEE_SHARE = 0.003
     MOVING_AVERAGE_LENGTH_IN_DAYS = 7
     DAYS_PER_YEAR = 12 * 30
+    CACHE_TTL = 590
+
+    def __init__(self):
+        self.wznn_reserve = 0
+        self.weth_reserve = 0
+        self.wznn_price_usd = 0
+        self.weth_price_usd = 0
+        self.liquidity_usd = 0
+        self.weekly_volume_usd = 0
+        self.yearly_trading_fees_usd = 0
+        self.impermanent_loss = 0
+        self.lp_token_total_supply = 0
+
+        self.bitquery_api_key = ''
+        self.ether_scan_api_key = ''
+
+        self.cache = None
+
+        # Result of the latest update
+        self.snapshot = self.__create_snapshot()
+
+    async def update(self, cache, znn_price_usd, eth_price_usd, bitquery_api_key, ether_scan_api_key):
+        # Returns the snapshot of the results
+        self.cache = cache
+        self.bitquery_api_key = bitquery_api_key
+        self.ether_scan_api_key = ether_scan_api_key
+        r_pool_balances = await self.cache.get_or_refresh('pool_balances', self.CACHE_TTL, self.__fetch_pool_balances)
+        r_lp_token_supply = await self.cache.get_or_refresh('lp_token_supply', self.CACHE_TTL, self.__fetch_lp_token_supply)
+        r_pool_data = await self.cache.get_or_refresh('znn_eth_pool_data', self.CACHE_TTL, self.__fetch_pool_data)
 
-    wznn_reserve = 0
-    weth_reserve = 0
-    wznn_price_usd = 0
-    weth_price_usd = 0
-    liquidity_usd = 0
-    weekly_volume_usd = 0
-    yearly_trading_fees_usd = 0
-    impermanent_loss = 0
-    lp_token_total_supply = 0
+        # Apply the results at once
+        self.wznn_price_usd = znn_price_usd
+        self.weth_price_usd = eth_price_usd
+        self.__update_pool_balances(r_pool_balances)
+        self.__update_lp_token_supply(r_lp_token_supply)
+        self.__update_pool_data(r_pool_data)
+        self.snapshot = self.__create_snapshot()
+        return self.snapshot
+
+    def update_prices(self, znn_price_usd, eth_price_usd):
+        # Returns the snapshot of the results
+        self.wznn_price_usd = znn_price_usd
+        self.weth_price_usd = eth_price_usd
+        self.liquidity_usd = self.wznn_reserve * self.wznn_price_usd + \
+            self.weth_reserve * self.weth_price_usd
+        self.snapshot = self.__create_snapshot()
+        return self.snapshot
 
-    bitquery_api_key = ''
-    ether_scan_api_key = ''
+    def __create_snapshot(self):
+        return ZnnEthUniswapPoolSnapshot(**{field: getattr(self, field)
+                                            for field in ZnnEthUniswapPoolSnapshot._fields})
 
-    data_store_dir = ''
+    def __update_pool_balances(self, r):
+        if r is None:
+            print('Error: __update_pool_balances')
+            return
 
-    async def update(self, data_store_dir, znn_price_usd, eth_price_usd, bitquery_api_key, ether_scan_api_key):
-        self.data_store_dir = data_store_dir
-        self.wznn_price_usd = znn_price_usd
-        self.weth_price_usd = eth_price_usd
-        self.bitquery_api_key = bitquery_api_key
-        self.ether_scan_api_key = ether_scan_api_key
-        await self.__update_pool_balances()
-        await self.__update_lp_token_supply()
-        await self.__update_pool_data()
-
-    async def __update_pool_balances(self):
-        file = f'{self.data_store_dir}/pool_balances_cache.json'
-        r = self.__read_file(file)
-        timestamp = math.trunc(time.time())
-
-        if r is None or len(r['weth_data']) == 0 or len(r['wznn_data']) == 0 or r['timestamp'] + 590 < timestamp:
-            r_weth = await HttpWrapper.get(f'{self.ETHER_SCAN_API_URL}?module=account&action=tokenbalance&contractaddress={self.WETH_ADDRESS}&address={self.POOL_ADDRESS}&tag=latest&apikey={self.ether_scan_api_key}')
-            r_wznn = await HttpWrapper.get(f'{self.ETHER_SCAN_API_URL}?module=account&action=tokenbalance&contractaddress={self.WZNN_ADDRESS}&address={self.POOL_ADDRESS}&tag=latest&apikey={self.ether_scan_api_key}')
-
-            if 'result' in r_weth and 'result' in r_wznn:
-                self.__write_to_file_as_json(
-                    {'weth_data': r_weth, 'wznn_data': r_wznn, 'timestamp': timestamp}, file)
-                print('Refreshed pool balances data')
-            else:
-                r_weth = r['weth_data']
-                r_wznn = r['wznn_data']
-                print('Refresh failed. Used pool balances cache')
-        else:
-            r_weth = r['weth_data']
-            r_wznn = r['wznn_data']
-            print('Used pool balances cache')
+        r_weth = r['weth_data']
+        r_wznn = r['wznn_data']
 
         try:
             self.weth_reserve = float(r_weth['result']) / 1000000000000000000
@@ -75,24 +102,19 @@ class ZnnEthUniswapPool(object):
         except KeyError:
             print('Error: __update_pool_balances')
 
-    async def __update_lp_token_supply(self):
-        file = f'{self.data_store_dir}/lp_token_supply_cache.json'
-        r = self.__read_file(file)
-        timestamp = math.trunc(time.time())
-
-        if r is None or len(r['data']) == 0 or r['timestamp'] + 590 < timestamp:
-            r = await HttpWrapper.get(f'{self.ETHER_SCAN_API_URL}?module=stats&action=tokensupply&contractaddress={self.POOL_ADDRESS}&apikey={self.ether_scan_api_key}')
-
-            if 'result' in r:
-                self.__write_to_file_as_json(
-                    {'data': r, 'timestamp': timestamp}, file)
-                print('Refreshed LP token supply data')
-            else:
-                r = r['data']
-                print('Refresh failed. Used LP supply cache')
-        else:
-            r = r['data']
-            print('Used LP token supply cache')
+    async def __fetch_pool_balances(self):
+        r_weth = await HttpWrapper.get(f'{self.ETHER_SCAN_API_URL}?module=account&action=tokenbalance&contractaddress={self.WETH_ADDRESS}&address={self.POOL_ADDRESS}&tag=latest&apikey={self.ether_scan_api_key}')
+        r_wznn = await HttpWrapper.get(f'{self.ETHER_SCAN_API_URL}?module=account&action=tokenbalance&contractaddress={self.WZNN_ADDRESS}&address={self.POOL_ADDRESS}&tag=latest&apikey={self.ether_scan_api_key}')
+
+        if 'result' in r_weth and 'result' in r_wznn:
+            print('Refreshed pool balances data')
+            return {'weth_data': r_weth, 'wznn_data': r_wznn}
+        return None
+
+    def __update_lp_token_supply(self, r):
+        if r is None:
+            print('Error: __update_lp_token_supply')
+            return
 
         try:
             self.lp_token_total_supply = float(
@@ -100,47 +122,18 @@ class ZnnEthUniswapPool(object):
         except KeyError:
             print('Error: __update_lp_token_supply')
 
-    async def __update_pool_data(self):
-        now = datetime.now(timezone.utc)
-        week_ago = now - timedelta(days=self.MOVING_AVERAGE_LENGTH_IN_DAYS)
-        week_ago = week_ago.strftime('%Y-%m-%dT%H:%M:%SZ')
-
-        trades_query_params = f'dexTrades(options: {{ desc: "date.date" }} time: {{ since: "{week_ago}" }} smartContractAddress: {{ is: "{self.POOL_ADDRESS}" }})'
-        trades_query_subfields = '{ date { date(format: "%y-%m-%d") } tradeAmount(in:USD) }'
-        balances_query_params = f'address(address: {{ is: "{self.POOL_ADDRESS}" }} )'
-        balances_query_subfields = '{ balances { currency { symbol } value } }'
-        start_reserves_query_params = f'startReserves: smartContractEvents(smartContractAddress: {{ is: "{self.POOL_ADDRESS}" }}  options: {{ limit: 1, asc: "block.height" }} smartContractEvent: {{ is: "Sync" }} time: {{ since: "{week_ago}" }} )'
-        start_reserves_query_subfields = '{ arguments { value argument } block { height } }'
-        end_reserves_query_params = f'endReserves: smartContractEvents(smartContractAddress: {{ is: "{self.POOL_ADDRESS}" }}  options: {{ limit: 1, desc: "block.height" }} smartContractEvent: {{ is: "Sync" }} )'
-        end_reserves_query_subfields = '{ arguments { value argument } block { height } }'
+    async def __fetch_lp_token_supply(self):
+        r = await HttpWrapper.get(f'{self.ETHER_SCAN_API_URL}?module=stats&action=tokensupply&contractaddress={self.POOL_ADDRESS}&apikey={self.ether_scan_api_key}')
 
-        body = {
-            'query': '{ ethereum(network: ethereum) {' + trades_query_params + ' ' + trades_query_subfields + ' '
-            + balances_query_params + ' ' + balances_query_subfields
-            + start_reserves_query_params + ' ' + start_reserves_query_subfields
-            + end_reserves_query_params + ' ' + end_reserves_query_subfields
-            + '} }'}
+        if 'result' in r:
+            print('Refreshed LP token supply data')
+            return r
+        return None
 
-        file = f'{self.data_store_dir}/znn_eth_pool_data_cache.json'
-        data = self.__read_file(file)
-        timestamp = math.trunc(time.time())
-
-        if data is None or data['timestamp'] + 590 < timestamp:
-            r = await HttpWrapper.post(self.BITQUERY_API_URL, body, headers={
-                'Content-type': 'application/json',
-                'X-API-KEY': self.bitquery_api_key
-            })
-            if 'data' in r:
-                self.__write_to_file_as_json(
-                    {'data': r, 'timestamp': timestamp}, file)
-                print('Refreshed pool data')
-                data = r
-            else:
-                data = data['data']
-                print('Refresh failed. Used pool data cache')
-        else:
-            data = data['data']
-            print('Used pool data cache')
+    def __update_pool_data(self, data):
+        if data is None:
+            print('Error: __update_pool_data')
+            return
 
         try:
             self.weekly_volume_usd = 0
@@ -166,6 +159,36 @@ class ZnnEthUniswapPool(object):
         except KeyError:
             print('Error: __update_pool_data')
 
+    async def __fetch_pool_data(self):
+        now = datetime.now(timezone.utc)
+        week_ago = now - timedelta(days=self.MOVING_AVERAGE_LENGTH_IN_DAYS)
+        week_ago = week_ago.strftime('%Y-%m-%dT%H:%M:%SZ')
+
+        trades_query_params = f'dexTrades(options: {{ desc: "date.date" }} time: {{ since: "{week_ago}" }} smartContractAddress: {{ is: "{self.POOL_ADDRESS}" }})'
+        trades_query_subfields = '{ date { date(format: "%y-%m-%d") } tradeAmount(in:USD) }'
+        balances_query_params = f'address(address: {{ is: "{self.POOL_ADDRESS}" }} )'
+        balances_query_subfields = '{ balances { currency { symbol } value } }'
+        start_reserves_query_params = f'startReserves: smartContractEvents(smartContractAddress: {{ is: "{self.POOL_ADDRESS}" }}  options: {{ limit: 1, asc: "block.height" }} smartContractEvent: {{ is: "Sync" }} time: {{ since: "{week_ago}" }} )'
+        start_reserves_query_subfields = '{ arguments { value argument } block { height } }'
+        end_reserves_query_params = f'endReserves: smartContractEvents(smartContractAddress: {{ is: "{self.POOL_ADDRESS}" }}  options: {{ limit: 1, desc: "block.height" }} smartContractEvent: {{ is: "Sync" }} )'
+        end_reserves_query_subfields = '{ arguments { value argument } block { height } }'
+
+        body = {
+            'query': '{ ethereum(network: ethereum) {' + trades_query_params + ' ' + trades_query_subfields + ' '
+            + balances_query_params + ' ' + balances_query_subfields
+            + start_reserves_query_params + ' ' + start_reserves_query_subfields
+            + end_reserves_query_params + ' ' + end_reserves_query_subfields
+            + '} }'}
+
+        r = await HttpWrapper.post(self.BITQUERY_API_URL, body, headers={
+            'Content-type': 'application/json',
+            'X-API-KEY': self.bitquery_api_key
+        })
+        if 'data' in r:
+            print('Refreshed pool data')
+            return r
+        return None
+
     def __calculate_impermanent_loss(self, token_reserve_start, base_reserve_start, token_reserve_end, base_reserve_end):
         end_price_ratio = base_reserve_end / token_reserve_end
         product_constant = base_reserve_start * token_reserve_start
@@ -175,16 +198,3 @@ class ZnnEthUniswapPool(object):
                        end_price_ratio) + math.sqrt(product_constant * end_price_ratio)
         impermanent_loss = (hold_strategy - lp_strategy) / hold_strategy * 100
         return impermanent_loss
-
-    def __read_file(self, file_name):
-        try:
-            f = open(file_name)
-            content = json.load(f)
-            f.close()
-            return content
-        except:
-            return None
-
-    def __write_to_file_as_json(self, data, file_name):
-        with open(file_name, 'w') as outfile:
-            json.dump(data, outfile, indent=4)